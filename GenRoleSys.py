@@ -1,16 +1,9 @@
 from typing import List, Dict, Any, Optional
 
-from langchain_core.messages import SystemMessage
 from pydantic import BaseModel, Field
-from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
-import logging
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
-from langchain_core.output_parsers import JsonOutputParser
+from tools.json_repair import aparse_llm_json, parse_llm_json
+from tools.retry_policy import acall_with_retries, call_with_retries
+from tools.prompt_registry import get_chat_prompt
 
 
 class RoleDefinition(BaseModel):
@@ -23,8 +16,19 @@ class RoleGenerator:
 
     def __init__(self, prompt_map: Dict[str, str]):
         self.prompt_map = prompt_map
-        self.parser = PydanticOutputParser(pydantic_object=List[RoleDefinition])
-        self.output_parser = JsonOutputParser()
+
+    def _build_messages(self, task: str):
+        chat_prompt = get_chat_prompt(self.prompt_map, "role_system", "{task}")
+
+        return chat_prompt.format_messages(task=task)
+
+    def _parse_response(self, response, llm) -> List[RoleDefinition]:
+        parsed_json = parse_llm_json(response, "role_system", llm)
+        return [RoleDefinition.model_validate(role_dict) for role_dict in parsed_json]
+
+    async def _aparse_response(self, response, llm) -> List[RoleDefinition]:
+        parsed_json = await aparse_llm_json(response, "role_system", llm)
+        return [RoleDefinition.model_validate(role_dict) for role_dict in parsed_json]
 
     def generate_roles(self, task: str) -> List[RoleDefinition]:
         """
@@ -36,38 +40,22 @@ class RoleGenerator:
         Returns:
             A list of structured role definitions.
         """
-        llm = get_llm_model()
-        system_prompt_str = self.prompt_map.get("role_system", "")
-
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessage(content=system_prompt_str),
-                HumanMessagePromptTemplate.from_template("{task}"),
-            ]
+        messages = self._build_messages(task)
+        return call_with_retries(
+            "role_system", lambda llm: llm.invoke(messages), self._parse_response, default=[]
         )
 
-        messages = chat_prompt.format_messages(task=task)
-
-        max_retries = 3
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                response = llm(messages)
-                parsed_json = self.output_parser.invoke(response)
-                role_definitions = [RoleDefinition(**role_dict) for role_dict in parsed_json]
-                return role_definitions
-
-            except Exception as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    logging.warning(f"Attempt {retry_count} failed: {e}. Retrying...")
-                else:
-                    logging.error(
-                        f"Failed to parse LLM response after {max_retries} attempts: {e}"
-                    )
-                    if "response" in locals():
-                        logging.error(
-                            f"Raw Response: {getattr(response, 'content', str(response))}"
-                        )
-                    return []
+    async def agenerate_roles(self, task: str) -> List[RoleDefinition]:
+        """
+        Async version of generate_roles, using ainvoke.
+
+        Args:
+            task: High-level task description.
+
+        Returns:
+            A list of structured role definitions.
+        """
+        messages = self._build_messages(task)
+        return await acall_with_retries(
+            "role_system", lambda llm: llm.ainvoke(messages), self._aparse_response, default=[]
+        )
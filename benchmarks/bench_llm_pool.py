@@ -0,0 +1,162 @@
+"""
+Per-call overhead of get_llm_model(): fresh client per call vs pooled client.
+
+A local OpenAI compatible stand-in server answers every chat completion
+immediately, so the measured time is the client side overhead (model
+construction, connection setup) plus a loopback round-trip.
+
+Usage:
+    python benchmarks/bench_llm_pool.py -n 200 -t 8
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "bench-model",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "ok"},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal /chat/completions endpoint with HTTP/1.1 keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StandInHandler.connections_lock:
+            StandInHandler.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_calls(get_model, calls: int, threads: int):
+    """
+    Invoke get_model() + one chat completion per call and time each call.
+
+    Returns:
+        List of per-call latencies in milliseconds
+    """
+    messages = [SystemMessage(content="bench"), HumanMessage(content="ping")]
+
+    def one_call(_):
+        start = time.perf_counter()
+        llm = get_model()
+        llm.invoke(messages)
+        return (time.perf_counter() - start) * 1000
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(one_call, range(calls)))
+
+
+def summarize(name: str, latencies, connections: int):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return {
+        "mode": name,
+        "calls": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(p95, 3),
+        "tcp_connections": connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM client pool benchmark")
+    parser.add_argument("-n", "--calls", type=int, default=200, help="calls per mode")
+    parser.add_argument("-t", "--threads", type=int, default=8, help="worker threads")
+    parser.add_argument("-o", "--output", type=str, help="write results as JSON")
+    args = parser.parse_args()
+
+    server = start_server()
+    os.environ["PROVIDER"] = "openai"
+    os.environ["MODEL_NAME"] = "bench-model"
+    os.environ["BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    os.environ["API_KEYS"] = "bench-key-1, bench-key-2, bench-key-3"
+
+    from tools import llm_generatory
+
+    provider = llm_generatory._get_provider()
+    model_name, base_url = llm_generatory._get_model_config(provider)
+    api_keys = llm_generatory._get_api_keys()
+
+    def fresh_client():
+        # Behaviour before pooling: a new model (and HTTP client) per call
+        return llm_generatory._create_client(
+            provider, model_name, base_url, api_keys[0]
+        )
+
+    def pooled_client():
+        return llm_generatory.get_pooled_client(
+            provider, model_name, base_url, api_keys[0]
+        )
+
+    results = []
+    for name, factory in (("fresh", fresh_client), ("pooled", pooled_client)):
+        # Warm up imports / pool outside the measurement
+        run_calls(factory, args.threads, args.threads)
+        StandInHandler.connections = 0
+        latencies = run_calls(factory, args.calls, args.threads)
+        results.append(summarize(name, latencies, StandInHandler.connections))
+
+    server.shutdown()
+
+    for row in results:
+        print(
+            f"{row['mode']:>7}: mean {row['mean_ms']:.3f} ms  p50 {row['p50_ms']:.3f} ms  "
+            f"p95 {row['p95_ms']:.3f} ms  connections {row['tcp_connections']}"
+        )
+    speedup = results[0]["mean_ms"] / results[1]["mean_ms"]
+    print(f"pooled per-call overhead is {speedup:.2f}x lower than fresh clients")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
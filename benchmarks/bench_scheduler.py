@@ -0,0 +1,451 @@
+"""
+Scheduler benchmark on synthetic task DAGs.
+
+Runs chains, wide fan-outs, diamonds and random layered graphs through
+TaskExecutor.execute_all, TaskJxExecutor.execute_all and
+sample.task.execute_tasks_parallel. Every node costs one fake LLM call with a
+fixed latency, so the wall-clock above the theoretical bound and the CPU time
+are overhead of the scheduler itself. Each run happens in its own process and
+is killed after --timeout seconds.
+
+Usage:
+    python benchmarks/bench_scheduler.py --sizes 10,100,1000 --latency 0.01
+    python benchmarks/bench_scheduler.py --baseline benchmarks/results/old.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).parent.parent
+sys.path.append(str(ROOT))
+
+os.environ.setdefault("PROVIDER", "mock")
+
+import task_exect
+from GenRoleSys import RoleDefinition
+from task_exect import TaskExecutor
+from task_jx import TaskDefinition
+from task_jx_excet import TaskJxExecutor
+from tools.task_splitter import TaskItem
+
+BENCH_ROLE = RoleDefinition(role_name="Bench Role", prompt_text="bench")
+
+
+# ----------------------------------------------------------------------
+# Synthetic DAGs: lists of {"id", "description", "dependsOn"}
+# ----------------------------------------------------------------------
+
+
+def _node(i: int, deps: List[int]) -> Dict[str, Any]:
+    return {
+        "id": str(i),
+        "description": f"bench task {i}",
+        "dependsOn": [str(d) for d in deps],
+    }
+
+
+def make_chain(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [_node(i, [i - 1] if i > 1 else []) for i in range(1, n + 1)]
+
+
+def make_fanout(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """One root, n - 2 independent children, one sink joining them."""
+    if n < 3:
+        return make_chain(n, rng)
+    nodes = [_node(1, [])]
+    nodes += [_node(i, [1]) for i in range(2, n)]
+    nodes.append(_node(n, list(range(2, n))))
+    return nodes
+
+
+def make_diamond(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Repeated diamonds (a -> b, c -> d) chained together."""
+    nodes = [_node(1, [])]
+    i = 1
+    while i + 3 <= n:
+        top = i
+        nodes.append(_node(i + 1, [top]))
+        nodes.append(_node(i + 2, [top]))
+        nodes.append(_node(i + 3, [i + 1, i + 2]))
+        i += 3
+    for j in range(i + 1, n + 1):
+        nodes.append(_node(j, [j - 1]))
+    return nodes
+
+
+def make_layered(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Random layered graph: ~sqrt(n) layers, each node depends on 1-3 nodes of the previous layer."""
+    width = max(1, int(n ** 0.5))
+    nodes = []
+    previous: List[int] = []
+    current: List[int] = []
+    for i in range(1, n + 1):
+        deps = rng.sample(previous, min(len(previous), rng.randint(1, 3))) if previous else []
+        nodes.append(_node(i, sorted(deps)))
+        current.append(i)
+        if len(current) == width:
+            previous, current = current, []
+    return nodes
+
+
+def make_skewed(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Independent leaves listed first, followed by one long chain (worst case for FIFO)."""
+    leaves = n // 2
+    nodes = [_node(i, []) for i in range(1, leaves + 1)]
+    nodes += [_node(i, [i - 1] if i > leaves + 1 else []) for i in range(leaves + 1, n + 1)]
+    return nodes
+
+
+SHAPES: Dict[str, Callable[[int, random.Random], List[Dict[str, Any]]]] = {
+    "chain": make_chain,
+    "fanout": make_fanout,
+    "diamond": make_diamond,
+    "layered": make_layered,
+    "skewed": make_skewed,
+}
+
+
+def critical_path_nodes(nodes: List[Dict[str, Any]]) -> int:
+    """Number of nodes on the longest dependency chain (nodes are topologically ordered)."""
+    depth: Dict[str, int] = {}
+    for node in nodes:
+        depth[node["id"]] = 1 + max((depth[d] for d in node["dependsOn"]), default=0)
+    return max(depth.values(), default=0)
+
+
+# ----------------------------------------------------------------------
+# Fake LLM and executor adapters
+# ----------------------------------------------------------------------
+
+
+class FakeLLM:
+    """Stand-in for a chat model: every call takes exactly `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return f"result of {prompt}"
+
+
+class FakeReducer:
+    """Replaces TaskReducer so a top-level node costs exactly one fake call."""
+
+    def __init__(self, task_description: str, dependency_results: str = "", subtask_results: str = ""):
+        self.task_description = task_description
+        self.stream_metrics = None
+
+    def process_task(self, writer=None) -> str:
+        return f"reduced {self.task_description}"
+
+
+class BenchTaskExecutor(TaskExecutor):
+    def __init__(self, tasks, max_workers, llm: FakeLLM):
+        super().__init__(tasks, max_workers, prompt_map={})
+        self.llm = llm
+
+    def _process_task(self, task_description, prompt_map=None, dependent_results=None, task_id=None):
+        self.llm.invoke(task_description)
+        return []
+
+
+class BenchTaskJxExecutor(TaskJxExecutor):
+    def __init__(self, tasks, max_workers, llm: FakeLLM):
+        super().__init__(
+            tasks, roles=[BENCH_ROLE], prompt_map={}, max_workers=max_workers, batch_formats=False
+        )
+        self.llm = llm
+
+    def process_task(self, task, role, dependency_results):
+        return {
+            "task_id": task.id,
+            "status": "completed",
+            "description": task.description,
+            "role_name": task.role_name,
+            "dependsOn": task.dependsOn,
+            "result": self.llm.invoke(task.description),
+        }
+
+
+@contextlib.contextmanager
+def patched(module, name: str, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def run_task_executor(nodes, workers: int, llm: FakeLLM):
+    tasks = [TaskItem(**node) for node in nodes]
+    with patched(task_exect, "TaskReducer", FakeReducer):
+        return BenchTaskExecutor(tasks, workers, llm).execute_all()
+
+
+def run_task_jx_executor(nodes, workers: int, llm: FakeLLM):
+    tasks = [TaskDefinition(role_name=BENCH_ROLE.role_name, **node) for node in nodes]
+    return BenchTaskJxExecutor(tasks, workers, llm).execute_all()
+
+
+def _load_sample_task():
+    spec = importlib.util.spec_from_file_location("sample_task", ROOT / "sample.task.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_sample_parallel(nodes, workers: int, llm: FakeLLM):
+    sample_task = _load_sample_task()
+    tasks = [dict(node, role_name="Go API Designer") for node in nodes]
+    original_execute = sample_task.execute_task
+
+    def execute_task(task, all_results):
+        llm.invoke(task["description"])
+        return original_execute(task, all_results)
+
+    # The sample worker reads the module-level task list and prints per task
+    sample_task.task_list = tasks
+    sample_task.execute_task = execute_task
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sample_task.execute_tasks_parallel(tasks, num_threads=workers)
+
+
+EXECUTORS = {
+    "task_executor": run_task_executor,
+    "task_jx_executor": run_task_jx_executor,
+    "sample_parallel": run_sample_parallel,
+}
+
+
+# ----------------------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------------------
+
+
+class ThreadMonitor:
+    """Samples the number of live threads in the background."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # Do not count the monitor thread itself
+        self.peak -= 1
+
+
+def measure(executor: str, shape: str, size: int, latency: float, workers: int, seed: int, track_memory: bool):
+    nodes = SHAPES[shape](size, random.Random(seed))
+    llm = FakeLLM(latency)
+    critical_nodes = critical_path_nodes(nodes)
+    critical_path = critical_nodes * latency
+    lower_bound = max(critical_path, len(nodes) * latency / workers)
+
+    if track_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadMonitor() as monitor:
+        results = EXECUTORS[executor](nodes, workers, llm)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    peak_memory = 0
+    if track_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "executor": executor,
+        "shape": shape,
+        "nodes": len(nodes),
+        "workers": workers,
+        "latency_s": latency,
+        "policy": os.getenv("SCHEDULER_POLICY", "default"),
+        "critical_path_nodes": critical_nodes,
+        "critical_path_s": round(critical_path, 6),
+        "lower_bound_s": round(lower_bound, 6),
+        "wall_s": round(wall, 6),
+        "overhead_ratio": round(wall / lower_bound, 4) if lower_bound else None,
+        "scheduler_cpu_s": round(cpu, 6),
+        "cpu_per_node_ms": round(cpu / len(nodes) * 1000, 4),
+        "llm_calls": llm.calls,
+        "duplicate_calls": max(0, llm.calls - len(nodes)),
+        "results": len(results),
+        "peak_threads": monitor.peak,
+        "peak_memory_bytes": peak_memory,
+        "timed_out": False,
+    }
+
+
+def _measure_child(result_queue, log_level: str, *args):
+    logging.getLogger().setLevel(log_level)
+    result_queue.put(measure(*args))
+
+
+def measure_isolated(executor: str, shape: str, size: int, latency: float, workers: int,
+                     seed: int, track_memory: bool, timeout: float, log_level: str):
+    """
+    Run one measurement in a child process.
+
+    Keeps thread counts and memory of one run independent from the others, and
+    lets a scheduler that deadlocks or degrades quadratically be killed after
+    `timeout` seconds instead of stalling the whole suite.
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_measure_child,
+        args=(result_queue, log_level, executor, shape, size, latency, workers, seed, track_memory),
+        daemon=True,
+    )
+    process.start()
+    try:
+        return result_queue.get(timeout=timeout)
+    except queue.Empty:
+        return {
+            "executor": executor,
+            "shape": shape,
+            "nodes": size,
+            "workers": workers,
+            "latency_s": latency,
+            "timed_out": True,
+            "timeout_s": timeout,
+        }
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(rows: List[Dict[str, Any]], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["executor"], r["shape"], r["nodes"]): r for r in baseline["runs"]}
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit', '?')}):")
+    for row in rows:
+        before = old.get((row["executor"], row["shape"], row["nodes"]))
+        if not before:
+            continue
+        if row["timed_out"] or before["timed_out"]:
+            print(
+                f"{row['executor']:>17} {row['shape']:>8} {row['nodes']:>6}: "
+                f"timed out {before['timed_out']} -> {row['timed_out']}"
+            )
+            continue
+        print(
+            f"{row['executor']:>17} {row['shape']:>8} {row['nodes']:>6}: "
+            f"wall {before['wall_s']:.3f}s -> {row['wall_s']:.3f}s "
+            f"({row['wall_s'] / before['wall_s']:.2f}x), "
+            f"cpu {before['scheduler_cpu_s']:.3f}s -> {row['scheduler_cpu_s']:.3f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Task scheduler benchmark")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="comma separated DAG shapes")
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated node counts (10 to 10000)")
+    parser.add_argument("--executors", default=",".join(EXECUTORS), help="comma separated executors")
+    parser.add_argument("--latency", type=float, default=0.01, help="fake LLM latency in seconds")
+    parser.add_argument("--workers", type=int, default=5, help="worker threads per executor")
+    parser.add_argument("--seed", type=int, default=0, help="seed for random graphs")
+    parser.add_argument("--policy", help="dispatch policy: fifo, critical_path or dependents")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (lower overhead)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a run is killed")
+    parser.add_argument("--log-level", default="CRITICAL", help="log level of the executors during runs")
+    parser.add_argument("-o", "--output", help="result file (default benchmarks/results/scheduler_<timestamp>.json)")
+    parser.add_argument("--baseline", help="previous result file to compare against")
+    args = parser.parse_args()
+    if args.policy:
+        # Inherited by the measurement processes
+        os.environ["SCHEDULER_POLICY"] = args.policy
+
+    rows = []
+    for executor in args.executors.split(","):
+        for shape in args.shapes.split(","):
+            for size in [int(s) for s in args.sizes.split(",")]:
+                row = measure_isolated(
+                    executor, shape, size, args.latency, args.workers, args.seed,
+                    not args.no_memory, args.timeout, args.log_level,
+                )
+                rows.append(row)
+                if row["timed_out"]:
+                    print(f"{executor:>17} {shape:>8} {size:>6}: timed out after {args.timeout:.0f}s")
+                    continue
+                print(
+                    f"{executor:>17} {shape:>8} {size:>6}: wall {row['wall_s']:.3f}s "
+                    f"(bound {row['lower_bound_s']:.3f}s, x{row['overhead_ratio']}), "
+                    f"cpu {row['scheduler_cpu_s']:.3f}s, threads {row['peak_threads']}, "
+                    f"mem {row['peak_memory_bytes'] / 1024:.0f} KiB, "
+                    f"calls {row['llm_calls']} ({row['duplicate_calls']} duplicate)"
+                )
+
+    output = args.output or str(
+        ROOT / "benchmarks" / "results" / f"scheduler_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "timestamp": datetime.now().isoformat(),
+                "config": vars(args),
+                "runs": rows,
+            },
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"Results saved to: {output}")
+
+    if args.baseline:
+        compare(rows, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
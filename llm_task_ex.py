@@ -1,7 +1,13 @@
 from typing import Optional
 from pydantic import BaseModel, Field
 from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
+from tools.retry_policy import acall_with_retries, call_with_retries
+from tools.streaming import (
+    PartialResultWriter,
+    StreamMetrics,
+    acollect_stream,
+    collect_stream,
+)
 import logging
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_community.callbacks import get_openai_callback
@@ -38,25 +44,16 @@ Based *only* on the 'CURRENT TASK', generate the final output. Your response mus
 class LLMTaskProcessor:
     """Processes tasks and generates results using LLM"""
 
-    def __init__(self, sys_prompt: str):
+    def __init__(self, sys_prompt: str, role_name: Optional[str] = None):
         self.sys_prompt = sys_prompt
+        # Selects the role's model route, if MODEL_ROUTES has one
+        self.role_name = role_name
+        # Filled by streamed generations (process_task with a writer)
+        self.stream_metrics: Optional[StreamMetrics] = None
 
-    def process_task(
+    def _build_messages(
         self, PREVIOUS_TASK_RESULTS: str, TASK: str, FINAL_PRODUCT_DESCRIPTION: str
-    ) -> str:
-        """
-        Processes the given task and generates a result using LLM.
-
-        Args:
-            PREVIOUS_TASK_RESULTS (str): Context from previous tasks.
-            TASK (str): Current task to perform.
-            FINAL_PRODUCT_DESCRIPTION (str): Description of desired output.
-
-        Returns:
-            str: Generated result or empty string if failed.
-        """
-        llm = get_llm_model()
-
+    ):
         # Select the appropriate template based on if previous task results exist
         template = PROMPT_TEMPLATE_1 if PREVIOUS_TASK_RESULTS else PROMPT_TEMPLATE_2
 
@@ -80,19 +77,89 @@ class LLMTaskProcessor:
             ]
         )
 
-        messages = chat_prompt.format_messages()
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = llm(messages)
-                return response.content
-            except Exception as e:
-                logging.warning(f"Attempt {attempt + 1} failed: {e}")
-                if attempt == max_retries - 1:
-                    logging.error("All retry attempts failed.")
-                    logging.error(f"Last exception: {e}")
-                    return ""
+        return chat_prompt.format_messages()
+
+    def process_task(
+        self,
+        PREVIOUS_TASK_RESULTS: str,
+        TASK: str,
+        FINAL_PRODUCT_DESCRIPTION: str,
+        writer: Optional[PartialResultWriter] = None,
+    ) -> str:
+        """
+        Processes the given task and generates a result using LLM.
+
+        Args:
+            PREVIOUS_TASK_RESULTS (str): Context from previous tasks.
+            TASK (str): Current task to perform.
+            FINAL_PRODUCT_DESCRIPTION (str): Description of desired output.
+            writer: Stream the generation into this writer as it arrives and
+                    record time-to-first-token in self.stream_metrics.
+
+        Returns:
+            str: Generated result or empty string if failed.
+        """
+        messages = self._build_messages(
+            PREVIOUS_TASK_RESULTS, TASK, FINAL_PRODUCT_DESCRIPTION
+        )
+
+        def call(llm) -> str:
+            if writer is None:
+                return llm.invoke(messages).content
+
+            # Streaming mode: chunks are written as they arrive
+            writer.start()
+            result, self.stream_metrics = collect_stream(llm.stream(messages), writer.write)
+            return result
+
+        try:
+            return call_with_retries("task_execute", call, default="", role=self.role_name)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def aprocess_task(
+        self,
+        PREVIOUS_TASK_RESULTS: str,
+        TASK: str,
+        FINAL_PRODUCT_DESCRIPTION: str,
+        writer: Optional[PartialResultWriter] = None,
+    ) -> str:
+        """
+        Async version of process_task, using ainvoke.
+
+        Args:
+            PREVIOUS_TASK_RESULTS (str): Context from previous tasks.
+            TASK (str): Current task to perform.
+            FINAL_PRODUCT_DESCRIPTION (str): Description of desired output.
+            writer: Stream the generation into this writer as it arrives and
+                    record time-to-first-token in self.stream_metrics.
+
+        Returns:
+            str: Generated result or empty string if failed.
+        """
+        messages = self._build_messages(
+            PREVIOUS_TASK_RESULTS, TASK, FINAL_PRODUCT_DESCRIPTION
+        )
+
+        async def call(llm) -> str:
+            if writer is None:
+                return (await llm.ainvoke(messages)).content
+
+            # Streaming mode: chunks are written as they arrive
+            writer.start()
+            result, self.stream_metrics = await acollect_stream(
+                llm.astream(messages), writer.write
+            )
+            return result
+
+        try:
+            return await acall_with_retries(
+                "task_execute", call, default="", role=self.role_name
+            )
+        finally:
+            if writer is not None:
+                writer.close()
 
 
 if __name__ == "__main__":
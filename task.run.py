@@ -1,5 +1,6 @@
+import argparse
+import asyncio
 import os
-import json
 import logging
 import time
 from datetime import datetime
@@ -8,10 +9,23 @@ from langchain.prompts import PromptTemplate
 from pydantic import BaseModel, Field
 
 from GenRoleSys import RoleGenerator
-from task_exect import execute_tasks
+from task_exect import execute_tasks, execute_tasks_async
 from task_jx import TaskJxGenerator
-from tools.llm_generatory import get_llm_model
+from tools.checkpoint import RunJournal, is_checkpoint_enabled
+from tools.latency_stats import save_latency_stats
+from tools.llm_cache import get_cache_stats, is_cache_enabled
+from tools.llm_generatory import aclose_llm_pool, get_llm_model, warm_llm_pool
+from tools.metrics import log_metrics_summary, write_metrics
+from tools.prompt_registry import get_prompt_registry
+from tools.result_sink import ResultSink
 from tools.task_splitter import TaskSplitter, TaskItem
+from tools.tracing import (
+    atrace_iterable,
+    configure_tracing,
+    flush_tracing,
+    start_span,
+    trace_iterable,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -58,18 +72,22 @@ def log_prompt_map(prompt_map):
 
 def load_prompt():
     """
-    执行脚本的主函数。
+    加载提示词。
+
+    返回进程内共享的 PromptRegistry：每个文件只读取、编译一次，文件修改时间变化后才重新加载。
     """
     # 带自定义键名的要读取的文件
     files_mapping = {
         "role_system": "prompt/gen_role_sys.md",
         "task_jx": "prompt/task_jx.md",
         "task_result": "prompt/task_result.md",
+        "task_result_batch": "prompt/task_result_batch.md",
+        "task_plan": "prompt/task_plan.md",
         "task_split": "prompt/task_split.md",
     }
 
-    # 读取文件内容并使用自定义键存储在映射中
-    prompt_map = read_files_to_map(files_mapping)
+    # 读取文件内容并使用自定义键存储在映射中（已加载的文件不会重复读取）
+    prompt_map = get_prompt_registry(files_mapping)
 
     # 记录映射以进行验证
     log_prompt_map(prompt_map)
@@ -77,12 +95,186 @@ def load_prompt():
     return prompt_map
 
 
-def run(task: str) -> tuple[List[Dict[str, Any]], float]:
+def log_cache_stats():
+    """
+    记录 LLM 响应缓存的各阶段命中情况。
+    """
+    if is_cache_enabled():
+        for stage, counters in get_cache_stats().items():
+            logger.info(
+                f"LLM cache [{stage}]: {counters['hits']} hits, {counters['misses']} misses"
+            )
+
+
+def report_metrics():
+    """
+    记录各阶段的调用次数、token、耗时和成本；设置 METRICS_EXPORT 时写出快照
+    （.prom / .txt 为 Prometheus 文本格式，其他为 JSON）。
+    """
+    log_metrics_summary()
+    export_path = os.getenv("METRICS_EXPORT")
+    if export_path:
+        write_metrics(export_path)
+
+
+def is_split_streamed() -> bool:
+    """
+    是否流式拆分任务（默认开启，STREAM_SPLIT=0 关闭）。
+    """
+    return os.getenv("STREAM_SPLIT", "1") != "0"
+
+
+def open_journal(
+    task: Optional[str], resume: Optional[str]
+) -> tuple[str, Optional[RunJournal]]:
+    """
+    打开本次运行的检查点日志（CHECKPOINT=1 或恢复运行时记录，默认不记录）。
+
+    Args:
+        task: 要执行的任务；恢复时默认使用日志中记录的任务
+        resume: 要恢复的运行 ID
+
+    Returns:
+        Tuple of (task, journal)
+    """
+    if resume:
+        journal = RunJournal.resume(resume)
+        if task and journal.task and task != journal.task:
+            logger.warning(f"Run {resume} was started for another task, resuming that task")
+        return journal.task or task, journal
+    if not is_checkpoint_enabled():
+        return task, None
+    journal = RunJournal()
+    journal.record_run(task)
+    logger.info(f"Run id: {journal.run_id} (resume with --resume {journal.run_id})")
+    return task, journal
+
+
+def restored_split(journal: Optional[RunJournal]) -> Optional[List[TaskItem]]:
+    """
+    中断前已完成的任务拆分结果，没有时返回 None。
+    """
+    if journal is None or journal.split_tasks() is None:
+        return None
+    tasks = [TaskItem(**item) for item in journal.split_tasks()]
+    logger.info(f"Task split restored from checkpoint, {len(tasks)} items.")
+    return tasks
+
+
+def run(
+    task: Optional[str],
+    use_async: bool = False,
+    stream: bool = False,
+    resume: Optional[str] = None,
+    result_file: Optional[str] = None,
+) -> tuple[List[Dict[str, Any]], float]:
     """
     运行函数，执行任务。
 
+    拆分结果、每个计划、子任务和汇总结果完成后即写入 output/runs/<run id>.jsonl，
+    中断后用 resume 传入运行 ID 只执行缺失的部分。
+
+    Args:
+        task: 要执行的任务（恢复时可为 None）
+        use_async: 使用单个事件循环执行整个流程（见 arun），而不是嵌套线程池
+        stream: 流式生成子任务和汇总结果，实时写入 output/partial/ 并记录首 token 耗时
+        resume: 要恢复的运行 ID
+        result_file: 每个子任务和任务完成时即追加写入的 JSONL 结果文件（见 tools/result_sink.py）；
+            写入后内存中只保留各任务的状态、描述和结果文本
+
+    Returns:
+        Tuple containing:
+        - List of task items (only tools.result_sink.retained_result fields with result_file)
+        - Execution time in minutes
+    """
+    if use_async:
+        return run_event_loop(
+            arun(task, stream=stream, resume=resume, result_file=result_file)
+        )
+
+    start_time = time.time()
+    task, journal = open_journal(task, resume)
+    # 设置 TRACE_EXPORT（console 或 JSONL 文件路径）时记录整个运行的 span
+    configure_tracing()
+
+    # 预先创建所有 API key 对应的 LLM 客户端，后续各阶段复用连接
+    warm_llm_pool()
+
+    sink = ResultSink(result_file) if result_file else None
+    try:
+        with start_span("run", task=task, mode="sync", stream=stream):
+            # 获取 prompt_map
+            prompt_map = load_prompt()
+            # 使用 TaskSplitter 类处理任务，传入 prompt_map
+            task_splitter = TaskSplitter(prompt_map)
+            tasks = restored_split(journal)
+            if tasks is None and is_split_streamed():
+                # 流式拆分：每解析出一个任务就交给执行器，不必等待整个列表生成完
+                incoming = task_splitter.stream_split_task(task)
+                if journal is not None:
+                    incoming = journal.journal_split(incoming)
+                result = execute_tasks(
+                    tasks=[],
+                    prompt_map=prompt_map,
+                    stream=stream,
+                    incoming=trace_iterable("split", incoming),
+                    journal=journal,
+                    sink=sink,
+                )
+                logger.info(f"Streamed task split, {len(result)} tasks executed.")
+            else:
+                if tasks is None:
+                    with start_span("split") as span:
+                        tasks = task_splitter.split_task(task)
+                        if span is not None:
+                            span.set_attribute("items", len(tasks))
+                    if journal is not None:
+                        journal.record_split(tasks)
+
+                logger.info(f"Task split into {len(tasks)} items.")
+                logger.info(f"Tasks: {tasks}")
+                result = execute_tasks(
+                    tasks=tasks,
+                    prompt_map=prompt_map,
+                    stream=stream,
+                    journal=journal,
+                    sink=sink,
+                )
+    finally:
+        flush_tracing()
+        if sink is not None:
+            sink.close()
+    log_cache_stats()
+    report_metrics()
+    # 保存各阶段平均耗时，下次运行用于关键路径调度
+    save_latency_stats()
+
+    end_time = time.time()
+    execution_time_minutes = (end_time - start_time) / 60
+
+    return result, execution_time_minutes
+
+
+async def arun(
+    task: Optional[str],
+    max_workers: int = 5,
+    subtask_workers: int = 3,
+    stream: bool = False,
+    llm_concurrency: Optional[int] = None,
+    resume: Optional[str] = None,
+    result_file: Optional[str] = None,
+) -> tuple[List[Dict[str, Any]], float]:
+    """
+    异步运行函数：所有阶段使用 ainvoke，在同一个事件循环中执行。
+
     Args:
         task: 要执行的任务
+        max_workers: 同时执行的顶层任务数
+        subtask_workers: 未指定 llm_concurrency 时，全局并发 = max_workers * subtask_workers
+        stream: 流式生成并实时写入部分结果
+        llm_concurrency: 全局 LLM 并发上限（所有顶层任务和子任务共享），默认读取 LLM_MAX_CONCURRENCY
+        resume: 要恢复的运行 ID（见 run）
+        result_file: 增量写入的 JSONL 结果文件（见 run）
 
     Returns:
         Tuple containing:
@@ -90,16 +282,55 @@ def run(task: str) -> tuple[List[Dict[str, Any]], float]:
         - Execution time in minutes
     """
     start_time = time.time()
+    task, journal = open_journal(task, resume)
+    configure_tracing()
 
-    # 获取 prompt_map
-    prompt_map = load_prompt()
-    # 使用 TaskSplitter 类处理任务，传入 prompt_map
-    task_splitter = TaskSplitter(prompt_map)
-    tasks = task_splitter.split_task(task)
+    warm_llm_pool()
+    sink = ResultSink(result_file) if result_file else None
+    try:
+        with start_span("run", task=task, mode="async", stream=stream):
+            prompt_map = load_prompt()
+            task_splitter = TaskSplitter(prompt_map)
+            tasks = restored_split(journal)
+            incoming = None
+            if tasks is None and is_split_streamed():
+                tasks = []
+                incoming = task_splitter.astream_split_task(task)
+                if journal is not None:
+                    incoming = journal.ajournal_split(incoming)
+                incoming = atrace_iterable("split", incoming)
+            elif tasks is None:
+                with start_span("split") as span:
+                    tasks = await task_splitter.asplit_task(task)
+                    if span is not None:
+                        span.set_attribute("items", len(tasks))
+                if journal is not None:
+                    journal.record_split(tasks)
 
-    logger.info(f"Task split into {len(tasks)} items.")
-    logger.info(f"Tasks: {tasks}")
-    result = execute_tasks(tasks=tasks, prompt_map=prompt_map)
+                logger.info(f"Task split into {len(tasks)} items.")
+                logger.info(f"Tasks: {tasks}")
+            result = await execute_tasks_async(
+                tasks=tasks,
+                prompt_map=prompt_map,
+                max_workers=max_workers,
+                subtask_workers=subtask_workers,
+                stream=stream,
+                llm_concurrency=llm_concurrency,
+                incoming=incoming,
+                journal=journal,
+                sink=sink,
+            )
+        if incoming is not None:
+            logger.info(f"Streamed task split, {len(result)} tasks executed.")
+        log_cache_stats()
+        report_metrics()
+        save_latency_stats()
+    finally:
+        # 异步连接绑定在当前事件循环上，循环结束前关闭
+        await aclose_llm_pool()
+        flush_tracing()
+        if sink is not None:
+            sink.close()
 
     end_time = time.time()
     execution_time_minutes = (end_time - start_time) / 60
@@ -107,21 +338,50 @@ def run(task: str) -> tuple[List[Dict[str, Any]], float]:
     return result, execution_time_minutes
 
 
-if __name__ == "__main__":
-    task_list, execution_time = run("做一个 Linux 基础命令教学")
+def run_event_loop(coro):
+    """
+    Run a coroutine on a new event loop, using uvloop when it is installed.
 
-    # Create output directory if it doesn't exist
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    Set USE_UVLOOP=0 to force the default asyncio loop.
+    """
+    if os.getenv("USE_UVLOOP", "1") != "0":
+        try:
+            import uvloop
+        except ImportError:
+            uvloop = None
+        if uvloop is not None:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                return runner.run(coro)
+
+    return asyncio.run(coro)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a task and execute it with generated roles")
+    parser.add_argument(
+        "task", nargs="?", default="做一个 Linux 基础命令教学", help="Task to execute"
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        help="Resume an interrupted run from output/runs/<RUN_ID>.jsonl",
+    )
+    args = parser.parse_args()
 
-    # Create timestamped filename
+    # 结果在每个任务完成时追加写入，不在结束时一次性写出
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = os.path.join(output_dir, f"task_result_{timestamp}.json")
+    output_file = os.path.join("output", f"task_result_{timestamp}.jsonl")
 
-    # Write results to JSON file
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(task_list, f, ensure_ascii=False, indent=2)
+    task_list, execution_time = run(
+        None if args.resume else args.task,
+        use_async=os.getenv("RUN_MODE") == "async",
+        stream=os.getenv("LLM_STREAM") == "1",
+        resume=args.resume,
+        result_file=output_file,
+    )
 
-    logger.info(f"Results saved to: {output_file}")
+    logger.info(
+        f"Results saved to: {output_file} "
+        f"(nested JSON: python -m tools.result_sink {output_file})"
+    )
     logger.info(f"Task execution completed in {execution_time:.2f} minutes")
@@ -1,16 +1,36 @@
-import logging
+import asyncio
 import concurrent.futures
-from typing import List, Dict, Any, Optional, Set
+import contextvars
+import logging
+import os
+from typing import AsyncIterable, Iterable, List, Dict, Any, Optional, Set, Tuple
 import time
-import json
 from datetime import datetime
 from pydantic import BaseModel, Field
 
-from GenRoleSys import RoleGenerator
-from task_jx import TaskJxGenerator
-from task_jx_excet import execute_tasks_jx
+from GenRoleSys import RoleDefinition, RoleGenerator
+from task_jx import TaskDefinition, TaskJxGenerator
+from task_jx_excet import execute_tasks_jx, execute_tasks_jx_async
+from task_plan import PlanGenerator
 from task_reduce import TaskReducer
+from tools.dag_scheduler import (
+    ConcurrencyBudget,
+    DagScheduler,
+    DispatchPolicy,
+    execute_dag,
+    execute_dag_async,
+    get_dispatch_policy,
+)
+from tools.checkpoint import RunJournal
+from tools.dep_context import DependencyContext, DependencyContextBuilder, log_dependency_context
+from tools.latency_stats import estimate_latency
+from tools.llm_generatory import get_model_name
+from tools.metrics import TaskUsage, usage_scope
+from tools.result_sink import ResultSink, retained_result
+from tools.streaming import PartialResultWriter, log_stream_metrics
+from tools.subtask_dedup import SubtaskDeduplicator, is_dedup_enabled, log_dedup_stats
 from tools.task_splitter import TaskItem
+from tools.tracing import mark_span_failed, set_span_attributes, start_span
 
 logging.basicConfig(
     level=logging.INFO,
@@ -24,27 +44,167 @@ class TaskExecutor:
     Executes tasks in parallel while respecting their dependencies.
     """
 
-    def __init__(self, tasks: List[TaskItem], max_workers: int = 5, prompt_map=None):
+    def __init__(
+            self,
+            tasks: List[TaskItem],
+            max_workers: int = 5,
+            prompt_map=None,
+            subtask_workers: int = 3,
+            stream: bool = False,
+            llm_concurrency: Optional[int] = None,
+            policy: Optional[DispatchPolicy] = None,
+            fused_planning: Optional[bool] = None,
+            eager_planning: Optional[bool] = None,
+            journal: Optional[RunJournal] = None,
+            sink: Optional[ResultSink] = None,
+            dedup: Optional[bool] = None,
+    ):
         """
         Initialize the task executor.
 
         Args:
             tasks: List of TaskItem objects to execute
-            max_workers: Maximum number of worker threads
+            max_workers: Maximum number of worker threads (concurrent
+                         coroutines when run with aexecute_all)
+            subtask_workers: Only used for the default of llm_concurrency
+            stream: Stream subtask and reduce generations into
+                    output/partial/<timestamp>/<task id>/ as they arrive
+            llm_concurrency: Global limit on concurrent LLM calls, shared by the
+                             planning / reduce calls of every top-level task and
+                             all their subtasks. Defaults to LLM_MAX_CONCURRENCY,
+                             else max_workers * subtask_workers
+            policy: Order in which ready tasks are dispatched; defaults to
+                    SCHEDULER_POLICY (critical path weighted by stage latency)
+            fused_planning: Generate roles and subtasks in one request instead of
+                            two; defaults to FUSED_PLANNING (off unless set to 1)
+            eager_planning: Start planning and subtasks of every task right away
+                            and only hold back its reduce step until the tasks
+                            it depends on are completed; defaults to
+                            EAGER_PLANNING (off unless set to 1)
+            journal: Run journal receiving every plan, subtask and task result
+                     as it completes; what it already holds (from an
+                     interrupted run) is restored instead of executed
+            sink: Receives every subtask and task result as soon as it finishes;
+                  only the fields of retained_result are kept in self.results
+            dedup: Execute (near-)identical subtasks planned by different
+                   top-level tasks once and share the result; defaults to
+                   SUBTASK_DEDUP (off unless set to 1)
         """
         self.tasks = {task.id: task for task in tasks}
+        self.fused_planning = (
+            os.getenv("FUSED_PLANNING", "0") == "1"
+            if fused_planning is None
+            else fused_planning
+        )
+        self.eager_planning = (
+            os.getenv("EAGER_PLANNING", "0") == "1"
+            if eager_planning is None
+            else eager_planning
+        )
         self.max_workers = max_workers
         self.results = {}
-        self.completed_tasks: Set[str] = set()
-        self.failed_tasks: Set[str] = set()
-        self.in_progress: Set[str] = set()
+        self.scheduler = DagScheduler(
+            self.tasks, policy or get_dispatch_policy(weight=self._estimate_task_latency)
+        )
+        self.completed_tasks: Set[str] = self.scheduler.completed
+        self.failed_tasks: Set[str] = self.scheduler.failed
+        self.in_progress: Set[str] = self.scheduler.running
         self.prompt_map = prompt_map
+        self.subtask_workers = subtask_workers
+        self.budget = ConcurrencyBudget(
+            llm_concurrency
+            or int(os.getenv("LLM_MAX_CONCURRENCY", "0"))
+            or max_workers * subtask_workers
+        )
+        # Subtask workers; a budget of 0 or less (unlimited) cannot size a pool
+        self.subtask_pool_size = (
+            self.budget.limit if self.budget.limit > 0 else max_workers * subtask_workers
+        )
+        # Counts tokens with the tokenizer of the model the reduce prompt goes to
+        self.context_builder = DependencyContextBuilder(model=get_model_name("task_reduce"))
+        self.journal = journal
+        self.sink = sink
+        self.dedup = (
+            SubtaskDeduplicator()
+            if (is_dedup_enabled() if dedup is None else dedup)
+            else None
+        )
+        # LLM usage per task, including its subtasks (attached to the results)
+        self.task_usage: Dict[str, TaskUsage] = {}
+        # Shared by the subtasks of every top-level task while execute_all runs
+        self.subtask_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.stream_dir = (
+            os.path.join("output", "partial", datetime.now().strftime("%Y%m%d_%H%M%S"))
+            if stream
+            else None
+        )
+
+    def _estimate_task_latency(self, task_id: str) -> float:
+        """Expected duration of a top-level task: roles, plan, one subtask level and reduce."""
+        planning = ("task_plan",) if self.fused_planning else ("role_system", "task_jx")
+        return sum(
+            estimate_latency(stage)
+            for stage in planning + ("task_result", "task_execute", "task_reduce")
+        )
+
+    def _plan(
+            self, task_description: str, prompt_map
+    ) -> Tuple[List[RoleDefinition], List[TaskDefinition]]:
+        """
+        Generate the roles and the subtasks of a task.
+
+        With fused_planning both come from one request; if that produces no
+        valid plan, the separate role and plan requests are used instead.
+
+        Returns:
+            Tuple of (roles, subtasks)
+        """
+        if self.fused_planning:
+            with self.budget.slot():
+                plan = PlanGenerator(prompt_map).generate_plan(task_description)
+            if plan is not None:
+                return plan.roles, plan.tasks
+            logger.warning("Fused planning failed, generating roles and plan separately")
+
+        # 任务描述
+        role_gen = RoleGenerator(prompt_map)
+        # 传递规范化的描述
+        with self.budget.slot():
+            roles = role_gen.generate_roles(task_description)
+
+        role_names = [role.role_name for role in roles if role.role_name]
+        taskJxGenerator = TaskJxGenerator(prompt_map)
+        with self.budget.slot():
+            task_items = taskJxGenerator.generator_task(task_description, role_names)
+        return roles, task_items
+
+    async def _aplan(
+            self, task_description: str, prompt_map
+    ) -> Tuple[List[RoleDefinition], List[TaskDefinition]]:
+        """Async version of _plan."""
+        if self.fused_planning:
+            async with self.budget.aslot():
+                plan = await PlanGenerator(prompt_map).agenerate_plan(task_description)
+            if plan is not None:
+                return plan.roles, plan.tasks
+            logger.warning("Fused planning failed, generating roles and plan separately")
+
+        role_gen = RoleGenerator(prompt_map)
+        async with self.budget.aslot():
+            roles = await role_gen.agenerate_roles(task_description)
+
+        role_names = [role.role_name for role in roles if role.role_name]
+        taskJxGenerator = TaskJxGenerator(prompt_map)
+        async with self.budget.aslot():
+            task_items = await taskJxGenerator.agenerator_task(task_description, role_names)
+        return roles, task_items
 
     def _process_task(
             self,
             task_description: str,
             prompt_map=None,
             dependent_results: Dict[str, str] = None,
+            task_id: Optional[str] = None,
     ) -> List[Dict[str, Any]]:
         """
         Process a task by generating roles and executing the task.
@@ -53,50 +213,281 @@ class TaskExecutor:
             task_description: Description of the task to execute
             prompt_map: Map of prompts for role generation
             dependent_results: Results of dependent tasks that this task relies on
+            task_id: ID of the task, used to place streamed partial results
 
         Returns:
             Result of the task execution
         """
-        # 任务描述
-        role_gen = RoleGenerator(prompt_map)
-        # 传递规范化的描述
-        roles = role_gen.generate_roles(task_description)
+        planned = self._restored_plan(task_id, task_description)
+        if planned is None:
+            with start_span("planning", fused=self.fused_planning) as span:
+                planned = self._plan(task_description, prompt_map)
+                set_span_attributes(
+                    span, "planning", {"roles": len(planned[0]), "subtasks": len(planned[1])}
+                )
+            self._record_plan(task_id, task_description, *planned)
+        roles, task_items = planned
+
+        # 子任务在共享线程池上执行，并发只受全局预算限制
+        return execute_tasks_jx(
+            tasks=task_items,
+            roles=roles,
+            max_workers=self.subtask_pool_size,
+            prompt_map=prompt_map,
+            stream_dir=self._get_stream_dir(task_id),
+            budget=self.budget,
+            pool=self.subtask_pool,
+            journal=self.journal if task_id is not None else None,
+            journal_task=task_id,
+            sink=self.sink,
+            dedup=self.dedup,
+        )
 
-        role_names = [role.role_name for role in roles if role.role_name]
-        taskJxGenerator = TaskJxGenerator(prompt_map)
-        task_items = taskJxGenerator.generator_task(task_description, role_names)
+    async def _aprocess_task(
+            self,
+            task_description: str,
+            prompt_map=None,
+            dependent_results: Dict[str, str] = None,
+            task_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of _process_task.
 
-        return execute_tasks_jx(
-            tasks=task_items, roles=roles, max_workers=3, prompt_map=prompt_map
+        Args:
+            task_description: Description of the task to execute
+            prompt_map: Map of prompts for role generation
+            dependent_results: Results of dependent tasks that this task relies on
+            task_id: ID of the task, used to place streamed partial results
+
+        Returns:
+            Result of the task execution
+        """
+        planned = self._restored_plan(task_id, task_description)
+        if planned is None:
+            with start_span("planning", fused=self.fused_planning) as span:
+                planned = await self._aplan(task_description, prompt_map)
+                set_span_attributes(
+                    span, "planning", {"roles": len(planned[0]), "subtasks": len(planned[1])}
+                )
+            self._record_plan(task_id, task_description, *planned)
+        roles, task_items = planned
+
+        return await execute_tasks_jx_async(
+            tasks=task_items,
+            roles=roles,
+            max_workers=self.subtask_pool_size,
+            prompt_map=prompt_map,
+            stream_dir=self._get_stream_dir(task_id),
+            budget=self.budget,
+            journal=self.journal if task_id is not None else None,
+            journal_task=task_id,
+            sink=self.sink,
+            dedup=self.dedup,
         )
 
-    def _are_dependencies_met(self, task_id: str) -> bool:
+    def _restored_plan(
+            self, task_id: Optional[str], task_description: str
+    ) -> Optional[Tuple[List[RoleDefinition], List[TaskDefinition]]]:
+        """Roles and subtasks of the task from the journal of an interrupted run, if any."""
+        if self.journal is None or task_id is None:
+            return None
+        plan = self.journal.plan(task_id, task_description)
+        if plan is None:
+            return None
+        logger.info(f"Plan of task {task_id} restored from checkpoint")
+        return (
+            [RoleDefinition(**role) for role in plan["roles"]],
+            [TaskDefinition(**subtask) for subtask in plan["subtasks"]],
+        )
+
+    def _record_plan(
+            self,
+            task_id: Optional[str],
+            task_description: str,
+            roles: List[RoleDefinition],
+            task_items: List[TaskDefinition],
+    ):
+        # 计划为空说明规划失败，不记录，恢复时重新规划
+        if self.journal is not None and task_id is not None and task_items:
+            self.journal.record_plan(task_id, task_description, roles, task_items)
+
+    def _restored_result(self, task: TaskItem) -> Optional[Dict[str, Any]]:
+        """Result of a top-level task from the journal of an interrupted run, if any."""
+        if self.journal is None:
+            return None
+        return self.journal.task_result(task.id, task.description)
+
+    def _get_stream_dir(self, task_id: Optional[str]) -> Optional[str]:
+        if not self.stream_dir or task_id is None:
+            return None
+        return os.path.join(self.stream_dir, task_id)
+
+    def _get_stream_writer(self, task_id: str) -> Optional[PartialResultWriter]:
+        stream_dir = self._get_stream_dir(task_id)
+        if stream_dir is None:
+            return None
+        return PartialResultWriter(os.path.join(stream_dir, "result.md"))
+
+    def _execute_task(
+            self, task_id: str, prepared: Optional[concurrent.futures.Future] = None
+    ) -> Dict[str, Any]:
         """
-        Check if all dependencies for a task have been completed.
+        Execute a single task.
 
         Args:
-            task_id: ID of the task to check
+            task_id: ID of the task to execute
+            prepared: Future of the subtask results when planning and subtasks
+                      were started ahead of the dependencies (eager_planning);
+                      only the reduce step runs here then
 
         Returns:
-            True if all dependencies are met, False otherwise
+            Result of the task execution
         """
         task = self.tasks.get(task_id)
         if not task:
-            logger.warning(f"Task {task_id} not found")
-            return False
+            logger.error(f"Task {task_id} not found")
+            return {"status": "failed", "error": "Task not found", "task_id": task_id}
 
-        for dep_id in task.dependsOn:
-            if dep_id not in self.completed_tasks:
-                return False
+        restored = self._restored_result(task)
+        if restored is not None:
+            logger.info(f"Task {task_id} restored from checkpoint")
+            return restored
 
-        return True
+        attributes = {"task.id": task_id, "task.depends_on": task.dependsOn}
+        with start_span("task", **attributes) as span:
+            try:
+                logger.info(f"Executing task {task_id}: {task.description}")
 
-    def _execute_task(self, task_id: str) -> Dict[str, Any]:
+                # Collect results from dependencies
+                dependent_results = self._collect_dependency_results(task)
+
+                # Call the class method with dependent results
+                usage = self._get_task_usage(task_id)
+                if prepared is not None:
+                    task_result = prepared.result()
+                else:
+                    with usage_scope(usage):
+                        task_result = self._process_task(
+                            task.description, self.prompt_map, dependent_results, task_id
+                        )
+
+                # todo:
+                # 当前任务描述
+                # 当前任务依赖任务的任务执行结果
+                # 当前任务的子任务执行结果
+
+                leaf_task_format = self._format_leaf_results(task_result)
+
+                with self.budget.slot(), usage_scope(usage), start_span(
+                        "reduce"
+                ) as reduce_span:
+                    # 依赖结果按 token 预算裁剪（摘要请求也占用这个并发槽位）
+                    context = self.context_builder.build(dependent_results)
+                    self._trace_context(reduce_span, context)
+                    task_reduce = TaskReducer(
+                        task_description=task.description,
+                        dependency_results=context.text,
+                        subtask_results=leaf_task_format,
+                    )
+                    reduced = task_reduce.process_task(
+                        writer=self._get_stream_writer(task_id)
+                    )
+
+                # Example result - replace with actual execution result
+                result = {
+                    "task_id": task_id,
+                    "status": "completed",
+                    "description": task.description,
+                    "dependsOn": task.dependsOn,  # Include dependency information
+                    "children": task_result,
+                    "result": reduced,
+                }
+                self._add_stream_metrics(result, task_reduce)
+                self._add_context_stats(result, context)
+                result["usage"] = usage.to_dict()
+                set_span_attributes(span, "usage", result["usage"])
+                if self.journal is not None:
+                    self.journal.record_task(result)
+                logger.info(f"Task {task_id} completed")
+                return result
+
+            except Exception as e:
+                logger.error(f"Error executing task {task_id}: {str(e)}", exc_info=True)
+                mark_span_failed(span, str(e))
+                return {
+                    "task_id": task_id,
+                    "status": "failed",
+                    "error": str(e),
+                    "description": task.description,
+                    "dependsOn": task.dependsOn,
+                }
+
+    def _run_task(
+            self, task_id: str, prepared: Optional[concurrent.futures.Future] = None
+    ) -> Dict[str, Any]:
+        return self._write_result(self._execute_task(task_id, prepared))
+
+    async def _arun_task(
+            self, task_id: str, prepared: Optional[asyncio.Future] = None
+    ) -> Dict[str, Any]:
+        return self._write_result(await self._aexecute_task(task_id, prepared))
+
+    def _write_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if self.sink is None:
+            return result
+        self.sink.write_task(result)
+        # The full result is in the sink file now
+        return retained_result(result)
+
+    def _add_stream_metrics(self, result: Dict[str, Any], task_reduce: TaskReducer):
+        if task_reduce.stream_metrics is not None:
+            log_stream_metrics(f"Task {result['task_id']} reduce", task_reduce.stream_metrics)
+            result["stream_metrics"] = task_reduce.stream_metrics.model_dump()
+
+    def _add_context_stats(self, result: Dict[str, Any], context: DependencyContext):
+        if context.original_tokens:
+            log_dependency_context(f"Task {result['task_id']} reduce", context)
+            result["dependency_context"] = context.model_dump(exclude={"text"})
+
+    @staticmethod
+    def _trace_context(span, context: DependencyContext):
+        set_span_attributes(
+            span,
+            "dependency_context",
+            {"tokens": context.tokens, "saved_tokens": context.saved_tokens},
+        )
+
+    def _get_task_usage(self, task_id: str) -> TaskUsage:
+        return self.task_usage.setdefault(task_id, TaskUsage())
+
+    def _collect_dependency_results(self, task: TaskItem) -> Dict[str, Any]:
+        dependent_results = {}
+        for dep_id in task.dependsOn:
+            if dep_id in self.results:
+                dependent_results[dep_id] = {
+                    "description": self.results[dep_id]["description"],
+                    "result": self.results[dep_id]["result"],
+                }
+        return dependent_results
+
+    def _format_leaf_results(self, task_result: List[Dict[str, Any]]) -> str:
+        leaf_task = find_leaf_tasks(task_result)
+        leaf_task_format = ""
+        for e in leaf_task:
+            task_desc = e.get("description", "")
+            task_result_item = e.get("result", "")
+            leaf_task_format += f"### task: {task_desc} \nresult:\n{task_result_item} \n\n"
+        return leaf_task_format
+
+    async def _aexecute_task(
+            self, task_id: str, prepared: Optional[asyncio.Future] = None
+    ) -> Dict[str, Any]:
         """
-        Execute a single task.
+        Async version of _execute_task.
 
         Args:
             task_id: ID of the task to execute
+            prepared: Task producing the subtask results (see _execute_task)
 
         Returns:
             Result of the task execution
@@ -106,71 +497,71 @@ class TaskExecutor:
             logger.error(f"Task {task_id} not found")
             return {"status": "failed", "error": "Task not found", "task_id": task_id}
 
-        try:
-            logger.info(f"Executing task {task_id}: {task.description}")
-            self.in_progress.add(task_id)
-
-            # Collect results from dependencies
-            dependent_results = {}
-            for dep_id in task.dependsOn:
-                if dep_id in self.results:
-                    dependent_results[dep_id] = {
-                        "description": self.results[dep_id]["description"],
-                        "result": self.results[dep_id]["result"],
-                    }
-
-            # Call the class method with dependent results
-            task_result = self._process_task(
-                task.description, self.prompt_map, dependent_results
-            )
+        restored = self._restored_result(task)
+        if restored is not None:
+            logger.info(f"Task {task_id} restored from checkpoint")
+            return restored
 
-            # todo:
-            # 当前任务描述
-            # 当前任务依赖任务的任务执行结果
-            # 当前任务的子任务执行结果
-
-            leaf_task = find_leaf_tasks(task_result)
-            leaf_task_format = ""
-            for e in leaf_task:
-                task_desc = e.get("description", "")
-                task_result_item = e.get("result", "")
-                leaf_task_format += f"### task: {task_desc} \nresult:\n{task_result_item} \n\n"
-            fc = self.handler_dep_result(dependent_results)
-            task_reduce = TaskReducer(
-                task_description=task.description,
-                dependency_results=fc,
-                subtask_results=leaf_task_format,
-            )
+        attributes = {"task.id": task_id, "task.depends_on": task.dependsOn}
+        with start_span("task", **attributes) as span:
+            try:
+                logger.info(f"Executing task {task_id}: {task.description}")
 
-            # Example result - replace with actual execution result
-            result = {
-                "task_id": task_id,
-                "status": "completed",
-                "description": task.description,
-                "dependsOn": task.dependsOn,  # Include dependency information
-                "children": task_result,
-                "result": task_reduce.process_task(),
-            }
-
-            self.in_progress.remove(task_id)
-            self.completed_tasks.add(task_id)
-            logger.info(f"Task {task_id} completed")
-            return result
+                dependent_results = self._collect_dependency_results(task)
+
+                usage = self._get_task_usage(task_id)
+                if prepared is not None:
+                    task_result = await prepared
+                else:
+                    with usage_scope(usage):
+                        task_result = await self._aprocess_task(
+                            task.description, self.prompt_map, dependent_results, task_id
+                        )
+
+                with usage_scope(usage), start_span("reduce") as reduce_span:
+                    async with self.budget.aslot():
+                        context = await self.context_builder.abuild(dependent_results)
+                        self._trace_context(reduce_span, context)
+                        task_reduce = TaskReducer(
+                            task_description=task.description,
+                            dependency_results=context.text,
+                            subtask_results=self._format_leaf_results(task_result),
+                        )
+                        reduced = await task_reduce.aprocess_task(
+                            writer=self._get_stream_writer(task_id)
+                        )
+
+                result = {
+                    "task_id": task_id,
+                    "status": "completed",
+                    "description": task.description,
+                    "dependsOn": task.dependsOn,
+                    "children": task_result,
+                    "result": reduced,
+                }
+                self._add_stream_metrics(result, task_reduce)
+                self._add_context_stats(result, context)
+                result["usage"] = usage.to_dict()
+                set_span_attributes(span, "usage", result["usage"])
+                if self.journal is not None:
+                    self.journal.record_task(result)
+                logger.info(f"Task {task_id} completed")
+                return result
+
+            except Exception as e:
+                logger.error(f"Error executing task {task_id}: {str(e)}", exc_info=True)
+                mark_span_failed(span, str(e))
+                return {
+                    "task_id": task_id,
+                    "status": "failed",
+                    "error": str(e),
+                    "description": task.description,
+                    "dependsOn": task.dependsOn,
+                }
 
-        except Exception as e:
-            logger.error(f"Error executing task {task_id}: {str(e)}", exc_info=True)
-            self.in_progress.remove(task_id)
-            self.failed_tasks.add(task_id)
-            return {
-                "task_id": task_id,
-                "status": "failed",
-                "error": str(e),
-                "description": task.description,
-                "dependsOn": task.dependsOn,
-            }
     def handler_dep_result(self, dependency_results: Dict[str, Any]):
         """
-        Format dependency results into a markdown string.
+        Format dependency results into a markdown string within the token budget.
 
         Args:
             dependency_results: Dictionary of dependency results where keys are task IDs
@@ -179,84 +570,159 @@ class TaskExecutor:
         Returns:
             Formatted markdown string of dependency results
         """
-        if not dependency_results:
-            return ""
+        return self.context_builder.build(dependency_results).text
+
+    def execute_all(self, incoming: Optional[Iterable[TaskItem]] = None) -> List[Dict[str, Any]]:
+        """
+        Execute all tasks in parallel while respecting their dependencies.
 
-        md_output = "## Previous Task Results\n\n"
+        Each task is dispatched as soon as its last dependency completes.
+        Subtasks of all tasks share one thread pool sized to the LLM budget.
+        With eager_planning only the reduce step is dispatched that way;
+        planning and subtasks of all tasks start immediately.
 
-        for task_id, task_data in dependency_results.items():
-            description = task_data.get("description", "No description")
-            result = task_data.get("result", "No result")
+        Args:
+            incoming: Tasks still being produced (e.g. TaskSplitter.stream_split_task),
+                      added to the run as they arrive
+
+        Returns:
+            List of task results
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.subtask_pool_size, thread_name_prefix="subtask"
+        ) as self.subtask_pool:
+            try:
+                if self.eager_planning:
+                    return self._execute_all_eager(incoming)
+                return execute_dag(
+                    self.tasks,
+                    self.max_workers,
+                    self._run_task,
+                    self.results,
+                    self.scheduler,
+                    incoming=incoming,
+                )
+            finally:
+                self.subtask_pool = None
+                log_dedup_stats(self.dedup)
+
+    def _prepare_order(self) -> List[str]:
+        """Schedulable tasks in the order the dispatch policy would start them."""
+        order = self.scheduler.topological_order()
+        # sorted is stable: FIFO keeps dependency order
+        return sorted(order, key=lambda task_id: -self.scheduler.policy.priority(task_id))
+
+    def _execute_all_eager(
+            self, incoming: Optional[Iterable[TaskItem]] = None
+    ) -> List[Dict[str, Any]]:
+        # 规划和子任务不依赖上游结果，提前执行；只有 reduce 等待依赖完成
+        prepare_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="prepare"
+        )
+        prepared: Dict[str, concurrent.futures.Future] = {}
 
-            md_output += f"### Task {task_id}: {description}\n\n"
-            md_output += f"{result}\n\n"
-            md_output += "---\n\n"
+        def run_prepare(task: TaskItem) -> List[Dict[str, Any]]:
+            with usage_scope(self._get_task_usage(task.id)), start_span(
+                    "task.prepare", **{"task.id": task.id}
+            ):
+                return self._process_task(task.description, self.prompt_map, None, task.id)
 
-        return md_output
+        def prepare(task: TaskItem):
+            if self._restored_result(task) is None:
+                prepared[task.id] = prepare_pool.submit(
+                    contextvars.copy_context().run, run_prepare, task
+                )
 
-    def execute_all(self) -> List[Dict[str, Any]]:
+        def prepare_incoming():
+            for task in incoming:
+                prepare(task)
+                yield task
+
+        try:
+            for task_id in self._prepare_order():
+                prepare(self.tasks[task_id])
+            return execute_dag(
+                self.tasks,
+                self.max_workers,
+                lambda task_id: self._run_task(task_id, prepared.get(task_id)),
+                self.results,
+                self.scheduler,
+                incoming=prepare_incoming() if incoming is not None else None,
+            )
+        finally:
+            # Tasks skipped after a failed dependency do not need their subtasks
+            prepare_pool.shutdown(wait=True, cancel_futures=True)
+
+    async def aexecute_all(
+            self, incoming: Optional[AsyncIterable[TaskItem]] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Execute all tasks in parallel while respecting their dependencies.
+        Execute all tasks as coroutines on the running event loop.
+
+        Each task starts as soon as its dependencies complete; at most
+        max_workers tasks run at the same time. With eager_planning only the
+        reduce step waits for the dependencies (see execute_all).
+
+        Args:
+            incoming: Tasks still being produced (e.g. TaskSplitter.astream_split_task),
+                      added to the run as they arrive
 
         Returns:
             List of task results
         """
-        with concurrent.futures.ThreadPoolExecutor(
-                max_workers=self.max_workers
-        ) as executor:
-            futures = {}
-
-            while len(self.completed_tasks) + len(self.failed_tasks) < len(self.tasks):
-                # Find tasks that can be executed (dependencies met and not in progress)
-                for task_id, task in self.tasks.items():
-                    if (
-                            task_id not in self.completed_tasks
-                            and task_id not in self.failed_tasks
-                            and task_id not in self.in_progress
-                            and self._are_dependencies_met(task_id)
-                    ):
-                        # Submit task for execution
-                        futures[executor.submit(self._execute_task, task_id)] = task_id
-
-                # Wait for at least one task to complete if there are futures
-                if futures:
-                    done, _ = concurrent.futures.wait(
-                        futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED
+        try:
+            if self.eager_planning:
+                return await self._aexecute_all_eager(incoming)
+            return await execute_dag_async(
+                self.tasks,
+                self.max_workers,
+                self._arun_task,
+                self.results,
+                self.scheduler,
+                incoming=incoming,
+            )
+        finally:
+            log_dedup_stats(self.dedup)
+
+    async def _aexecute_all_eager(
+            self, incoming: Optional[AsyncIterable[TaskItem]] = None
+    ) -> List[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.max_workers)
+        prepared: Dict[str, asyncio.Future] = {}
+
+        async def run_prepare(task: TaskItem) -> List[Dict[str, Any]]:
+            async with semaphore:
+                with usage_scope(self._get_task_usage(task.id)), start_span(
+                        "task.prepare", **{"task.id": task.id}
+                ):
+                    return await self._aprocess_task(
+                        task.description, self.prompt_map, None, task.id
                     )
 
-                    # Process completed tasks
-                    for future in done:
-                        task_id = futures.pop(future)
-                        try:
-                            result = future.result()
-                            self.results[task_id] = result
-                            # Update the result field of the TaskItem object
-                            if result["status"] == "completed" and "result" in result:
-                                self.tasks[task_id].result = result["result"]
-                        except Exception as e:
-                            logger.error(
-                                f"Task {task_id} failed with exception: {str(e)}"
-                            )
-                            self.failed_tasks.add(task_id)
-                else:
-                    # No tasks can be executed right now, wait a bit before checking again
-                    time.sleep(0.1)
-
-                    # Check if we're in a deadlock (all remaining tasks have dependencies that can't be met)
-                    if not self.in_progress:
-                        remaining = (
-                                set(self.tasks.keys())
-                                - self.completed_tasks
-                                - self.failed_tasks
-                        )
-                        if remaining:
-                            logger.warning(
-                                f"Possible deadlock detected. Remaining tasks: {remaining}"
-                            )
-                            break
+        def prepare(task: TaskItem):
+            if self._restored_result(task) is None:
+                prepared[task.id] = asyncio.ensure_future(run_prepare(task))
 
-        # Return results as a list
-        return list(self.results.values())
+        async def prepare_incoming():
+            async for task in incoming:
+                prepare(task)
+                yield task
+
+        # Created in priority order, so the semaphore admits them in that order
+        for task_id in self._prepare_order():
+            prepare(self.tasks[task_id])
+        try:
+            return await execute_dag_async(
+                self.tasks,
+                self.max_workers,
+                lambda task_id: self._arun_task(task_id, prepared.get(task_id)),
+                self.results,
+                self.scheduler,
+                incoming=prepare_incoming() if incoming is not None else None,
+            )
+        finally:
+            for future in prepared.values():
+                future.cancel()
 
     def get_status(self) -> Dict[str, Any]:
         """
@@ -265,20 +731,19 @@ class TaskExecutor:
         Returns:
             Dictionary containing task execution status
         """
-        return {
-            "total": len(self.tasks),
-            "completed": len(self.completed_tasks),
-            "failed": len(self.failed_tasks),
-            "in_progress": len(self.in_progress),
-            "pending": len(self.tasks)
-                       - len(self.completed_tasks)
-                       - len(self.failed_tasks)
-                       - len(self.in_progress),
-        }
+        return self.scheduler.get_status()
 
 
 def execute_tasks(
-        tasks: List[TaskItem], prompt_map, max_workers: int = 5
+        tasks: List[TaskItem],
+        prompt_map,
+        max_workers: int = 5,
+        stream: bool = False,
+        llm_concurrency: Optional[int] = None,
+        eager_planning: Optional[bool] = None,
+        incoming: Optional[Iterable[TaskItem]] = None,
+        journal: Optional[RunJournal] = None,
+        sink: Optional[ResultSink] = None,
 ) -> List[Dict[str, Any]]:
     """
     Convenience function to execute a list of tasks.
@@ -286,12 +751,70 @@ def execute_tasks(
     Args:
         tasks: List of TaskItem objects
         max_workers: Maximum number of concurrent workers
+        stream: Stream generations to output/partial/ and record time-to-first-token
+        llm_concurrency: Global limit on concurrent LLM calls (see TaskExecutor)
+        eager_planning: Only gate the reduce step on dependencies (see TaskExecutor)
+        incoming: Tasks still being produced, started as they arrive
+        journal: Checkpoint journal of the run (see TaskExecutor)
+        sink: Result sink receiving each result as it finishes
+
+    Returns:
+        List of task results (retained_result of each when a sink is given)
+    """
+    executor = TaskExecutor(
+        tasks,
+        max_workers,
+        prompt_map,
+        stream=stream,
+        llm_concurrency=llm_concurrency,
+        eager_planning=eager_planning,
+        journal=journal,
+        sink=sink,
+    )
+    return executor.execute_all(incoming)
+
+
+async def execute_tasks_async(
+        tasks: List[TaskItem],
+        prompt_map,
+        max_workers: int = 5,
+        subtask_workers: int = 3,
+        stream: bool = False,
+        llm_concurrency: Optional[int] = None,
+        eager_planning: Optional[bool] = None,
+        incoming: Optional[AsyncIterable[TaskItem]] = None,
+        journal: Optional[RunJournal] = None,
+        sink: Optional[ResultSink] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Async version of execute_tasks: one event loop instead of nested thread pools.
+
+    Args:
+        tasks: List of TaskItem objects
+        max_workers: Maximum number of concurrently running top-level tasks
+        subtask_workers: Only used for the default of llm_concurrency
+        stream: Stream generations to output/partial/ and record time-to-first-token
+        llm_concurrency: Global limit on concurrent LLM calls (see TaskExecutor)
+        eager_planning: Only gate the reduce step on dependencies (see TaskExecutor)
+        incoming: Tasks still being produced, started as they arrive
+        journal: Checkpoint journal of the run (see TaskExecutor)
+        sink: Result sink receiving each result as it finishes
 
     Returns:
-        List of task results
+        List of task results (retained_result of each when a sink is given)
     """
-    executor = TaskExecutor(tasks, max_workers, prompt_map)
-    return executor.execute_all()
+    executor = TaskExecutor(
+        tasks,
+        max_workers,
+        prompt_map,
+        subtask_workers,
+        stream=stream,
+        llm_concurrency=llm_concurrency,
+        eager_planning=eager_planning,
+        journal=journal,
+        sink=sink,
+    )
+    return await executor.aexecute_all(incoming)
 
 
 def find_leaf_tasks(task_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -330,9 +853,14 @@ if __name__ == "__main__":
         TaskItem(id="task5", description="Fifth task"),
     ]
 
+    # Results are appended as each task finishes
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_filename = f"task_results_{timestamp}.jsonl"
+
     # Execute tasks
     logger.info("Starting task execution...")
-    results = execute_tasks(sample_tasks, prompt_map=None)
+    with ResultSink(output_filename) as sink:
+        results = execute_tasks(sample_tasks, prompt_map=None, sink=sink)
 
     # Display results
     logger.info(f"Execution completed with {len(results)} results")
@@ -347,12 +875,4 @@ if __name__ == "__main__":
             error = result.get("error", "Unknown error")
             logger.error(f"Task {task_id}: {description} - Failed: {error}")
 
-    # Write results to JSON file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_filename = f"task_results_{timestamp}.json"
-    logger.info(f"Writing results to {output_filename}")
-
-    with open(output_filename, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-
-    logger.info(f"Results successfully written to {output_filename}")
+    logger.info(f"Results written to {output_filename}")
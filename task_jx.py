@@ -1,16 +1,9 @@
 from typing import List, Dict, Any, Optional
 
-from langchain_core.messages import SystemMessage
 from pydantic import BaseModel, Field
-from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
-import logging
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
-from langchain_core.output_parsers import JsonOutputParser
+from tools.json_repair import aparse_llm_json, parse_llm_json
+from tools.retry_policy import acall_with_retries, call_with_retries
+from tools.prompt_registry import get_chat_prompt
 
 
 class TaskDefinition(BaseModel):
@@ -36,8 +29,21 @@ class TaskJxGenerator:
 
     def __init__(self, prompt_map: Dict[str, str]):
         self.prompt_map = prompt_map
-        self.parser = PydanticOutputParser(pydantic_object=List[TaskDefinition])
-        self.output_parser = JsonOutputParser()
+
+    def _build_messages(self, task: str, roles: List[str]):
+        chat_prompt = get_chat_prompt(
+            self.prompt_map, "task_jx", "taks: {task}\nrole: {role}"
+        )
+
+        return chat_prompt.format_messages(task=task, role=",".join(roles))
+
+    def _parse_response(self, response, llm) -> List[TaskDefinition]:
+        parsed_json = parse_llm_json(response, "task_jx", llm)
+        return [TaskDefinition.model_validate(role_dict) for role_dict in parsed_json]
+
+    async def _aparse_response(self, response, llm) -> List[TaskDefinition]:
+        parsed_json = await aparse_llm_json(response, "task_jx", llm)
+        return [TaskDefinition.model_validate(role_dict) for role_dict in parsed_json]
 
     def generator_task(self, task: str, roles: List[str]) -> List[TaskDefinition]:
         """
@@ -49,40 +55,25 @@ class TaskJxGenerator:
         Returns:
             A list of structured role definitions.
         """
-        llm = get_llm_model()
-        system_prompt_str = self.prompt_map.get("task_jx", "")
-
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessage(content=system_prompt_str),
-                HumanMessagePromptTemplate.from_template("taks: {task}\nrole: {role}"),
-            ]
+        messages = self._build_messages(task, roles)
+        return call_with_retries(
+            "task_jx", lambda llm: llm.invoke(messages), self._parse_response, default=[]
         )
 
-        messages = chat_prompt.format_messages(task=task, role=",".join(roles))
-
-        max_retries = 3
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                response = llm(messages)
-                parsed_json = self.output_parser.invoke(response)
-                role_definitions = [
-                    TaskDefinition(**role_dict) for role_dict in parsed_json
-                ]
-                return role_definitions
-
-            except Exception as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    logging.warning(f"Attempt {retry_count} failed: {e}. Retrying...")
-                else:
-                    logging.error(
-                        f"Failed to parse LLM response after {max_retries} attempts: {e}"
-                    )
-                    if "response" in locals():
-                        logging.error(
-                            f"Raw Response: {getattr(response, 'content', str(response))}"
-                        )
-                    return []
+    async def agenerator_task(
+        self, task: str, roles: List[str]
+    ) -> List[TaskDefinition]:
+        """
+        Async version of generator_task, using ainvoke.
+
+        Args:
+            task: High-level task description.
+            roles: Names of the roles available for the subtasks.
+
+        Returns:
+            A list of structured task definitions.
+        """
+        messages = self._build_messages(task, roles)
+        return await acall_with_retries(
+            "task_jx", lambda llm: llm.ainvoke(messages), self._aparse_response, default=[]
+        )
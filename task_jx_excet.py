@@ -1,5 +1,8 @@
-import logging
+import asyncio
 import concurrent.futures
+import contextvars
+import logging
+import os
 from typing import List, Dict, Any, Optional, Set
 import time
 import json
@@ -10,6 +13,23 @@ from GenRoleSys import RoleDefinition
 from llm_task_ex import LLMTaskProcessor
 from task_jx import TaskDefinition
 from task_result import TaskResultCalculator
+from tools.dag_scheduler import (
+    ConcurrencyBudget,
+    DagScheduler,
+    DispatchPolicy,
+    execute_dag,
+    execute_dag_async,
+    get_dispatch_policy,
+)
+from tools.checkpoint import RunJournal
+from tools.dep_context import DependencyContext, DependencyContextBuilder, log_dependency_context
+from tools.latency_stats import estimate_latency
+from tools.llm_generatory import get_model_name
+from tools.metrics import TaskUsage, usage_scope
+from tools.result_sink import ResultSink, retained_result
+from tools.streaming import PartialResultWriter, log_stream_metrics
+from tools.subtask_dedup import SubtaskDeduplicator, dependency_fingerprint
+from tools.tracing import set_span_attributes, start_span
 
 
 logging.basicConfig(
@@ -30,22 +50,76 @@ class TaskJxExecutor:
         roles,
         prompt_map,
         max_workers: int = 5,
+        stream_dir: Optional[str] = None,
+        budget: Optional[ConcurrencyBudget] = None,
+        pool: Optional[concurrent.futures.Executor] = None,
+        policy: Optional[DispatchPolicy] = None,
+        batch_formats: Optional[bool] = None,
+        journal: Optional[RunJournal] = None,
+        journal_task: Optional[str] = None,
+        sink: Optional[ResultSink] = None,
+        dedup: Optional[SubtaskDeduplicator] = None,
     ):
         """
         Initialize the task executor.
 
         Args:
             tasks: List of TaskDefinition objects to execute
-            max_workers: Maximum number of worker threads
+            max_workers: Maximum number of worker threads (concurrent
+                         coroutines when run with aexecute_all)
+            stream_dir: Stream each task's generation into <stream_dir>/<task id>.md
+                        and record time-to-first-token per task
+            budget: Concurrency budget shared with other executors; every LLM
+                    call holds one slot (unlimited by default)
+            pool: Thread pool shared with other executors, instead of a
+                  private pool of max_workers threads
+            policy: Order in which ready tasks are dispatched; defaults to
+                    SCHEDULER_POLICY (critical path weighted by stage latency)
+            batch_formats: Compute the output formats of all tasks in one request
+                           when the run starts instead of one request per task;
+                           defaults to TASK_RESULT_BATCH (on unless set to 0)
+            journal: Run journal receiving each completed task; tasks it
+                     already holds are restored instead of executed
+            journal_task: Id of the top-level task these tasks belong to
+            sink: Receives every task result as soon as the task finishes; only
+                  the fields of retained_result are kept in self.results
+            dedup: Shared with the executors of the other top-level tasks, so
+                   that a near-identical subtask of theirs is executed once
         """
         self.tasks = {task.id: task for task in tasks}
         self.max_workers = max_workers
         self.results = {}
-        self.completed_tasks: Set[str] = set()
-        self.failed_tasks: Set[str] = set()
-        self.in_progress: Set[str] = set()
+        self.batch_formats = (
+            os.getenv("TASK_RESULT_BATCH", "1") != "0"
+            if batch_formats is None
+            else batch_formats
+        )
+        self.scheduler = DagScheduler(
+            self.tasks, policy or get_dispatch_policy(weight=self._estimate_task_latency)
+        )
+        self.completed_tasks: Set[str] = self.scheduler.completed
+        self.failed_tasks: Set[str] = self.scheduler.failed
+        self.in_progress: Set[str] = self.scheduler.running
         self.roles: List[RoleDefinition] = roles
         self.prompt_map = prompt_map
+        self.stream_dir = stream_dir
+        self.budget = budget or ConcurrencyBudget()
+        self.context_builder = DependencyContextBuilder(model=get_model_name("task_execute"))
+        # Builders of roles routed to another model (see _get_context_builder)
+        self._context_builders: Dict[str, DependencyContextBuilder] = {}
+        self.pool = pool
+        self.journal = journal
+        self.journal_task = journal_task
+        self.sink = sink
+        self.dedup = dedup
+        # Future (thread or asyncio) resolving to {task id: output format}
+        self._result_formats = None
+
+    def _estimate_task_latency(self, task_id: str) -> float:
+        """Expected duration of a subtask: execution call (+ output format call unless batched)."""
+        if self.batch_formats:
+            return estimate_latency("task_execute")
+        return estimate_latency("task_result") + estimate_latency("task_execute")
 
     def _find_role_by_name(self, role_name: str) -> Optional[RoleDefinition]:
         """
@@ -63,30 +137,174 @@ class TaskJxExecutor:
         logger.warning(f"Role '{role_name}' not found")
         return None
 
-    def _are_dependencies_met(self, task_id: str) -> bool:
+    def _execute_task(self, task_id: str) -> Dict[str, Any]:
         """
-        Check if all dependencies for a task have been completed.
+        Execute a single task.
 
         Args:
-            task_id: ID of the task to check
+            task_id: ID of the task to execute
 
         Returns:
-            True if all dependencies are met, False otherwise
+            Result of the task execution
         """
         task = self.tasks.get(task_id)
+
         if not task:
-            logger.warning(f"Task {task_id} not found")
-            return False
+            logger.error(f"Task {task_id} not found")
+            return {"status": "failed", "error": "Task not found", "task_id": task_id}
 
-        for dep_id in task.dependsOn:
-            if dep_id not in self.completed_tasks:
-                return False
+        restored = self._restored_result(task)
+        if restored is not None:
+            return restored
 
-        return True
+        # Find the role responsible for this task
+        role = self._find_role_by_name(task.role_name)
+        if not role:
+            return {
+                "task_id": task_id,
+                "status": "failed",
+                "error": f"Role '{task.role_name}' not found",
+                "description": task.description,
+                "dependsOn": task.dependsOn,
+            }
 
-    def _execute_task(self, task_id: str) -> Dict[str, Any]:
+        try:
+            logger.info(
+                f"Executing task {task_id}: {task.description} with role {task.role_name}"
+            )
+
+            # Gather results from dependent tasks
+            dependency_results = self._collect_dependency_results(task)
+
+            # Process the task with its dependencies
+            attributes = {"task.id": task_id, "role_name": task.role_name}
+            with start_span("subtask", **attributes) as span, usage_scope() as usage:
+                result = self._process_deduplicated(task, role, dependency_results, usage)
+                result["usage"] = usage.to_dict()
+                set_span_attributes(span, "usage", result["usage"])
+            self._record(result)
+            logger.info(f"Task {task_id} completed")
+            return result
+
+        except Exception as e:
+            logger.error(f"Error executing task {task_id}: {str(e)}", exc_info=True)
+            return {
+                "task_id": task_id,
+                "status": "failed",
+                "error": str(e),
+                "description": task.description,
+                "dependsOn": task.dependsOn,
+            }
+
+    def _process_deduplicated(
+        self,
+        task: TaskDefinition,
+        role: RoleDefinition,
+        dependency_results: Dict[str, Any],
+        usage: TaskUsage,
+    ) -> Dict[str, Any]:
+        """process_task, unless another top-level task runs the same subtask."""
+        if self.dedup is None:
+            return self.process_task(task, role, dependency_results)
+        claim = self.dedup.claim(
+            self.journal_task,
+            task.id,
+            task.role_name,
+            task.description,
+            dependency_fingerprint(dependency_results),
+        )
+        if not claim.owner:
+            shared = claim.future.result()
+            if shared is not None:
+                return self.dedup.share(claim, shared, task, role.prompt_text)
+            return self.process_task(task, role, dependency_results)
+
+        result = None
+        try:
+            result = self.process_task(task, role, dependency_results)
+            return result
+        finally:
+            self.dedup.resolve(claim, result, usage.calls)
+
+    async def _aprocess_deduplicated(
+        self,
+        task: TaskDefinition,
+        role: RoleDefinition,
+        dependency_results: Dict[str, Any],
+        usage: TaskUsage,
+    ) -> Dict[str, Any]:
+        """Async version of _process_deduplicated."""
+        if self.dedup is None:
+            return await self.aprocess_task(task, role, dependency_results)
+        claim = self.dedup.claim(
+            self.journal_task,
+            task.id,
+            task.role_name,
+            task.description,
+            dependency_fingerprint(dependency_results),
+        )
+        if not claim.owner:
+            shared = await asyncio.wrap_future(claim.future)
+            if shared is not None:
+                return self.dedup.share(claim, shared, task, role.prompt_text)
+            return await self.aprocess_task(task, role, dependency_results)
+
+        result = None
+        try:
+            result = await self.aprocess_task(task, role, dependency_results)
+            return result
+        finally:
+            self.dedup.resolve(claim, result, usage.calls)
+
+    def _run_task(self, task_id: str) -> Dict[str, Any]:
+        return self._write_result(self._execute_task(task_id))
+
+    async def _arun_task(self, task_id: str) -> Dict[str, Any]:
+        return self._write_result(await self._aexecute_task(task_id))
+
+    def _write_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if self.sink is None:
+            return result
+        self.sink.write_subtask(self.journal_task, result)
+        # The full result is in the sink file now
+        return retained_result(result)
+
+    def _restored_result(self, task: TaskDefinition) -> Optional[Dict[str, Any]]:
+        """Result of the task from the journal of an interrupted run, if any."""
+        if self.journal is None:
+            return None
+        result = self.journal.subtask_result(self.journal_task, task.id, task.description)
+        if result is not None:
+            logger.info(f"Task {task.id} restored from checkpoint")
+        return result
+
+    def _record(self, result: Dict[str, Any]):
+        if self.journal is not None:
+            self.journal.record_subtask(self.journal_task, result)
+
+    def _pending_tasks(self) -> List[TaskDefinition]:
+        """Tasks that still have to be executed (not restored from the journal)."""
+        if self.journal is None:
+            return list(self.tasks.values())
+        return [
+            task
+            for task in self.tasks.values()
+            if self.journal.subtask_result(self.journal_task, task.id, task.description) is None
+        ]
+
+    def _collect_dependency_results(self, task: TaskDefinition) -> Dict[str, Any]:
+        dependency_results = {}
+        for dep_id in task.dependsOn:
+            if dep_id in self.results:
+                dependency_results[dep_id] = {
+                    "description": self.results[dep_id]["description"],
+                    "result": self.results[dep_id]["result"],
+                }
+        return dependency_results
+
+    async def _aexecute_task(self, task_id: str) -> Dict[str, Any]:
         """
-        Execute a single task.
+        Async version of _execute_task.
 
         Args:
             task_id: ID of the task to execute
@@ -100,7 +318,10 @@ class TaskJxExecutor:
             logger.error(f"Task {task_id} not found")
             return {"status": "failed", "error": "Task not found", "task_id": task_id}
 
-        # Find the role responsible for this task
+        restored = self._restored_result(task)
+        if restored is not None:
+            return restored
+
         role = self._find_role_by_name(task.role_name)
         if not role:
             return {
@@ -115,29 +336,21 @@ class TaskJxExecutor:
             logger.info(
                 f"Executing task {task_id}: {task.description} with role {task.role_name}"
             )
-            self.in_progress.add(task_id)
 
-            # Gather results from dependent tasks
-            dependency_results = {}
-            for dep_id in task.dependsOn:
-                if dep_id in self.results:
-                    dependency_results[dep_id] = {
-                        "description": self.results[dep_id]["description"],
-                        "result": self.results[dep_id]["result"],
-                    }
-
-            # Process the task with its dependencies
-            result = self.process_task(task, role, dependency_results)
-
-            self.in_progress.remove(task_id)
-            self.completed_tasks.add(task_id)
+            dependency_results = self._collect_dependency_results(task)
+            attributes = {"task.id": task_id, "role_name": task.role_name}
+            with start_span("subtask", **attributes) as span, usage_scope() as usage:
+                result = await self._aprocess_deduplicated(
+                    task, role, dependency_results, usage
+                )
+                result["usage"] = usage.to_dict()
+                set_span_attributes(span, "usage", result["usage"])
+            self._record(result)
             logger.info(f"Task {task_id} completed")
             return result
 
         except Exception as e:
             logger.error(f"Error executing task {task_id}: {str(e)}", exc_info=True)
-            self.in_progress.remove(task_id)
-            self.failed_tasks.add(task_id)
             return {
                 "task_id": task_id,
                 "status": "failed",
@@ -146,9 +359,54 @@ class TaskJxExecutor:
                 "dependsOn": task.dependsOn,
             }
 
+    def _get_stream_writer(self, task_id: str) -> Optional[PartialResultWriter]:
+        if not self.stream_dir:
+            return None
+        return PartialResultWriter(os.path.join(self.stream_dir, f"{task_id}.md"))
+
+    def _build_result(
+        self,
+        task: TaskDefinition,
+        role: RoleDefinition,
+        task_result_format: str,
+        result: str,
+        llm_task_proc: LLMTaskProcessor,
+        context: DependencyContext,
+    ) -> Dict[str, Any]:
+        # Create result with dependency information
+        task_result = {
+            "task_id": task.id,
+            "status": "completed",
+            "description": task.description,
+            "role_name": task.role_name,
+            "role_sys_prompt": role.prompt_text,
+            "dependsOn": task.dependsOn,
+            "task_result_format": task_result_format,
+            "result": result,
+        }
+        if llm_task_proc.stream_metrics is not None:
+            log_stream_metrics(f"Task {task.id}", llm_task_proc.stream_metrics)
+            task_result["stream_metrics"] = llm_task_proc.stream_metrics.model_dump()
+        if context.original_tokens:
+            log_dependency_context(f"Task {task.id}", context)
+            task_result["dependency_context"] = context.model_dump(exclude={"text"})
+        return task_result
+
+    def _get_context_builder(self, role: RoleDefinition) -> DependencyContextBuilder:
+        """Builder counting tokens for the model the role's subtasks are sent to."""
+        model = get_model_name("task_execute", role.role_name)
+        if model == self.context_builder.model:
+            return self.context_builder
+        builder = self._context_builders.get(model)
+        if builder is None:
+            builder = self._context_builders.setdefault(
+                model, DependencyContextBuilder(model=model)
+            )
+        return builder
+
     def handler_dep_result(self, dependency_results: Dict[str, Any]):
         """
-        Format dependency results into a markdown string.
+        Format dependency results into a markdown string within the token budget.
 
         Args:
             dependency_results: Dictionary of dependency results where keys are task IDs
@@ -157,20 +415,41 @@ class TaskJxExecutor:
         Returns:
             Formatted markdown string of dependency results
         """
-        if not dependency_results:
-            return ""
+        return self.context_builder.build(dependency_results).text
+
+    def _calculate_result_formats(self) -> Dict[str, str]:
+        with self.budget.slot():
+            return TaskResultCalculator(self.prompt_map).calculate_results(
+                self._pending_tasks()
+            )
 
-        md_output = "## Previous Task Results\n\n"
+    async def _acalculate_result_formats(self) -> Dict[str, str]:
+        async with self.budget.aslot():
+            return await TaskResultCalculator(self.prompt_map).acalculate_results(
+                self._pending_tasks()
+            )
 
-        for task_id, task_data in dependency_results.items():
-            description = task_data.get("description", "No description")
-            result = task_data.get("result", "No result")
+    def _get_result_format(self, task: TaskDefinition, role: RoleDefinition) -> str:
+        """Output format of a task: from the batch request, else its own request."""
+        if self._result_formats is not None:
+            formats = self._result_formats.result()
+            if task.id in formats:
+                return formats[task.id]
 
-            md_output += f"### Task {task_id}: {description}\n\n"
-            md_output += f"{result}\n\n"
-            md_output += "---\n\n"
+        task_result_calc = TaskResultCalculator(self.prompt_map)
+        with self.budget.slot():
+            return task_result_calc.calculate_result(task.description, role.role_name)
 
-        return md_output
+    async def _aget_result_format(self, task: TaskDefinition, role: RoleDefinition) -> str:
+        """Async version of _get_result_format."""
+        if self._result_formats is not None:
+            formats = await self._result_formats
+            if task.id in formats:
+                return formats[task.id]
+
+        task_result_calc = TaskResultCalculator(self.prompt_map)
+        async with self.budget.aslot():
+            return await task_result_calc.acalculate_result(task.description, role.role_name)
 
     def process_task(
         self,
@@ -189,14 +468,9 @@ class TaskJxExecutor:
         Returns:
             Result of the task execution
         """
-        time.sleep(1)
-
         # step1:
-        # 需要确认任务的产物的提示词
-        task_result_calc = TaskResultCalculator(self.prompt_map)
-        task_result_format = task_result_calc.calculate_result(
-            task.description, role.role_name
-        )
+        # 需要确认任务的产物的提示词（优先使用整个计划批量计算的结果）
+        task_result_format = self._get_result_format(task, role)
         # step2:
         # 任务执行的系统提示词
         # role.prompt_text
@@ -204,89 +478,111 @@ class TaskJxExecutor:
         # task :
         # 最终产物:
 
-        llm_task_proc = LLMTaskProcessor(role.prompt_text)
+        llm_task_proc = LLMTaskProcessor(role.prompt_text, role.role_name)
 
-        result = llm_task_proc.process_task(
-            self.handler_dep_result(dependency_results),
-            task.description,
-            task_result_format,
+        with self.budget.slot():
+            # 依赖结果按 token 预算裁剪（摘要请求也占用这个并发槽位）
+            context = self._get_context_builder(role).build(dependency_results)
+            result = llm_task_proc.process_task(
+                context.text,
+                task.description,
+                task_result_format,
+                writer=self._get_stream_writer(task.id),
+            )
+
+        return self._build_result(
+            task, role, task_result_format, result, llm_task_proc, context
         )
 
-        # Create result with dependency information
-        return {
-            "task_id": task.id,
-            "status": "completed",
-            "description": task.description,
-            "role_name": task.role_name,
-            "role_sys_prompt": role.prompt_text,
-            "dependsOn": task.dependsOn,
-            "task_result_format": task_result_format,
-            "result": result,
-        }
+    async def aprocess_task(
+        self,
+        task: TaskDefinition,
+        role: RoleDefinition,
+        dependency_results: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Async version of process_task.
+
+        Args:
+            task: The task to process
+            role: The role responsible for the task
+            dependency_results: Results from dependent tasks
+
+        Returns:
+            Result of the task execution
+        """
+        task_result_format = await self._aget_result_format(task, role)
+
+        llm_task_proc = LLMTaskProcessor(role.prompt_text, role.role_name)
+
+        async with self.budget.aslot():
+            context = await self._get_context_builder(role).abuild(dependency_results)
+            result = await llm_task_proc.aprocess_task(
+                context.text,
+                task.description,
+                task_result_format,
+                writer=self._get_stream_writer(task.id),
+            )
+
+        return self._build_result(
+            task, role, task_result_format, result, llm_task_proc, context
+        )
 
     def execute_all(self) -> List[Dict[str, Any]]:
         """
         Execute all tasks in parallel while respecting their dependencies.
 
+        Each task is dispatched as soon as its last dependency completes.
+        With batch_formats, the output formats of the whole plan are requested
+        in the background while the first tasks are dispatched.
+
         Returns:
             List of task results
         """
+        if not self.batch_formats or not self._pending_tasks():
+            return execute_dag(
+                self.tasks,
+                self.max_workers,
+                self._run_task,
+                self.results,
+                self.scheduler,
+                pool=self.pool,
+            )
+
         with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_workers
-        ) as executor:
-            futures = {}
-
-            while len(self.completed_tasks) + len(self.failed_tasks) < len(self.tasks):
-                # Find tasks that can be executed (dependencies met and not in progress)
-                for task_id, task in self.tasks.items():
-                    if (
-                        task_id not in self.completed_tasks
-                        and task_id not in self.failed_tasks
-                        and task_id not in self.in_progress
-                        and self._are_dependencies_met(task_id)
-                    ):
-                        # Submit task for execution
-                        futures[executor.submit(self._execute_task, task_id)] = task_id
-
-                # Wait for at least one task to complete if there are futures
-                if futures:
-                    done, _ = concurrent.futures.wait(
-                        futures.keys(), return_when=concurrent.futures.FIRST_COMPLETED
-                    )
-
-                    # Process completed tasks
-                    for future in done:
-                        task_id = futures.pop(future)
-                        try:
-                            result = future.result()
-                            self.results[task_id] = result
-                            # Update the result field of the TaskDefinition object
-                            if result["status"] == "completed" and "result" in result:
-                                self.tasks[task_id].result = result["result"]
-                        except Exception as e:
-                            logger.error(
-                                f"Task {task_id} failed with exception: {str(e)}"
-                            )
-                            self.failed_tasks.add(task_id)
-                else:
-                    # No tasks can be executed right now, wait a bit before checking again
-                    time.sleep(0.1)
-
-                    # Check if we're in a deadlock (all remaining tasks have dependencies that can't be met)
-                    if not self.in_progress:
-                        remaining = (
-                            set(self.tasks.keys())
-                            - self.completed_tasks
-                            - self.failed_tasks
-                        )
-                        if remaining:
-                            logger.warning(
-                                f"Possible deadlock detected. Remaining tasks: {remaining}"
-                            )
-                            break
-
-        # Return results as a list
-        return list(self.results.values())
+            max_workers=1, thread_name_prefix="result-format"
+        ) as format_executor:
+            self._result_formats = format_executor.submit(
+                contextvars.copy_context().run, self._calculate_result_formats
+            )
+            return execute_dag(
+                self.tasks,
+                self.max_workers,
+                self._run_task,
+                self.results,
+                self.scheduler,
+                pool=self.pool,
+            )
+
+    async def aexecute_all(self) -> List[Dict[str, Any]]:
+        """
+        Execute all tasks as coroutines on the running event loop.
+
+        Each task starts as soon as its dependencies complete; at most
+        max_workers tasks run at the same time.
+
+        Returns:
+            List of task results
+        """
+        if self.batch_formats and self._pending_tasks():
+            self._result_formats = asyncio.ensure_future(self._acalculate_result_formats())
+        try:
+            return await execute_dag_async(
+                self.tasks, self.max_workers, self._arun_task, self.results, self.scheduler
+            )
+        finally:
+            if self._result_formats is not None and not self._result_formats.done():
+                self._result_formats.cancel()
 
     def get_status(self) -> Dict[str, Any]:
         """
@@ -295,16 +591,7 @@ class TaskJxExecutor:
         Returns:
             Dictionary containing task execution status
         """
-        return {
-            "total": len(self.tasks),
-            "completed": len(self.completed_tasks),
-            "failed": len(self.failed_tasks),
-            "in_progress": len(self.in_progress),
-            "pending": len(self.tasks)
-            - len(self.completed_tasks)
-            - len(self.failed_tasks)
-            - len(self.in_progress),
-        }
+        return self.scheduler.get_status()
 
 
 def execute_tasks_jx(
@@ -312,6 +599,13 @@ def execute_tasks_jx(
     roles,
     prompt_map,
     max_workers: int = 5,
+    stream_dir: Optional[str] = None,
+    budget: Optional[ConcurrencyBudget] = None,
+    pool: Optional[concurrent.futures.Executor] = None,
+    journal: Optional[RunJournal] = None,
+    journal_task: Optional[str] = None,
+    sink: Optional[ResultSink] = None,
+    dedup: Optional[SubtaskDeduplicator] = None,
 ) -> List[Dict[str, Any]]:
     """
     Convenience function to execute a list of tasks.
@@ -319,11 +613,71 @@ def execute_tasks_jx(
     Args:
         tasks: List of TaskDefinition objects
         max_workers: Maximum number of concurrent workers
+        stream_dir: Directory receiving streamed partial results (None disables streaming)
+        budget: Concurrency budget shared across executors
+        pool: Thread pool shared across executors
+        journal: Run journal to record completed tasks in and restore them from
+        journal_task: Id of the top-level task the tasks belong to
+        sink: Result sink receiving each task result as it finishes
+        dedup: Deduplicator shared across top-level tasks
 
     Returns:
-        List of task results
+        List of task results (retained_result of each when a sink is given)
     """
     executor = TaskJxExecutor(
-        tasks=tasks, roles=roles, max_workers=max_workers, prompt_map=prompt_map
+        tasks=tasks,
+        roles=roles,
+        max_workers=max_workers,
+        prompt_map=prompt_map,
+        stream_dir=stream_dir,
+        budget=budget,
+        pool=pool,
+        journal=journal,
+        journal_task=journal_task,
+        sink=sink,
+        dedup=dedup,
     )
     return executor.execute_all()
+
+
+async def execute_tasks_jx_async(
+    tasks: List[TaskDefinition],
+    roles,
+    prompt_map,
+    max_workers: int = 5,
+    stream_dir: Optional[str] = None,
+    budget: Optional[ConcurrencyBudget] = None,
+    journal: Optional[RunJournal] = None,
+    journal_task: Optional[str] = None,
+    sink: Optional[ResultSink] = None,
+    dedup: Optional[SubtaskDeduplicator] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Async version of execute_tasks_jx.
+
+    Args:
+        tasks: List of TaskDefinition objects
+        max_workers: Maximum number of concurrently running tasks
+        stream_dir: Directory receiving streamed partial results (None disables streaming)
+        budget: Concurrency budget shared across executors
+        journal: Run journal to record completed tasks in and restore them from
+        journal_task: Id of the top-level task the tasks belong to
+        sink: Result sink receiving each task result as it finishes
+        dedup: Deduplicator shared across top-level tasks
+
+    Returns:
+        List of task results (retained_result of each when a sink is given)
+    """
+    executor = TaskJxExecutor(
+        tasks=tasks,
+        roles=roles,
+        max_workers=max_workers,
+        prompt_map=prompt_map,
+        stream_dir=stream_dir,
+        budget=budget,
+        journal=journal,
+        journal_task=journal_task,
+        sink=sink,
+        dedup=dedup,
+    )
+    return await executor.aexecute_all()
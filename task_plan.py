@@ -0,0 +1,119 @@
+from typing import List, Dict, Optional
+
+from pydantic import BaseModel, Field
+from tools.json_repair import aparse_llm_json, parse_llm_json
+from tools.retry_policy import InvalidOutputError, acall_with_retries, call_with_retries
+from tools.prompt_registry import get_chat_prompt
+
+from GenRoleSys import RoleDefinition
+from task_jx import TaskDefinition
+
+
+class TaskPlan(BaseModel):
+    """
+    角色和子任务一次性生成的结果
+
+    由 PlanGenerator 在一次请求中生成，等价于 RoleGenerator + TaskJxGenerator 两次调用的结果。
+    """
+
+    roles: List[RoleDefinition] = Field(description="执行任务所需的角色")
+    tasks: List[TaskDefinition] = Field(description="分配给这些角色的子任务")
+
+
+def validate_plan(plan: TaskPlan) -> TaskPlan:
+    """
+    Check that a plan can be executed as is.
+
+    Role names referenced by tasks are matched case-insensitively and rewritten
+    to the spelling used in `roles`.
+
+    Args:
+        plan: Parsed plan
+
+    Returns:
+        The plan with normalised role names
+
+    Raises:
+        InvalidOutputError: If the plan is empty, references an unknown role
+                            or task, or contains duplicate task ids
+    """
+    if not plan.roles:
+        raise InvalidOutputError("Plan has no roles")
+    if not plan.tasks:
+        raise InvalidOutputError("Plan has no tasks")
+
+    role_names = {role.role_name.strip().lower(): role.role_name for role in plan.roles}
+    task_ids = [task.id for task in plan.tasks]
+    duplicates = {task_id for task_id in task_ids if task_ids.count(task_id) > 1}
+    if duplicates:
+        raise InvalidOutputError(f"Duplicate task ids: {sorted(duplicates)}")
+
+    unknown_roles = []
+    unknown_deps = []
+    for task in plan.tasks:
+        role_name = role_names.get(task.role_name.strip().lower())
+        if role_name is None:
+            unknown_roles.append(task.role_name)
+        else:
+            task.role_name = role_name
+        unknown_deps += [dep_id for dep_id in task.dependsOn if dep_id not in task_ids]
+
+    if unknown_roles:
+        raise InvalidOutputError(f"Tasks reference unknown roles: {unknown_roles}")
+    if unknown_deps:
+        raise InvalidOutputError(f"Tasks depend on unknown task ids: {unknown_deps}")
+    return plan
+
+
+class PlanGenerator:
+    """Generates the roles and the subtask plan of a task in a single LLM call"""
+
+    def __init__(self, prompt_map: Dict[str, str]):
+        self.prompt_map = prompt_map
+
+    def _build_messages(self, task: str):
+        chat_prompt = get_chat_prompt(self.prompt_map, "task_plan", "{task}")
+
+        return chat_prompt.format_messages(task=task)
+
+    def _parse_response(self, response, llm) -> TaskPlan:
+        # model_validate: an array or scalar is a ValidationError (retried), not a TypeError
+        parsed_json = parse_llm_json(response, "task_plan", llm)
+        return validate_plan(TaskPlan.model_validate(parsed_json))
+
+    async def _aparse_response(self, response, llm) -> TaskPlan:
+        parsed_json = await aparse_llm_json(response, "task_plan", llm)
+        return validate_plan(TaskPlan.model_validate(parsed_json))
+
+    def generate_plan(self, task: str) -> Optional[TaskPlan]:
+        """
+        Generates roles and subtasks for a high-level task description.
+
+        Invalid plans (e.g. a task assigned to a role that was not generated)
+        are retried like unparsable responses.
+
+        Args:
+            task: High-level task description.
+
+        Returns:
+            The validated plan, or None if no valid plan was produced.
+        """
+        messages = self._build_messages(task)
+        return call_with_retries(
+            "task_plan", lambda llm: llm.invoke(messages), self._parse_response
+        )
+
+    async def agenerate_plan(self, task: str) -> Optional[TaskPlan]:
+        """
+        Async version of generate_plan, using ainvoke.
+
+        Args:
+            task: High-level task description.
+
+        Returns:
+            The validated plan, or None if no valid plan was produced.
+        """
+        messages = self._build_messages(task)
+        return await acall_with_retries(
+            "task_plan", lambda llm: llm.ainvoke(messages), self._aparse_response
+        )
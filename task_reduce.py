@@ -1,7 +1,13 @@
 from typing import Optional
 from pydantic import BaseModel, Field
 from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
+from tools.retry_policy import acall_with_retries, call_with_retries
+from tools.streaming import (
+    PartialResultWriter,
+    StreamMetrics,
+    acollect_stream,
+    collect_stream,
+)
 import logging
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_community.callbacks import get_openai_callback
@@ -72,9 +78,27 @@ class TaskReducer:
         self.dependency_results = dependency_results
         # 当前任务的子任务执行结果
         self.subtask_results = subtask_results
+        # 流式生成的耗时指标（process_task 传入 writer 时填充）
+        self.stream_metrics: Optional[StreamMetrics] = None
+
+    def _build_messages(self):
+        template = (PROMPT_TEMPLATE
+                    .replace("[maintask]",self.task_description)
+                    .replace("[result]",self.dependency_results)
+                    .replace("[subtask]",self.subtask_results))
+
+        chat_prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessage(content=SYS_PROMPT),
+                HumanMessage(content=template),
+            ]
+        )
+
+        return chat_prompt.format_messages()
 
     def process_task(
         self,
+        writer: Optional[PartialResultWriter] = None,
     ) -> str:
         """
         Processes the given task and generates a result using LLM.
@@ -83,39 +107,60 @@ class TaskReducer:
             PREVIOUS_TASK_RESULTS (str): Context from previous tasks.
             TASK (str): Current task to perform.
             FINAL_PRODUCT_DESCRIPTION (str): Description of desired output.
+            writer: Stream the generation into this writer as it arrives and
+                    record time-to-first-token in self.stream_metrics.
 
         Returns:
             str: Generated result or empty string if failed.
         """
-        llm = get_llm_model()
+        messages = self._build_messages()
 
-        # Select the appropriate template based on if previous task results exist
-        template = (PROMPT_TEMPLATE
-                    .replace("[maintask]",self.task_description)
-                    .replace("[result]",self.dependency_results)
-                    .replace("[subtask]",self.subtask_results))
+        def call(llm) -> str:
+            if writer is None:
+                return llm.invoke(messages).content
 
-        # If using template 2, no need for PREVIOUS_TASK_RESULTS parameter
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessage(content=SYS_PROMPT),
-                HumanMessage(content=template),
-            ]
-        )
+            # Streaming mode: chunks are written as they arrive
+            writer.start()
+            result, self.stream_metrics = collect_stream(llm.stream(messages), writer.write)
+            return result
 
-        messages = chat_prompt.format_messages()
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = llm(messages)
-                return response.content
-            except Exception as e:
-                logging.warning(f"Attempt {attempt + 1} failed: {e}")
-                if attempt == max_retries - 1:
-                    logging.error("All retry attempts failed.")
-                    logging.error(f"Last exception: {e}")
-                    return ""
+        try:
+            return call_with_retries("task_reduce", call, default="")
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def aprocess_task(
+        self,
+        writer: Optional[PartialResultWriter] = None,
+    ) -> str:
+        """
+        Async version of process_task, using ainvoke.
+
+        Args:
+            writer: Stream the generation into this writer as it arrives.
+
+        Returns:
+            str: Generated result or empty string if failed.
+        """
+        messages = self._build_messages()
+
+        async def call(llm) -> str:
+            if writer is None:
+                return (await llm.ainvoke(messages)).content
+
+            # Streaming mode: chunks are written as they arrive
+            writer.start()
+            result, self.stream_metrics = await acollect_stream(
+                llm.astream(messages), writer.write
+            )
+            return result
+
+        try:
+            return await acall_with_retries("task_reduce", call, default="")
+        finally:
+            if writer is not None:
+                writer.close()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,11 @@
+import json
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
-from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
+from tools.retry_policy import InvalidOutputError, acall_with_retries, call_with_retries
 import logging
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
+from tools.prompt_registry import get_chat_prompt
 from langchain_core.output_parsers import JsonOutputParser
 
 
@@ -18,6 +14,14 @@ class TaskResultCalculator:
 
     def __init__(self, prompt_map: Dict[str, str]):
         self.prompt_map = prompt_map
+        self.output_parser = JsonOutputParser()
+
+    def _build_messages(self, task: str, role: str):
+        chat_prompt = get_chat_prompt(
+            self.prompt_map, "task_result", "task: {task} \nrole={role}", system_is_template=True
+        )
+
+        return chat_prompt.format_messages(task=task,role=role)
 
     def calculate_result(self, task: str,role:str) -> str:
         """
@@ -29,35 +33,99 @@ class TaskResultCalculator:
         Returns:
             A string representing the task execution result.
         """
-        llm = get_llm_model()
-        system_prompt_str = self.prompt_map.get("task_result", "")
+        messages = self._build_messages(task, role)
+        return call_with_retries(
+            "task_result",
+            lambda llm: llm.invoke(messages),
+            lambda response, llm: response.content,
+            default="",
+            role=role,
+        )
+
+    async def acalculate_result(self, task: str, role: str) -> str:
+        """
+        Async version of calculate_result, using ainvoke.
+
+        Args:
+            task: Task to calculate result for.
+            role: Role responsible for the task.
 
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_prompt_str),
-                HumanMessagePromptTemplate.from_template("task: {task} \nrole={role}"),
-            ]
+        Returns:
+            A string representing the task execution result.
+        """
+        messages = self._build_messages(task, role)
+        return await acall_with_retries(
+            "task_result",
+            lambda llm: llm.ainvoke(messages),
+            lambda response, llm: response.content,
+            default="",
+            role=role,
         )
 
-        messages = chat_prompt.format_messages(task=task,role=role)
-
-        max_retries = 3
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                response = llm(messages)
-                return response.content
-            except Exception as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    logging.warning(f"Attempt {retry_count} failed: {e}. Retrying...")
-                else:
-                    logging.error(
-                        f"Failed to parse LLM response after {max_retries} attempts: {e}"
-                    )
-                    if "response" in locals():
-                        logging.error(
-                            f"Raw Response: {getattr(response, 'content', str(response))}"
-                        )
-                    return ""
+    def _build_batch_messages(self, tasks: List[Any]):
+        system_prompt_str = self.prompt_map.get("task_result_batch", "")
+        task_list = [
+            {"id": task.id, "task": task.description, "role": task.role_name}
+            for task in tasks
+        ]
+        return [
+            SystemMessage(content=system_prompt_str),
+            HumanMessage(content=json.dumps(task_list, ensure_ascii=False)),
+        ]
+
+    def _parse_batch_response(self, content: str, tasks: List[Any]) -> Dict[str, str]:
+        parsed = self.output_parser.parse(content)
+        if not isinstance(parsed, dict):
+            raise InvalidOutputError(f"Expected a JSON object, got {type(parsed).__name__}")
+        formats = {
+            str(task_id): str(value).strip()
+            for task_id, value in parsed.items()
+            if value and str(value).strip()
+        }
+        missing = [task.id for task in tasks if task.id not in formats]
+        if missing:
+            logging.warning(f"Batch output format response is missing tasks: {missing}")
+        return formats
+
+    def calculate_results(self, tasks: List[Any]) -> Dict[str, str]:
+        """
+        Calculates the output formats of all tasks of a plan in one request.
+
+        Args:
+            tasks: TaskDefinition objects (anything with id, description and role_name)
+
+        Returns:
+            Dict of task id to output format; tasks the response did not cover
+            are left out, callers fall back to calculate_result for them.
+        """
+        if not tasks:
+            return {}
+
+        messages = self._build_batch_messages(tasks)
+        return call_with_retries(
+            "task_result_batch",
+            lambda llm: llm.invoke(messages),
+            lambda response, llm: self._parse_batch_response(response.content, tasks),
+            default={},
+        )
+
+    async def acalculate_results(self, tasks: List[Any]) -> Dict[str, str]:
+        """
+        Async version of calculate_results, using ainvoke.
+
+        Args:
+            tasks: TaskDefinition objects (anything with id, description and role_name)
+
+        Returns:
+            Dict of task id to output format
+        """
+        if not tasks:
+            return {}
+
+        messages = self._build_batch_messages(tasks)
+        return await acall_with_retries(
+            "task_result_batch",
+            lambda llm: llm.ainvoke(messages),
+            lambda response, llm: self._parse_batch_response(response.content, tasks),
+            default={},
+        )
@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+from langchain_core.messages import AIMessage
+
+# Modules live at the repository root (task_*.py) and in tools/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import retry_policy  # noqa: E402
+from tools.llm_generatory import clear_llm_pool  # noqa: E402
+from tools.prompt_registry import get_prompt_registry  # noqa: E402
+
+PROMPT_FILES = {
+    "role_system": "prompt/gen_role_sys.md",
+    "task_jx": "prompt/task_jx.md",
+    "task_result": "prompt/task_result.md",
+    "task_result_batch": "prompt/task_result_batch.md",
+    "task_plan": "prompt/task_plan.md",
+    "task_split": "prompt/task_split.md",
+}
+
+
+@pytest.fixture
+def mock_provider(monkeypatch, tmp_path):
+    """Offline mock model (tools.mock_llm) with no cache, journal or hedging."""
+    for name, value in {
+        "PROVIDER": "mock",
+        "API_KEYS": "mock-key",
+        "MODEL_ROUTES": "",
+        "LLM_CACHE": "0",
+        "CHECKPOINT": "0",
+        "HEDGE": "0",
+        "JSON_FIX": "0",
+        "RETRY_BASE_DELAY": "0",
+        "LLM_LATENCY_STATS": str(tmp_path / "latency.json"),
+    }.items():
+        monkeypatch.setenv(name, value)
+    clear_llm_pool()
+    yield
+    clear_llm_pool()
+
+
+@pytest.fixture
+def prompt_map(monkeypatch):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.chdir(root)
+    return get_prompt_registry(PROMPT_FILES)
+
+
+class QueuedModel:
+    """Stage client answering with the queued replies (an exception is raised)."""
+
+    def __init__(self, replies, fallback: int):
+        self.replies = replies
+        self.fallback = fallback
+        self.metadata = {"api_key": "key-1"}
+
+    def invoke(self, messages):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return AIMessage(content=reply)
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+@pytest.fixture
+def queued_replies(monkeypatch):
+    """
+    Replace the stage clients of the retry helpers with QueuedModel.
+
+    Returns:
+        Tuple of (replies to queue, fallback position of every client created)
+    """
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0")
+    monkeypatch.setenv("JSON_FIX", "0")
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget(0.0, 100))
+    replies, fallbacks = [], []
+
+    def get_client(stage, role, fallback):
+        fallbacks.append(fallback)
+        return QueuedModel(replies, fallback)
+
+    monkeypatch.setattr(retry_policy, "_get_stage_client", get_client)
+    return replies, fallbacks
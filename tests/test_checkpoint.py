@@ -0,0 +1,106 @@
+import pytest
+
+from task_exect import execute_tasks
+from tools import retry_policy
+from tools.checkpoint import RunJournal
+from tools.result_sink import ResultSink, read_results
+from tools.task_splitter import TaskItem
+
+TASKS = [
+    TaskItem(id="1", description="Install Linux"),
+    TaskItem(id="2", description="Learn ls and cd", dependsOn=["1"]),
+]
+
+
+def _subtask(subtask_id: str, status: str = "completed") -> dict:
+    return {
+        "task_id": subtask_id,
+        "status": status,
+        "description": f"Step {subtask_id}",
+        "dependsOn": [],
+        "result": "done",
+        "role_name": "Developer",
+        "role_sys_prompt": "You write code.",
+        "usage": {"calls": 1},
+    }
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    """Stage clients handed out to the retry helpers, one entry per attempt."""
+    calls = []
+    get_client = retry_policy._get_stage_client
+
+    def counting(stage, role, fallback):
+        calls.append(stage)
+        return get_client(stage, role, fallback)
+
+    monkeypatch.setattr(retry_policy, "_get_stage_client", counting)
+    return calls
+
+
+def test_task_children_are_restored_from_their_subtask_records(tmp_path):
+    journal = RunJournal("run", str(tmp_path))
+    journal.record_subtask("1", _subtask("a"))
+    journal.record_task(
+        {
+            "task_id": "1",
+            "status": "completed",
+            "description": "Install Linux",
+            # What the executor holds with a result sink: retained_result of each child
+            "children": [
+                {"task_id": "a", "status": "completed", "result": "done"},
+                {"task_id": "b", "status": "failed", "error": "boom"},
+            ],
+        }
+    )
+
+    restored = RunJournal.resume("run", str(tmp_path)).task_result("1", "Install Linux")
+
+    assert restored["children"][0] == _subtask("a")
+    assert restored["children"][1] == {"task_id": "b", "status": "failed", "error": "boom"}
+
+
+def test_task_with_a_lost_subtask_record_is_redone(tmp_path):
+    journal = RunJournal("run", str(tmp_path))
+    journal.record_subtask("1", _subtask("a"))
+    journal.record_task(
+        {"task_id": "1", "status": "completed", "description": "x", "children": [_subtask("a")]}
+    )
+    lines = open(journal.path, encoding="utf-8").read().splitlines()
+    with open(journal.path, "w", encoding="utf-8") as f:
+        f.write(lines[1] + "\n")
+
+    assert RunJournal.resume("run", str(tmp_path)).task_result("1", "x") is None
+
+
+def test_resumed_run_skips_journaled_tasks(mock_provider, prompt_map, model_calls, tmp_path):
+    first = execute_tasks(TASKS, prompt_map, journal=RunJournal("run", str(tmp_path)))
+    assert [result["status"] for result in first] == ["completed", "completed"]
+    assert model_calls
+
+    model_calls.clear()
+    resumed = execute_tasks(TASKS, prompt_map, journal=RunJournal.resume("run", str(tmp_path)))
+
+    assert model_calls == []
+    assert resumed == first
+
+
+def test_resume_with_a_sink_writes_the_full_children(
+        mock_provider, prompt_map, model_calls, tmp_path
+):
+    with ResultSink(str(tmp_path / "first.jsonl")) as sink:
+        execute_tasks(TASKS, prompt_map, journal=RunJournal("run", str(tmp_path)), sink=sink)
+    first = read_results(str(tmp_path / "first.jsonl"))
+
+    model_calls.clear()
+    with ResultSink(str(tmp_path / "resumed.jsonl")) as sink:
+        execute_tasks(
+            TASKS, prompt_map, journal=RunJournal.resume("run", str(tmp_path)), sink=sink
+        )
+    resumed = read_results(str(tmp_path / "resumed.jsonl"))
+
+    assert model_calls == []
+    assert resumed == first
+    child = resumed[0]["children"][0]
+    assert child["role_name"] and child["role_sys_prompt"] and child["usage"]
@@ -0,0 +1,204 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from tools.dag_scheduler import (
+    ConcurrencyBudget,
+    CriticalPathPolicy,
+    DagScheduler,
+    DependentsPolicy,
+    DispatchPolicy,
+    execute_dag,
+    execute_dag_async,
+    find_unschedulable_tasks,
+    get_dispatch_policy,
+)
+
+
+class Task(BaseModel):
+    id: str
+    dependsOn: List[str] = Field(default_factory=list)
+    result: str = ""
+
+
+def _graph(*edges: str):
+    """Tasks from "id:dep,dep" strings."""
+    tasks = {}
+    for edge in edges:
+        task_id, _, deps = edge.partition(":")
+        tasks[task_id] = Task(id=task_id, dependsOn=[d for d in deps.split(",") if d])
+    return tasks
+
+
+def _drain(scheduler: DagScheduler) -> List[str]:
+    ready = []
+    while True:
+        task_id = scheduler.pop_ready()
+        if task_id is None:
+            return ready
+        ready.append(task_id)
+
+
+def test_task_is_ready_once_its_last_dependency_completes():
+    scheduler = DagScheduler(_graph("a", "b", "c:a,b"))
+
+    assert sorted(_drain(scheduler)) == ["a", "b"]
+    assert scheduler.finish("a", True) == []
+    assert scheduler.finish("b", True) == ["c"]
+    assert _drain(scheduler) == ["c"]
+    scheduler.finish("c", True)
+    assert scheduler.done
+    assert scheduler.get_status()["completed"] == 3
+
+
+def test_failure_skips_all_transitive_dependents():
+    scheduler = DagScheduler(_graph("a", "b:a", "c:b", "d"))
+
+    assert sorted(_drain(scheduler)) == ["a", "d"]
+    assert scheduler.finish("a", False) == []
+    scheduler.finish("d", True)
+
+    assert scheduler.failed == {"a"}
+    assert scheduler.skipped == {"b", "c"}
+    assert scheduler.done
+    assert _drain(scheduler) == []
+
+
+def test_cycles_and_missing_dependencies_are_skipped_up_front():
+    tasks = _graph("a", "b:c", "c:b", "d:missing", "e:d")
+
+    assert find_unschedulable_tasks(tasks) == {"b", "c", "d", "e"}
+    scheduler = DagScheduler(tasks)
+    assert scheduler.skipped == {"b", "c", "d", "e"}
+    assert _drain(scheduler) == ["a"]
+
+
+def test_added_task_waits_for_a_dependency_not_added_yet():
+    scheduler = DagScheduler({})
+
+    assert not scheduler.add_task("b", Task(id="b", dependsOn=["a"]))
+    assert scheduler.add_task("a", Task(id="a"))
+    assert _drain(scheduler) == ["a"]
+    assert scheduler.finish("a", True) == ["b"]
+
+
+def test_added_task_depending_on_a_failed_task_is_skipped():
+    scheduler = DagScheduler(_graph("a"))
+    _drain(scheduler)
+    scheduler.finish("a", False)
+
+    assert not scheduler.add_task("b", Task(id="b", dependsOn=["a"]))
+    assert "b" in scheduler.skipped
+
+
+def test_close_skips_tasks_still_waiting_for_a_task_never_added():
+    scheduler = DagScheduler({})
+    scheduler.add_task("b", Task(id="b", dependsOn=["a"]))
+
+    assert scheduler.close() == {"b"}
+    assert scheduler.done
+
+
+def test_critical_path_runs_the_head_of_the_longest_chain_first():
+    tasks = _graph("leaf", "head", "mid:head", "tail:mid")
+    scheduler = DagScheduler(tasks, CriticalPathPolicy())
+
+    assert _drain(scheduler) == ["head", "leaf"]
+
+
+def test_critical_path_weighs_chains_by_expected_duration():
+    tasks = _graph("slow", "fast", "after_fast:fast")
+    weights = {"slow": 5.0, "fast": 1.0, "after_fast": 1.0}
+    scheduler = DagScheduler(tasks, CriticalPathPolicy(weights.get))
+
+    assert _drain(scheduler) == ["slow", "fast"]
+
+
+def test_dependents_policy_runs_the_most_depended_on_task_first():
+    tasks = _graph("a", "b", "c:b", "d:b", "e:a")
+    scheduler = DagScheduler(tasks, DependentsPolicy())
+
+    assert _drain(scheduler) == ["b", "a"]
+
+
+def test_dispatch_policy_is_picked_by_name(monkeypatch):
+    monkeypatch.delenv("SCHEDULER_POLICY", raising=False)
+    assert isinstance(get_dispatch_policy(), CriticalPathPolicy)
+    assert isinstance(get_dispatch_policy("dependents"), DependentsPolicy)
+    assert type(get_dispatch_policy("unknown")) is DispatchPolicy
+
+
+def _execute(task_id: str):
+    if task_id == "bad":
+        raise RuntimeError("boom")
+    return {"task_id": task_id, "status": "completed", "result": task_id.upper()}
+
+
+def test_execute_dag_records_results_and_skips_dependents_of_failures():
+    tasks = _graph("a", "b:a", "bad", "c:bad")
+    results = {}
+
+    execute_dag(tasks, 2, _execute, results)
+
+    assert results["a"]["status"] == "completed"
+    assert results["b"]["status"] == "completed"
+    assert results["bad"] == {"task_id": "bad", "status": "failed", "error": "boom"}
+    assert "c" not in results
+    assert tasks["a"].result == "A"
+
+
+def test_execute_dag_async_matches_the_thread_pool_version():
+    tasks = _graph("a", "b:a", "bad", "c:bad")
+    results = {}
+
+    async def execute(task_id: str):
+        return _execute(task_id)
+
+    asyncio.run(execute_dag_async(tasks, 2, execute, results))
+
+    assert set(results) == {"a", "b", "bad"}
+    assert results["bad"]["status"] == "failed"
+
+
+def test_execute_dag_adds_incoming_tasks_as_they_arrive():
+    incoming = [Task(id="b", dependsOn=["a"]), Task(id="a")]
+    results = {}
+
+    execute_dag({}, 2, _execute, results, incoming=iter(incoming))
+
+    assert list(results) == ["a", "b"]
+
+
+def test_concurrency_budget_caps_calls_across_threads():
+    budget = ConcurrencyBudget(2)
+
+    def call():
+        with budget.slot():
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert budget.peak == 2
+    assert budget.in_use == 0
+
+
+def test_concurrency_budget_of_zero_or_less_is_unlimited():
+    budget = ConcurrencyBudget(-1)
+
+    async def call():
+        async with budget.aslot():
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(call() for _ in range(5)))
+
+    asyncio.run(run())
+
+    assert budget.peak == 5
@@ -0,0 +1,82 @@
+import logging
+
+import pytest
+
+from tools import dep_context
+from tools.dep_context import FULL, TRUNCATE, DependencyContextBuilder
+from tools.llm_generatory import get_model_name
+
+DEPENDENCIES = {
+    "1": {"description": "Install Linux", "result": "word " * 400},
+    "2": {"description": "Learn ls", "result": "ls lists files."},
+}
+
+
+@pytest.fixture
+def chars_as_tokens(monkeypatch):
+    """One token per character, so no tokenizer has to be loaded."""
+    counted = []
+
+    def count_tokens(text, model=None):
+        counted.append(model)
+        return len(text)
+
+    monkeypatch.setattr(dep_context, "count_tokens", count_tokens)
+    monkeypatch.setattr(dep_context, "_get_encoding", lambda model: None)
+    return counted
+
+
+def test_without_a_budget_results_are_passed_in_full_and_not_counted(chars_as_tokens):
+    context = DependencyContextBuilder(max_tokens=0, model="m").build(DEPENDENCIES)
+
+    assert chars_as_tokens == []
+    assert "### Task 1: Install Linux" in context.text
+    assert "word " * 400 in context.text
+    assert context.strategies == {"1": FULL, "2": FULL}
+    assert context.original_tokens == 0
+
+
+def test_results_over_the_budget_are_truncated_and_logged(chars_as_tokens, caplog):
+    builder = DependencyContextBuilder(max_tokens=600, strategy=TRUNCATE, model="m")
+
+    with caplog.at_level(logging.WARNING):
+        context = builder.build(DEPENDENCIES)
+
+    assert context.strategies == {"1": TRUNCATE, "2": FULL}
+    assert "ls lists files." in context.text
+    assert "tokens omitted" in context.text
+    assert context.saved_tokens > 0
+    assert set(chars_as_tokens) == {"m"}
+    assert "were shortened" in caplog.text
+
+
+def test_model_name_follows_the_provider_and_the_stage_route(monkeypatch):
+    monkeypatch.delenv("MODEL_NAME", raising=False)
+    monkeypatch.setenv("MODEL_ROUTES", "")
+    monkeypatch.setenv("PROVIDER", "google")
+    assert get_model_name("task_reduce").startswith("gemini")
+
+    monkeypatch.setenv(
+        "MODEL_ROUTES",
+        '{"task_execute": {"model": "small", "roles": {"Writer": {"model": "big"}}}}',
+    )
+    assert get_model_name("task_execute") == "small"
+    assert get_model_name("task_execute", "Writer") == "big"
+    assert get_model_name("task_reduce").startswith("gemini")
+
+
+def test_subtask_context_is_counted_for_the_model_of_its_role(monkeypatch, mock_provider):
+    from GenRoleSys import RoleDefinition
+    from task_jx_excet import TaskJxExecutor
+
+    monkeypatch.setenv(
+        "MODEL_ROUTES", '{"task_execute": {"roles": {"Writer": {"model": "mock-big"}}}}'
+    )
+    executor = TaskJxExecutor(tasks=[], roles=[], prompt_map={})
+
+    writer = executor._get_context_builder(RoleDefinition(role_name="Writer", prompt_text=""))
+    other = executor._get_context_builder(RoleDefinition(role_name="Dev", prompt_text=""))
+
+    assert writer.model == "mock-big"
+    assert other is executor.context_builder
+    assert other.model == "mock-model"
@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+import pytest
+
+from GenRoleSys import RoleGenerator
+from task_jx import TaskJxGenerator
+
+ROLES = [{"role_name": "Developer", "prompt_text": "You write code."}]
+TASKS = [{"id": "1", "description": "Write the script", "role_name": "Developer"}]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_role_list_with_non_object_items_is_retried_up_the_cascade(
+        queued_replies, prompt_map, use_async
+):
+    queued, fallbacks = queued_replies
+    queued.extend([json.dumps(["Developer"]), json.dumps(ROLES)])
+    generator = RoleGenerator(prompt_map)
+
+    if use_async:
+        roles = asyncio.run(generator.agenerate_roles("Write a script"))
+    else:
+        roles = generator.generate_roles("Write a script")
+
+    assert [role.role_name for role in roles] == ["Developer"]
+    assert fallbacks == [0, 1]
+
+
+def test_subtask_list_with_non_object_items_is_retried_up_the_cascade(
+        queued_replies, prompt_map
+):
+    queued, fallbacks = queued_replies
+    queued.extend([json.dumps([1, 2]), json.dumps(TASKS)])
+
+    tasks = TaskJxGenerator(prompt_map).generator_task("Write a script", ["Developer"])
+
+    assert [task.id for task in tasks] == ["1"]
+    assert fallbacks == [0, 1]
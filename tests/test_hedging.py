@@ -0,0 +1,49 @@
+import concurrent.futures
+import time
+
+import pytest
+
+from tools import hedging
+from tools.hedging import HedgeBudget, HedgedModel
+
+
+class SleepingModel:
+    def __init__(self, seconds: float, answer: str):
+        self.seconds = seconds
+        self.answer = answer
+        self.calls = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.seconds)
+        return self.answer
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(hedging, "hedge_delay", lambda stage: 0.05)
+    monkeypatch.setattr(hedging, "_budget", HedgeBudget(1.0))
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(hedging, "_executor", pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def test_slow_primary_is_hedged_and_the_backup_answer_returned(executor):
+    backup = SleepingModel(0, "backup")
+
+    answer = HedgedModel("task_plan", SleepingModel(0.5, "primary"), lambda: backup).invoke([])
+
+    assert answer == "backup"
+    assert backup.calls == 1
+
+
+def test_time_waiting_for_a_worker_does_not_count_towards_the_delay(executor):
+    backup = SleepingModel(0, "backup")
+    for _ in range(2):
+        executor.submit(time.sleep, 0.2)
+
+    answer = HedgedModel("task_plan", SleepingModel(0, "primary"), lambda: backup).invoke([])
+
+    assert answer == "primary"
+    assert backup.calls == 0
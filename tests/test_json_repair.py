@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from tools.json_repair import (
+    FAST,
+    REPAIRED,
+    SALVAGED,
+    JsonRepairError,
+    extract_json,
+    parse_json,
+    parse_llm_json,
+    repair_json,
+    salvage_json_array,
+)
+from tools.retry_policy import InvalidOutputError
+
+
+class FixingModel:
+    """Stands in for the stage client answering the "fix this JSON" request."""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.requests = []
+
+    def invoke(self, messages):
+        self.requests.append(messages)
+        return AIMessage(content=self.reply)
+
+
+def test_extract_json_prefers_a_fenced_block():
+    assert extract_json('Here:\n```json\n[1, 2]\n```\nDone') == "[1, 2]"
+    assert extract_json('```json\n{"a": 1}') == '{"a": 1}'
+    assert extract_json('Sure! {"a": [1]}') == '{"a": [1]}'
+
+
+def test_valid_json_takes_the_fast_path():
+    assert parse_json('```json\n[{"id": "1"}]\n```') == ([{"id": "1"}], FAST)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('[{"id": "1",}, {"id": "2"},]', [{"id": "1"}, {"id": "2"}]),
+        ('{"text": "say "hi" now"}', {"text": 'say "hi" now'}),
+        ('{"text": "line one\nline two"}', {"text": "line one\nline two"}),
+        ('[1, 2] trailing words', [1, 2]),
+        ('{"a": {"b": 1}', {"a": {"b": 1}}),
+        ('{"a": "unterminated', {"a": "unterminated"}),
+        ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ],
+)
+def test_common_syntax_errors_are_repaired(text, expected):
+    assert parse_json(text) == (expected, REPAIRED)
+
+
+def test_truncated_array_drops_the_half_written_item():
+    text = '[{"id": "1", "description": "a"}, {"id": "2", "descr'
+
+    assert json.loads(repair_json(text)) == [{"id": "1", "description": "a"}]
+    assert parse_json(text) == ([{"id": "1", "description": "a"}], REPAIRED)
+
+
+def test_salvage_keeps_the_elements_before_the_first_broken_one():
+    text = '[{"id": "1"}, {"id": "2"}, {"id": 3 4}, {"id": "5"}]'
+
+    assert salvage_json_array(text) == [{"id": "1"}, {"id": "2"}]
+    assert parse_json(text) == ([{"id": "1"}, {"id": "2"}], SALVAGED)
+
+
+@pytest.mark.parametrize("text", ["no json here", '[{"id": 3 4}]'])
+def test_nothing_usable_raises(text):
+    assert salvage_json_array(text) == []
+    with pytest.raises(JsonRepairError):
+        parse_json(text)
+
+
+def test_repair_error_is_an_output_error():
+    with pytest.raises(InvalidOutputError):
+        parse_json("not json at all")
+
+
+def test_unrepairable_output_is_sent_back_to_the_model(monkeypatch):
+    monkeypatch.setenv("JSON_FIX", "1")
+    model = FixingModel('[{"id": "1"}]')
+
+    value = parse_llm_json(AIMessage(content="not json at all"), "task_split", model)
+
+    assert value == [{"id": "1"}]
+    assert len(model.requests) == 1
+    assert "not json at all" in model.requests[0][0].content
+
+
+def test_fix_request_failing_too_raises(monkeypatch):
+    monkeypatch.setenv("JSON_FIX", "1")
+
+    with pytest.raises(JsonRepairError):
+        parse_llm_json(AIMessage(content="nope"), "task_split", FixingModel("still nope"))
+
+
+def test_fix_request_is_skipped_when_disabled(monkeypatch):
+    monkeypatch.setenv("JSON_FIX", "0")
+    model = FixingModel("[]")
+
+    with pytest.raises(JsonRepairError):
+        parse_llm_json(AIMessage(content="nope"), "task_split", model)
+    assert model.requests == []
+
@@ -0,0 +1,87 @@
+import pytest
+from langchain_core.outputs import Generation
+
+from tools import llm_cache, retry_policy
+from tools.llm_cache import SQLiteResponseStore, StageCache, cache_attempt
+from tools.retry_policy import InvalidOutputError, call_with_retries
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return StageCache(SQLiteResponseStore(str(tmp_path / "cache.sqlite")), "task_plan")
+
+
+class CachedModel:
+    """Answers like a LangChain model with a cache: lookup first, update on a miss."""
+
+    def __init__(self, cache: StageCache, replies):
+        self.cache = cache
+        self.replies = replies
+        self.requests = 0
+        self.metadata = {"api_key": "key-1"}
+
+    def invoke(self, messages):
+        cached = self.cache.lookup("prompt", "model")
+        if cached is not None:
+            return cached[0].text
+        self.requests += 1
+        reply = self.replies.pop(0)
+        self.cache.update("prompt", "model", [Generation(text=reply)])
+        return reply
+
+
+def _parse(response, llm):
+    if response == "bad":
+        raise InvalidOutputError("not a plan")
+    return response
+
+
+def _stored(cache: StageCache) -> bool:
+    return cache.store.get(cache.store.make_key("prompt", "model")) is not None
+
+
+def test_writes_inside_an_attempt_wait_for_commit(cache):
+    with cache_attempt() as attempt:
+        cache.update("prompt", "model", [Generation(text="ok")])
+        assert not _stored(cache)
+    assert not _stored(cache)
+
+    attempt.commit()
+
+    assert cache.lookup("prompt", "model")[0].text == "ok"
+
+
+def test_attempt_without_lookup_is_not_answered_from_the_cache(cache):
+    cache.update("prompt", "model", [Generation(text="ok")])
+
+    with cache_attempt(lookup=False):
+        assert cache.lookup("prompt", "model") is None
+    assert cache.lookup("prompt", "model") is not None
+
+
+def test_only_the_accepted_response_is_cached(cache, monkeypatch):
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0")
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget(0.0, 100))
+    model = CachedModel(cache, ["bad", "ok"])
+    monkeypatch.setattr(retry_policy, "_get_stage_client", lambda stage, role, fallback: model)
+
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse) == "ok"
+    assert model.requests == 2
+
+    # A later run is answered from the cache with the accepted response
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse) == "ok"
+    assert model.requests == 2
+
+
+def test_failed_response_is_not_replayed_to_the_retry(cache, monkeypatch):
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0")
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget(0.0, 100))
+    # Stored by an earlier run whose parser accepted it
+    cache.update("prompt", "model", [Generation(text="bad")])
+    model = CachedModel(cache, ["ok"])
+    monkeypatch.setattr(retry_policy, "_get_stage_client", lambda stage, role, fallback: model)
+
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse) == "ok"
+    assert model.requests == 1
+    assert cache.lookup("prompt", "model")[0].text == "ok"
+    assert llm_cache.get_cache_stats()["task_plan"]["hits"] >= 1
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from tools import retry_policy
+from tools.model_routing import ModelRoute, get_route_cascade
+from tools.retry_policy import InvalidOutputError, call_with_retries
+
+ROUTES = {
+    "task_plan": {"model": "small", "fallback": ["large"]},
+    "task_execute": {
+        "provider": "mock",
+        "model": "worker",
+        "fallback": "large",
+        "roles": {"Reviewer": {"model": "reviewer"}},
+    },
+}
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    monkeypatch.setenv("MODEL_ROUTES", json.dumps(ROUTES))
+
+
+def test_stage_route_is_followed_by_its_fallbacks(routes):
+    assert [route.model for route in get_route_cascade("task_plan")] == ["small", "large"]
+    assert get_route_cascade("task_split") == [ModelRoute()]
+
+
+def test_role_route_overrides_the_stage_route_and_keeps_its_fallbacks(routes):
+    reviewer, fallback = get_route_cascade("task_execute", "Reviewer")
+
+    assert (reviewer.provider, reviewer.model) == ("mock", "reviewer")
+    assert (fallback.provider, fallback.model) == (None, "large")
+    assert get_route_cascade("task_execute", "Developer")[0].model == "worker"
+
+
+def test_invalid_routes_are_ignored(monkeypatch):
+    monkeypatch.setenv("MODEL_ROUTES", "{not json")
+
+    assert get_route_cascade("task_plan") == [ModelRoute()]
+
+
+def test_output_rejected_by_the_stage_is_retried_on_the_fallback_model(
+        mock_provider, routes, monkeypatch
+):
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget(0.0, 100))
+    models = []
+
+    def parse(response, llm):
+        models.append(llm.model_name)
+        if llm.model_name == "small":
+            raise InvalidOutputError("plan has no tasks")
+        return response.content
+
+    result = call_with_retries(
+        "task_plan", lambda llm: llm.invoke([HumanMessage(content="Plan it")]), parse
+    )
+
+    assert result
+    assert models == ["small", "large"]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from tools import prompt_registry
+from tools.prompt_registry import PromptRegistry, get_chat_prompt
+
+
+@pytest.fixture
+def prompt_file(tmp_path):
+    path = tmp_path / "role.md"
+    path.write_text("You plan {task}.", encoding="utf-8")
+    return path
+
+
+def test_loading_and_compiling_prompts_does_not_count_tokens(monkeypatch, prompt_file):
+    def count_tokens(text, model=None):
+        raise AssertionError("tokenizer used while loading prompts")
+
+    monkeypatch.setattr(prompt_registry, "count_tokens", count_tokens)
+    registry = PromptRegistry({"role_system": str(prompt_file)})
+
+    assert registry["role_system"] == "You plan {task}."
+    prompt = get_chat_prompt(registry, "role_system", "{task}", system_is_template=True)
+    assert prompt.format_messages(task="x")[0].content == "You plan x."
+
+
+def test_tokens_are_counted_once_on_first_use(monkeypatch, prompt_file):
+    counted = []
+
+    def count_tokens(text, model=None):
+        counted.append(text)
+        return 4
+
+    monkeypatch.setattr(prompt_registry, "count_tokens", count_tokens)
+    registry = PromptRegistry({"role_system": str(prompt_file)})
+
+    assert registry.tokens("role_system") == 4
+    assert registry.tokens("role_system") == 4
+    assert registry.tokens("missing") == 0
+    assert counted == ["You plan {task}."]
+
+
+def test_changed_file_is_read_again(prompt_file):
+    registry = PromptRegistry({"role_system": str(prompt_file)}, check_interval=0.0)
+    first = registry.chat_prompt("role_system", "{task}")
+
+    prompt_file.write_text("You review {task}.", encoding="utf-8")
+    stat = prompt_file.stat()
+    os.utime(prompt_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert registry["role_system"] == "You review {task}."
+    assert registry.chat_prompt("role_system", "{task}") is not first
@@ -0,0 +1,48 @@
+import pytest
+
+from tools.rate_limiter import KeyRateLimiter, TokenBucket, _parse_budget
+
+
+def test_bucket_allows_a_burst_of_one_minute_then_waits_for_refills():
+    bucket = TokenBucket(60)
+
+    assert [bucket.reserve(1) for _ in range(60)] == [0.0] * 60
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.consume(1_000_000)
+
+    assert bucket.reserve(1_000_000) == 0.0
+
+
+def test_token_debt_holds_back_requests_until_it_is_repaid():
+    limiter = KeyRateLimiter("key-1", rpm=0, tpm=600)
+
+    assert limiter.acquire(blocking=False)
+    limiter.record_tokens(1200)
+
+    # 600 tokens of debt at 10 tokens per second
+    assert limiter.wait_time() == pytest.approx(60.0, abs=0.5)
+    assert not limiter.acquire(blocking=False)
+
+
+def test_non_blocking_acquire_fails_once_the_requests_per_minute_are_used():
+    limiter = KeyRateLimiter("key-1", rpm=2)
+
+    assert limiter.acquire(blocking=False)
+    assert limiter.acquire(blocking=False)
+    assert not limiter.acquire(blocking=False)
+
+
+def test_budget_is_one_value_for_every_key_or_one_per_key(monkeypatch):
+    keys = ["a", "b"]
+
+    monkeypatch.setenv("RATE_LIMIT_RPM", "60")
+    assert _parse_budget("RATE_LIMIT_RPM", keys) == {"a": 60.0, "b": 60.0}
+    monkeypatch.setenv("RATE_LIMIT_RPM", "60, 30")
+    assert _parse_budget("RATE_LIMIT_RPM", keys) == {"a": 60.0, "b": 30.0}
+    monkeypatch.setenv("RATE_LIMIT_RPM", "60, 30, 10")
+    with pytest.raises(ValueError):
+        _parse_budget("RATE_LIMIT_RPM", keys)
@@ -0,0 +1,62 @@
+from tools.result_sink import RETAINED_FIELDS, ResultSink, read_results, retained_result
+
+
+def _subtask(subtask_id: str, role_name: str = "Developer") -> dict:
+    return {
+        "task_id": subtask_id,
+        "status": "completed",
+        "description": f"Step {subtask_id}",
+        "dependsOn": [],
+        "result": f"result {subtask_id}",
+        "role_name": role_name,
+        "role_sys_prompt": f"You are a {role_name}.",
+        "usage": {"calls": 1},
+    }
+
+
+def _task(task_id: str, children) -> dict:
+    return {
+        "task_id": task_id,
+        "status": "completed",
+        "description": f"Task {task_id}",
+        "dependsOn": [],
+        "children": children,
+        "result": f"reduced {task_id}",
+        "usage": {"calls": 3},
+    }
+
+
+def test_retained_result_keeps_only_the_fields_read_later():
+    retained = retained_result(_task("1", [_subtask("a")]))
+
+    assert set(retained) == set(RETAINED_FIELDS) - {"error"}
+    assert "children" not in retained and "usage" not in retained
+
+
+def test_read_results_rebuilds_what_was_written(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    first = _task("1", [_subtask("a"), _subtask("b", "Tester")])
+    # Subtask "c" was restored from a checkpoint and never written on its own
+    second = _task("2", [_subtask("c")])
+    with ResultSink(path) as sink:
+        for child in first["children"]:
+            sink.write_subtask("1", child)
+        sink.write_task(first)
+        sink.write_task(second)
+
+    assert read_results(path) == [first, second]
+    with open(path, encoding="utf-8") as f:
+        prompts = f.read().count("You are a Developer.")
+    assert prompts == 2  # once per top-level task, not once per subtask
+
+
+def test_subtasks_of_an_unfinished_task_are_grouped_as_incomplete(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    with ResultSink(path) as sink:
+        sink.write_subtask("1", _subtask("a"))
+    with open(path, "ab") as f:
+        f.write(b'{"record": "subtask", "parent": "1", "task_')
+
+    assert read_results(path) == [
+        {"task_id": "1", "status": "incomplete", "children": [_subtask("a")]}
+    ]
@@ -0,0 +1,187 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from tools import retry_policy
+from tools.json_repair import JsonRepairError
+from tools.retry_policy import (
+    FATAL,
+    KEY,
+    OUTPUT,
+    RATE_LIMIT,
+    TRANSIENT,
+    InvalidOutputError,
+    acall_with_retries,
+    call_with_retries,
+    classify_error,
+    retry_after,
+)
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+class Item(BaseModel):
+    id: str
+
+
+def _validation_error() -> ValidationError:
+    with pytest.raises(ValidationError) as info:
+        Item()
+    return info.value
+
+
+@pytest.mark.parametrize(
+    "status, kind",
+    [
+        (429, RATE_LIMIT),
+        (401, KEY),
+        (403, KEY),
+        (408, TRANSIENT),
+        (409, TRANSIENT),
+        (500, TRANSIENT),
+        (503, TRANSIENT),
+        (400, FATAL),
+        (404, FATAL),
+        (422, FATAL),
+    ],
+)
+def test_provider_errors_are_classified_by_status(status, kind):
+    assert classify_error(ProviderError(status)) == kind
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        TimeoutError("read timed out"),
+        ConnectionError("reset"),
+        httpx.ConnectError("refused"),
+        httpx.ReadTimeout("slow"),
+        httpx.RemoteProtocolError("closed"),
+    ],
+)
+def test_network_errors_are_transient(error):
+    assert classify_error(error) == TRANSIENT
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        InvalidOutputError("plan has no tasks"),
+        JsonRepairError("Invalid JSON output"),
+        json.JSONDecodeError("Expecting value", "", 0),
+        _validation_error(),
+    ],
+)
+def test_parse_and_validation_errors_are_output_errors(error):
+    assert classify_error(error) == OUTPUT
+
+
+@pytest.mark.parametrize(
+    "error",
+    [KeyError("role_name"), TypeError("bad argument"), ValueError("other"), RuntimeError()],
+)
+def test_other_errors_are_fatal(error):
+    assert classify_error(error) == FATAL
+
+
+def test_retry_after_reads_seconds_and_http_dates():
+    assert retry_after(ProviderError(429, {"retry-after": "2.5"})) == 2.5
+    assert retry_after(ProviderError(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(ProviderError(429)) is None
+
+
+class FakeModel:
+    """Stage client answering with the next queued outcome."""
+
+    def __init__(self, outcomes, fallback: int):
+        self.outcomes = outcomes
+        self.fallback = fallback
+        self.metadata = {"api_key": "key-1"}
+
+    def invoke(self, messages):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    """Fallback positions of the clients handed out, and the queued outcomes."""
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0")
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget(0.0, 100))
+    created, outcomes = [], []
+
+    def get_client(stage, role, fallback):
+        created.append(fallback)
+        return FakeModel(outcomes, fallback)
+
+    monkeypatch.setattr(retry_policy, "_get_stage_client", get_client)
+    return created, outcomes
+
+
+def _parse(response, llm):
+    if response == "bad":
+        raise InvalidOutputError("not a plan")
+    return response.upper()
+
+
+def test_fatal_error_is_not_retried(clients):
+    created, outcomes = clients
+    outcomes.extend([KeyError("boom"), "never"])
+
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse, default="x") == "x"
+    assert created == [0]
+    assert outcomes == ["never"]
+
+
+def test_transient_error_retries_on_the_same_model(clients):
+    created, outcomes = clients
+    outcomes.extend([ProviderError(503), "ok"])
+
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse) == "OK"
+    assert created == [0, 0]
+
+
+def test_invalid_output_retries_one_step_up_the_fallback_cascade(clients):
+    created, outcomes = clients
+    outcomes.extend(["bad", "bad", "ok"])
+
+    assert call_with_retries("task_plan", lambda llm: llm.invoke([]), _parse) == "OK"
+    assert created == [0, 1, 2]
+
+
+def test_gives_up_after_max_attempts(clients):
+    created, outcomes = clients
+    outcomes.extend([ProviderError(500)] * 3 + ["unused"])
+
+    result = call_with_retries(
+        "task_plan", lambda llm: llm.invoke([]), _parse, default=[], max_attempts=3
+    )
+
+    assert result == []
+    assert len(created) == 3
+
+
+def test_async_version_accepts_an_async_parse(clients):
+    created, outcomes = clients
+    outcomes.extend(["bad", "ok"])
+
+    async def parse(response, llm):
+        return _parse(response, llm)
+
+    result = asyncio.run(acall_with_retries("task_plan", lambda llm: llm.ainvoke([]), parse))
+
+    assert result == "OK"
+    assert created == [0, 1]
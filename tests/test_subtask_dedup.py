@@ -0,0 +1,146 @@
+from types import SimpleNamespace
+
+from tools.subtask_dedup import SubtaskDeduplicator, dependency_fingerprint
+
+PROMPT = "You are a developer."
+DESCRIPTION = "Set up the Python development environment and install dependencies"
+
+
+def _dependencies(result: str):
+    return {"1": {"description": "Choose the Python version", "result": result}}
+
+
+def _completed(task_id: str) -> dict:
+    return {
+        "task_id": task_id,
+        "status": "completed",
+        "description": DESCRIPTION,
+        "result": "done",
+        "usage": {"calls": 2},
+    }
+
+
+def test_identical_subtask_of_another_task_waits_for_the_first():
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    context = dependency_fingerprint(_dependencies("3.12"))
+
+    first = dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+    second = dedup.claim("B", "5", "dev ", DESCRIPTION.upper(), context)
+
+    assert first.owner
+    assert not second.owner
+    assert second.entry is first.entry
+    dedup.resolve(first, _completed("2"), calls=2)
+    task = SimpleNamespace(id="5", description=DESCRIPTION, role_name="Dev", dependsOn=["1"])
+    shared = dedup.share(second, second.future.result(), task, PROMPT)
+    assert shared["task_id"] == "5"
+    assert shared["result"] == "done"
+    assert "usage" not in shared
+    assert shared["deduplicated_from"] == {"task_id": "A", "subtask_id": "2", "similarity": 1.0}
+    assert dedup.stats() == {"exact": 1, "near": 0, "saved_calls": 2}
+
+
+def test_same_description_with_different_dependency_results_is_not_merged():
+    dedup = SubtaskDeduplicator(threshold=0.9)
+
+    first = dedup.claim(
+        "A", "2", "Dev", DESCRIPTION, dependency_fingerprint(_dependencies("3.12"))
+    )
+    second = dedup.claim(
+        "B", "2", "Dev", DESCRIPTION, dependency_fingerprint(_dependencies("2.7"))
+    )
+
+    assert first.owner
+    assert second.owner
+    assert dedup.stats()["exact"] == 0
+
+
+def test_same_role_with_differently_worded_prompts_still_merges():
+    # Every top-level task generates its own prompt for a role
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    context = dependency_fingerprint(_dependencies("3.12"))
+
+    first = dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+    second = dedup.claim("B", "2", "Dev", DESCRIPTION, context)
+    dedup.resolve(first, _completed("2"), calls=2)
+    task = SimpleNamespace(id="2", description=DESCRIPTION, role_name="Dev", dependsOn=["1"])
+    shared = dedup.share(second, second.future.result(), task, "You build Python tools.")
+
+    assert not second.owner
+    assert shared["role_sys_prompt"] == "You build Python tools."
+
+
+def test_same_description_for_another_role_is_not_merged():
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    context = dependency_fingerprint({})
+
+    dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+
+    assert dedup.claim("B", "2", "Tester", DESCRIPTION, context).owner
+
+
+def test_subtasks_of_the_same_task_are_never_merged():
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    context = dependency_fingerprint({})
+
+    dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+    second = dedup.claim("A", "3", "Dev", DESCRIPTION, context)
+
+    assert second.owner
+
+
+def test_near_duplicate_merges_only_above_threshold():
+    near = DESCRIPTION.replace("install dependencies", "install the dependencies")
+    context = dependency_fingerprint({})
+
+    dedup = SubtaskDeduplicator(threshold=0.8)
+    dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+    claim = dedup.claim("B", "2", "Dev", near, context)
+    assert not claim.owner
+    assert 0.8 <= claim.similarity < 1.0
+    assert dedup.stats()["near"] == 1
+
+    exact_only = SubtaskDeduplicator(threshold=1.0)
+    exact_only.claim("A", "2", "Dev", DESCRIPTION, context)
+    assert exact_only.claim("B", "2", "Dev", near, context).owner
+
+
+def test_failed_execution_lets_later_duplicates_run_themselves():
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    context = dependency_fingerprint({})
+
+    first = dedup.claim("A", "2", "Dev", DESCRIPTION, context)
+    waiting = dedup.claim("B", "2", "Dev", DESCRIPTION, context)
+    dedup.resolve(first, {"task_id": "2", "status": "failed", "error": "boom"})
+
+    assert waiting.future.result() is None
+    assert dedup.claim("C", "2", "Dev", DESCRIPTION, context).owner
+
+
+def test_executors_of_two_tasks_share_a_subtask_despite_their_own_role_prompts(
+        mock_provider, prompt_map
+):
+    from GenRoleSys import RoleDefinition
+    from task_jx import TaskDefinition
+    from task_jx_excet import execute_tasks_jx
+
+    dedup = SubtaskDeduplicator(threshold=0.9)
+    plan = [TaskDefinition(id="1", description=DESCRIPTION, role_name="Dev")]
+    first = execute_tasks_jx(
+        plan,
+        [RoleDefinition(role_name="Dev", prompt_text=PROMPT)],
+        prompt_map,
+        journal_task="A",
+        dedup=dedup,
+    )
+    second = execute_tasks_jx(
+        plan,
+        [RoleDefinition(role_name="Dev", prompt_text="You build Python tools.")],
+        prompt_map,
+        journal_task="B",
+        dedup=dedup,
+    )
+
+    assert "deduplicated_from" not in first[0]
+    assert second[0]["deduplicated_from"]["task_id"] == "A"
+    assert second[0]["role_sys_prompt"] == "You build Python tools."
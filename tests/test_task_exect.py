@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from task_exect import TaskExecutor, execute_tasks, execute_tasks_async
+from tools.task_splitter import TaskItem
+
+TASKS = [
+    TaskItem(id="1", description="Install Linux"),
+    TaskItem(id="2", description="Learn ls and cd", dependsOn=["1"]),
+    TaskItem(id="3", description="Learn vim"),
+]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_unlimited_llm_concurrency_still_sizes_the_subtask_pool(
+        mock_provider, prompt_map, monkeypatch, use_async
+):
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "-1")
+
+    if use_async:
+        results = asyncio.run(execute_tasks_async(TASKS, prompt_map, max_workers=2))
+    else:
+        results = execute_tasks(TASKS, prompt_map, max_workers=2)
+
+    assert [result["status"] for result in results] == ["completed"] * 3
+    assert TaskExecutor(TASKS, 2, prompt_map, 3).subtask_pool_size == 6
+
+
+def test_llm_calls_of_all_levels_share_one_budget(mock_provider, prompt_map):
+    executor = TaskExecutor(TASKS, 3, prompt_map, llm_concurrency=2)
+
+    results = executor.execute_all()
+
+    assert [result["status"] for result in results] == ["completed"] * 3
+    assert executor.subtask_pool_size == 2
+    assert 1 <= executor.budget.peak <= 2
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from task_plan import PlanGenerator, TaskPlan, validate_plan
+from tools.retry_policy import InvalidOutputError
+
+PLAN = {
+    "roles": [{"role_name": "Developer", "prompt_text": "You write code."}],
+    "tasks": [
+        {"id": "1", "description": "Write the script", "role_name": "developer"},
+        {"id": "2", "description": "Test it", "role_name": "Developer", "dependsOn": ["1"]},
+    ],
+}
+
+
+def test_validate_plan_normalises_role_names():
+    plan = validate_plan(TaskPlan.model_validate(PLAN))
+
+    assert [task.role_name for task in plan.tasks] == ["Developer", "Developer"]
+
+
+@pytest.mark.parametrize(
+    "change, message",
+    [
+        ({"tasks": []}, "no tasks"),
+        ({"roles": []}, "no roles"),
+        ({"tasks": PLAN["tasks"] + [PLAN["tasks"][0]]}, "Duplicate task ids"),
+        ({"tasks": [{"id": "1", "description": "x", "role_name": "Tester"}]}, "unknown roles"),
+    ],
+)
+def test_unusable_plans_are_invalid_output(change, message):
+    with pytest.raises(InvalidOutputError, match=message):
+        validate_plan(TaskPlan.model_validate({**PLAN, **change}))
+
+
+@pytest.mark.parametrize("reply", ["[1, 2, 3]", '"a plan"', "42"])
+def test_plan_that_is_not_an_object_escalates_like_invalid_output(queued_replies, prompt_map, reply):
+    queued, fallbacks = queued_replies
+    queued.extend([reply, json.dumps(PLAN)])
+
+    plan = PlanGenerator(prompt_map).generate_plan("Write a script")
+
+    assert [task.id for task in plan.tasks] == ["1", "2"]
+    # The retry went one step up the MODEL_ROUTES fallback cascade
+    assert fallbacks == [0, 1]
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from tools import retry_policy
+from tools.task_splitter import TaskSplitter
+
+PLAN = [
+    {"id": "1", "description": "Install Linux", "dependsOn": []},
+    {"id": "2", "description": "Learn ls and cd", "dependsOn": ["1"]},
+    {"id": "3", "description": "Learn file permissions", "dependsOn": ["2"]},
+]
+
+
+class StreamingModel:
+    """Streams the queued chunk lists; an exception in a list is raised at that point."""
+
+    def __init__(self, streams, reply=None):
+        self.streams = streams
+        self.reply = reply
+        self.invoked = 0
+        self.metadata = {"api_key": "key-1"}
+
+    def stream(self, messages):
+        for part in self.streams.pop(0):
+            if isinstance(part, Exception):
+                raise part
+            yield AIMessageChunk(content=part)
+
+    async def astream(self, messages):
+        for chunk in self.stream(messages):
+            yield chunk
+
+    def invoke(self, messages):
+        self.invoked += 1
+        return AIMessage(content=self.reply)
+
+    async def ainvoke(self, messages):
+        return self.invoke(messages)
+
+
+@pytest.fixture
+def model(monkeypatch, prompt_map):
+    monkeypatch.setenv("RETRY_BASE_DELAY", "0")
+    monkeypatch.setenv("JSON_FIX", "0")
+    monkeypatch.setenv("LLM_CACHE", "0")
+    model = StreamingModel([], reply=json.dumps(PLAN))
+    monkeypatch.setattr(retry_policy, "_get_stage_client", lambda stage, role, fallback: model)
+    return model
+
+
+def _chunks(items, close=True):
+    text = "```json\n[" + ", ".join(json.dumps(item) for item in items)
+    return [text[i:i + 7] for i in range(0, len(text), 7)] + (["]\n```"] if close else [])
+
+
+def _split(prompt_map, use_async=False):
+    splitter = TaskSplitter(prompt_map)
+    if not use_async:
+        return [item.id for item in splitter.stream_split_task("Linux basics")]
+
+    async def collect():
+        return [item.id async for item in splitter.astream_split_task("Linux basics")]
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_complete_stream_yields_every_item_once(model, prompt_map, use_async):
+    model.streams.append(_chunks(PLAN))
+
+    assert _split(prompt_map, use_async) == ["1", "2", "3"]
+    assert model.invoked == 0
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failure_mid_stream_splits_again_for_the_missing_items(model, prompt_map, use_async):
+    model.streams.append(_chunks(PLAN[:1], close=False) + [ConnectionError("reset by peer")])
+
+    assert _split(prompt_map, use_async) == ["1", "2", "3"]
+    assert model.invoked == 1
+
+
+def test_truncated_stream_splits_again_for_the_missing_items(model, prompt_map):
+    model.streams.append(_chunks(PLAN[:2], close=False) + [', {"id": "3", "descr'])
+
+    assert _split(prompt_map) == ["1", "2", "3"]
+    assert model.invoked == 1
+
+
+def test_malformed_item_is_repaired_from_the_complete_text(model, prompt_map):
+    broken = '[{"id": "1", "description": "Install Linux",}, ' + json.dumps(PLAN[1]) + "]"
+    model.streams.append([broken[:20], broken[20:]])
+
+    assert _split(prompt_map) == ["2", "1"]
+    assert model.invoked == 0
+
+
+def test_failure_before_any_item_retries_the_stream(model, prompt_map):
+    model.streams.extend([[ConnectionError("refused")], _chunks(PLAN)])
+
+    assert _split(prompt_map) == ["1", "2", "3"]
+    assert model.invoked == 0
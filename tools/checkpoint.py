@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+def new_run_id() -> str:
+    """Sortable, unique id of a run, e.g. 20250423_150604_1a2b3c."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+def checkpoint_dir() -> str:
+    return os.getenv("CHECKPOINT_DIR", os.path.join("output", "runs"))
+
+
+def is_checkpoint_enabled() -> bool:
+    """
+    Journal new runs to disk so they can be resumed (off unless CHECKPOINT=1;
+    a resumed run always keeps journaling).
+    """
+    return os.getenv("CHECKPOINT", "0") == "1"
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of a run: the split, then each plan, subtask
+    result and top-level result as soon as it is completed.
+
+    Every record is flushed and fsynced before the call returns, so a run
+    that dies keeps everything it paid for. Reopening the journal of a run
+    id replays it; lookups only return entries whose description still
+    matches, so results are never attached to a different task.
+    """
+
+    def __init__(self, run_id: Optional[str] = None, directory: Optional[str] = None):
+        """
+        Args:
+            run_id: Id of the run; a new one by default. An existing journal
+                    with this id is loaded and appended to
+            directory: Where journals are kept; CHECKPOINT_DIR by default
+                       (output/runs)
+        """
+        self.run_id = run_id or new_run_id()
+        directory = directory or checkpoint_dir()
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{self.run_id}.jsonl")
+        self.task: Optional[str] = None
+        self._split: Optional[List[Dict[str, Any]]] = None
+        self._plans: Dict[str, Dict[str, Any]] = {}
+        self._subtasks: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def resume(cls, run_id: str, directory: Optional[str] = None) -> "RunJournal":
+        """
+        Open the journal of an earlier run.
+
+        Raises:
+            FileNotFoundError: If there is no journal for run_id
+        """
+        path = os.path.join(directory or checkpoint_dir(), f"{run_id}.jsonl")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No checkpoint for run {run_id} at {path}")
+        journal = cls(run_id, directory)
+        logger.info(
+            f"Resuming run {run_id}: split {'done' if journal._split is not None else 'missing'}, "
+            f"{len(journal._plans)} plans, "
+            f"{sum(len(results) for results in journal._subtasks.values())} subtasks, "
+            f"{len(journal._tasks)} tasks restored"
+        )
+        return journal
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        # A crash can leave a partial last line; drop it so appends start clean
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning(f"Dropping incomplete last record of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping unreadable record in {self.path}: {e}")
+
+    def _apply(self, record: Dict[str, Any]):
+        kind = record["type"]
+        if kind == "run":
+            self.task = record["task"]
+        elif kind == "split":
+            self._split = record["tasks"]
+        elif kind == "plan":
+            self._plans[record["task_id"]] = record
+        elif kind == "subtask":
+            self._subtasks.setdefault(record["task_id"], {})[
+                record["result"]["task_id"]
+            ] = record["result"]
+        elif kind == "task":
+            self._tasks[record["result"]["task_id"]] = record["result"]
+
+    def _append(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.warning(f"Could not write checkpoint {self.path}: {e}")
+                return
+            self._apply(record)
+
+    def record_run(self, task: str):
+        if self.task is None:
+            self._append({"type": "run", "task": task, "time": datetime.now().isoformat()})
+
+    def record_split(self, tasks: List[BaseModel]):
+        # An empty split is a failed one; leave it to be redone on resume
+        if tasks:
+            self._append({"type": "split", "tasks": [task.model_dump() for task in tasks]})
+
+    def split_tasks(self) -> Optional[List[Dict[str, Any]]]:
+        """Tasks of the completed split, None if the split did not finish."""
+        return self._split
+
+    def journal_split(self, incoming: Iterable[BaseModel]) -> Iterator[BaseModel]:
+        """Pass a streamed split through, recording it once it is complete."""
+        tasks = []
+        for task in incoming:
+            tasks.append(task)
+            yield task
+        self.record_split(tasks)
+
+    async def ajournal_split(
+            self, incoming: AsyncIterable[BaseModel]
+    ) -> AsyncIterator[BaseModel]:
+        """Async version of journal_split."""
+        tasks = []
+        async for task in incoming:
+            tasks.append(task)
+            yield task
+        self.record_split(tasks)
+
+    def record_plan(
+            self, task_id: str, description: str, roles: List[BaseModel], subtasks: List[BaseModel]
+    ):
+        self._append(
+            {
+                "type": "plan",
+                "task_id": task_id,
+                "description": description,
+                "roles": [role.model_dump() for role in roles],
+                "subtasks": [subtask.model_dump() for subtask in subtasks],
+            }
+        )
+
+    def plan(self, task_id: str, description: str) -> Optional[Dict[str, Any]]:
+        """Journaled plan of a task: {"roles": [...], "subtasks": [...]} as dicts."""
+        plan = self._plans.get(task_id)
+        if plan is None or plan["description"] != description:
+            return None
+        return plan
+
+    def record_subtask(self, task_id: str, result: Dict[str, Any]):
+        """Record a completed subtask of top-level task task_id."""
+        if result.get("status") == "completed":
+            self._append({"type": "subtask", "task_id": task_id, "result": result})
+
+    def subtask_result(
+            self, task_id: str, subtask_id: str, description: str
+    ) -> Optional[Dict[str, Any]]:
+        result = self._subtasks.get(task_id, {}).get(subtask_id)
+        if result is None or result.get("description") != description:
+            return None
+        return result
+
+    def record_task(self, result: Dict[str, Any]):
+        """
+        Record a completed top-level task (after its reduce step).
+
+        Children already journaled as subtasks are stored by id and restored
+        from those records: with a result sink the children handed in only
+        hold the fields of retained_result.
+        """
+        if result.get("status") != "completed":
+            return
+        if "children" in result:
+            journaled = self._subtasks.get(result["task_id"], {})
+            result = {
+                **result,
+                "children": [
+                    child["task_id"] if child.get("task_id") in journaled else child
+                    for child in result["children"]
+                ],
+            }
+        self._append({"type": "task", "result": result})
+
+    def task_result(self, task_id: str, description: str) -> Optional[Dict[str, Any]]:
+        result = self._tasks.get(task_id)
+        if result is None or result.get("description") != description:
+            return None
+        if "children" not in result:
+            return result
+        journaled = self._subtasks.get(task_id, {})
+        children = []
+        for child in result["children"]:
+            if isinstance(child, dict):
+                children.append(child)
+            elif child in journaled:
+                children.append(journaled[child])
+            else:
+                # The subtask record was lost (unreadable line); redo the task
+                logger.warning(f"Subtask {child} of task {task_id} missing from {self.path}")
+                return None
+        return {**result, "children": children}
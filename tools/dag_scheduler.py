@@ -0,0 +1,614 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import (
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def find_unschedulable_tasks(tasks: Dict[str, Any]) -> Set[str]:
+    """
+    Find tasks that can never run: part of a cycle or depending on a missing task.
+
+    Args:
+        tasks: Map of task id to task (anything with a dependsOn list)
+
+    Returns:
+        Set of task ids that can never have their dependencies met
+    """
+    indegree = {task_id: len(task.dependsOn) for task_id, task in tasks.items()}
+    dependents: Dict[str, List[str]] = {task_id: [] for task_id in tasks}
+    for task_id, task in tasks.items():
+        for dep_id in task.dependsOn:
+            if dep_id in dependents:
+                dependents[dep_id].append(task_id)
+
+    ready = [task_id for task_id, count in indegree.items() if count == 0]
+    schedulable = set()
+    while ready:
+        task_id = ready.pop()
+        schedulable.add(task_id)
+        for child_id in dependents[task_id]:
+            indegree[child_id] -= 1
+            if indegree[child_id] == 0:
+                ready.append(child_id)
+
+    return set(tasks) - schedulable
+
+
+class DispatchPolicy:
+    """
+    Decides which ready task is dispatched first when more tasks are ready
+    than there are free workers. The base policy is FIFO.
+    """
+
+    name = "fifo"
+
+    def prepare(self, scheduler: "DagScheduler"):
+        """Called once the scheduler has built the dependency graph."""
+
+    def priority(self, task_id: str) -> float:
+        """Higher runs first; ties keep FIFO order."""
+        return 0.0
+
+
+class CriticalPathPolicy(DispatchPolicy):
+    """
+    Run first the tasks with the longest remaining downstream chain.
+
+    The length of a chain is the sum of its node weights, so a task heading a
+    long chain of slow tasks is not left waiting behind independent leaves.
+    """
+
+    name = "critical_path"
+
+    def __init__(self, weight: Optional[Callable[[str], float]] = None):
+        """
+        Args:
+            weight: Expected duration of a task by id (1.0 for every task by default)
+        """
+        self.weight = weight or (lambda task_id: 1.0)
+        self.rank: Dict[str, float] = {}
+
+    def prepare(self, scheduler: "DagScheduler"):
+        self.rank = {}
+        for task_id in reversed(scheduler.topological_order()):
+            downstream = [self.rank[c] for c in scheduler.dependents[task_id] if c in self.rank]
+            self.rank[task_id] = self.weight(task_id) + max(downstream, default=0.0)
+
+    def priority(self, task_id: str) -> float:
+        return self.rank.get(task_id, 0.0)
+
+
+class DependentsPolicy(DispatchPolicy):
+    """Run first the tasks that the most other tasks (transitively) depend on."""
+
+    name = "dependents"
+
+    def __init__(self):
+        self.count: Dict[str, int] = {}
+
+    def prepare(self, scheduler: "DagScheduler"):
+        order = scheduler.topological_order()
+        bit = {task_id: 1 << i for i, task_id in enumerate(order)}
+        # Bitset of all transitive dependents per task
+        reachable: Dict[str, int] = {}
+        for task_id in reversed(order):
+            mask = 0
+            for child_id in scheduler.dependents[task_id]:
+                if child_id in reachable:
+                    mask |= bit[child_id] | reachable[child_id]
+            reachable[task_id] = mask
+        self.count = {task_id: mask.bit_count() for task_id, mask in reachable.items()}
+
+    def priority(self, task_id: str) -> float:
+        return self.count.get(task_id, 0)
+
+
+DISPATCH_POLICIES = {
+    DispatchPolicy.name: DispatchPolicy,
+    CriticalPathPolicy.name: CriticalPathPolicy,
+    DependentsPolicy.name: DependentsPolicy,
+}
+
+
+def get_dispatch_policy(
+    name: Optional[str] = None, weight: Optional[Callable[[str], float]] = None
+) -> DispatchPolicy:
+    """
+    Create a dispatch policy by name.
+
+    Args:
+        name: fifo, critical_path or dependents; defaults to SCHEDULER_POLICY,
+              else critical_path. Unknown names fall back to FIFO.
+        weight: Expected duration of a task by id, used by critical_path
+
+    Returns:
+        DispatchPolicy instance
+    """
+    name = (name or os.getenv("SCHEDULER_POLICY", CriticalPathPolicy.name)).strip().lower()
+    if name == CriticalPathPolicy.name:
+        return CriticalPathPolicy(weight)
+    policy_class = DISPATCH_POLICIES.get(name)
+    if policy_class is None:
+        logger.warning(f"Unknown scheduler policy '{name}', using FIFO")
+        return DispatchPolicy()
+    return policy_class()
+
+
+class DagScheduler:
+    """
+    Dependency bookkeeping for a graph of tasks.
+
+    Every task keeps a count of unfinished dependencies; when the last one
+    completes the task is appended to the ready queue, so a dependent can be
+    dispatched as soon as its last parent finishes without rescanning the
+    graph. Tasks in a cycle or depending on a missing task are found up front,
+    and dependents of a failed task are skipped instead of waiting forever.
+    Among ready tasks, the dispatch policy decides which one starts first.
+
+    Tasks can also be added while the graph runs (add_task); a dependency on
+    a task that has not been added yet is then a wait, not an error, until
+    close() declares the graph complete.
+    """
+
+    def __init__(self, tasks: Dict[str, Any], policy: Optional[DispatchPolicy] = None):
+        """
+        Args:
+            tasks: Map of task id to task (anything with a dependsOn list)
+            policy: Order of ready tasks, FIFO by default
+        """
+        self.tasks = tasks
+        self.completed: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.skipped: Set[str] = set()
+        self.running: Set[str] = set()
+        # Heap of (-priority, insertion order, task id)
+        self.ready: List[Tuple[float, int, str]] = []
+        self.policy = policy or DispatchPolicy()
+        self._order = itertools.count()
+        self.indegree: Dict[str, int] = {}
+        self.dependents: Dict[str, List[str]] = {task_id: [] for task_id in tasks}
+        self._lock = threading.Lock()
+
+        for task_id, task in tasks.items():
+            self.indegree[task_id] = len(task.dependsOn)
+            for dep_id in task.dependsOn:
+                if dep_id in self.dependents:
+                    self.dependents[dep_id].append(task_id)
+
+        unschedulable = find_unschedulable_tasks(tasks)
+        if unschedulable:
+            logger.warning(
+                f"Tasks with cyclic or missing dependencies will not run: {unschedulable}"
+            )
+            self.skipped.update(unschedulable)
+
+        self.policy.prepare(self)
+        for task_id, count in self.indegree.items():
+            if count == 0 and task_id not in self.skipped:
+                self._push_ready(task_id)
+
+    def topological_order(self) -> List[str]:
+        """Ids of all schedulable tasks, every task after its dependencies."""
+        indegree = {
+            task_id: sum(1 for dep_id in task.dependsOn if dep_id in self.tasks)
+            for task_id, task in self.tasks.items()
+            if task_id not in self.skipped
+        }
+        order = [task_id for task_id, count in indegree.items() if count == 0]
+        for task_id in order:
+            for child_id in self.dependents[task_id]:
+                if child_id in indegree:
+                    indegree[child_id] -= 1
+                    if indegree[child_id] == 0:
+                        order.append(child_id)
+        return order
+
+    def _push_ready(self, task_id: str):
+        heapq.heappush(
+            self.ready, (-self.policy.priority(task_id), next(self._order), task_id)
+        )
+
+    def add_task(self, task_id: str, task: Any) -> bool:
+        """
+        Add a task to a graph that may already be running.
+
+        Dependencies that already completed count as met; a dependency that
+        failed or was skipped skips the new task. The dispatch policy is
+        prepared again and the ready queue re-ranked, since a new task can
+        lengthen the chain behind tasks that are already waiting.
+
+        Args:
+            task_id: ID of the new task
+            task: Task (anything with a dependsOn list); also added to `tasks`
+
+        Returns:
+            True if the task became ready immediately
+        """
+        with self._lock:
+            if task_id in self.tasks:
+                logger.warning(f"Duplicate task id {task_id} ignored")
+                return False
+            self.tasks[task_id] = task
+            # A placeholder list exists if a task added earlier depends on this one
+            self.dependents.setdefault(task_id, [])
+
+            waiting = 0
+            lost = [
+                dep_id
+                for dep_id in task.dependsOn
+                if dep_id in self.failed or dep_id in self.skipped
+            ]
+            for dep_id in task.dependsOn:
+                self.dependents.setdefault(dep_id, []).append(task_id)
+                if dep_id not in self.completed:
+                    waiting += 1
+            self.indegree[task_id] = waiting
+
+            if lost:
+                logger.warning(f"Task {task_id} skipped, dependencies {lost} did not complete")
+                self.skipped.add(task_id)
+
+            self.policy.prepare(self)
+            self.ready = [
+                (-self.policy.priority(ready_id), order, ready_id)
+                for _, order, ready_id in self.ready
+            ]
+            heapq.heapify(self.ready)
+            if waiting == 0 and task_id not in self.skipped:
+                self._push_ready(task_id)
+                return True
+            return False
+
+    def close(self) -> Set[str]:
+        """
+        Declare that no more tasks will be added.
+
+        Tasks still waiting for a task that was never added, or part of a
+        cycle, can no longer run and are skipped.
+
+        Returns:
+            IDs of the tasks skipped
+        """
+        with self._lock:
+            unschedulable = find_unschedulable_tasks(self.tasks) - self.skipped
+            if unschedulable:
+                logger.warning(
+                    f"Tasks with cyclic or missing dependencies will not run: {unschedulable}"
+                )
+                self.skipped.update(unschedulable)
+            return unschedulable
+
+    def pop_ready(self) -> Optional[str]:
+        """
+        Take the next task whose dependencies are all completed.
+
+        Returns:
+            Task id (now counted as running), or None if nothing is ready
+        """
+        with self._lock:
+            if not self.ready:
+                return None
+            _, _, task_id = heapq.heappop(self.ready)
+            self.running.add(task_id)
+            return task_id
+
+    def finish(self, task_id: str, succeeded: bool) -> List[str]:
+        """
+        Record the outcome of a running task.
+
+        Args:
+            task_id: ID of the finished task
+            succeeded: False marks the task failed and skips all its dependents
+
+        Returns:
+            IDs of the tasks that became ready
+        """
+        with self._lock:
+            self.running.discard(task_id)
+            if not succeeded:
+                self.failed.add(task_id)
+                self._skip_dependents(task_id)
+                return []
+
+            self.completed.add(task_id)
+            newly_ready = []
+            for child_id in self.dependents[task_id]:
+                self.indegree[child_id] -= 1
+                if self.indegree[child_id] == 0 and child_id not in self.skipped:
+                    newly_ready.append(child_id)
+                    self._push_ready(child_id)
+            return newly_ready
+
+    def _skip_dependents(self, task_id: str):
+        stack = list(self.dependents[task_id])
+        skipped = []
+        while stack:
+            child_id = stack.pop()
+            if child_id in self.skipped:
+                continue
+            self.skipped.add(child_id)
+            skipped.append(child_id)
+            stack.extend(self.dependents[child_id])
+        if skipped:
+            logger.warning(f"Tasks skipped, dependency {task_id} failed: {skipped}")
+
+    @property
+    def done(self) -> bool:
+        return not self.running and not self.ready
+
+    def get_status(self) -> Dict[str, int]:
+        with self._lock:
+            finished = len(self.completed) + len(self.failed) + len(self.skipped)
+            return {
+                "total": len(self.tasks),
+                "completed": len(self.completed),
+                "failed": len(self.failed),
+                "skipped": len(self.skipped),
+                "in_progress": len(self.running),
+                "pending": len(self.tasks) - finished - len(self.running),
+            }
+
+
+class ConcurrencyBudget:
+    """
+    Cap on concurrent LLM calls shared by every level of the executors.
+
+    Top-level planning and reduce calls and all subtask calls take a slot for
+    the duration of the call, so capacity left idle by one top-level task is
+    used by the subtasks of another. A limit of 0 or less means unlimited.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._semaphore = threading.BoundedSemaphore(limit) if limit > 0 else None
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+
+    def _exit(self):
+        with self._lock:
+            self.in_use -= 1
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot (blocking the thread until one is free)."""
+        with self._semaphore or nullcontext():
+            self._enter()
+            try:
+                yield
+            finally:
+                self._exit()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async version of slot for coroutines on one event loop."""
+        if self.limit > 0 and self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.limit)
+        async with self._async_semaphore or nullcontext():
+            self._enter()
+            try:
+                yield
+            finally:
+                self._exit()
+
+
+def _record_result(
+    tasks: Dict[str, Any], results: Dict[str, Any], task_id: str, result: Dict[str, Any]
+) -> bool:
+    results[task_id] = result
+    if result.get("status") == "completed":
+        if "result" in result:
+            tasks[task_id].result = result["result"]
+        return True
+    return False
+
+
+def _failed_result(task_id: str, error: Exception) -> Dict[str, Any]:
+    logger.error(f"Task {task_id} failed with exception: {str(error)}")
+    return {"task_id": task_id, "status": "failed", "error": str(error)}
+
+
+def _feed_incoming(incoming: Iterable[Any], completions: "queue.SimpleQueue"):
+    try:
+        for task in incoming:
+            completions.put((None, task))
+    except Exception as e:
+        logger.error(f"Reading incoming tasks failed: {str(e)}", exc_info=True)
+    finally:
+        completions.put((None, None))
+
+
+def execute_dag(
+    tasks: Dict[str, Any],
+    max_workers: int,
+    execute: Callable[[str], Dict[str, Any]],
+    results: Dict[str, Any],
+    scheduler: Optional[DagScheduler] = None,
+    pool: Optional[concurrent.futures.Executor] = None,
+    incoming: Optional[Iterable[Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run a dependency graph of tasks on a thread pool.
+
+    Workers only run `execute`; all scheduler state is updated from the
+    calling thread, which wakes up on each completion and dispatches the
+    tasks that became ready. Tasks (and the reading of `incoming`) run in a
+    copy of the caller's context variables (e.g. the metrics scope or the
+    trace span of the parent task).
+
+    Args:
+        tasks: Map of task id to task (anything with dependsOn / result fields)
+        max_workers: Maximum number of tasks executing at the same time
+        execute: Function taking a task id and returning a result dict
+        results: Dict that receives the results in completion order
+        scheduler: Scheduler to use, a new one for `tasks` by default
+        pool: Shared thread pool to run the tasks on (left running afterwards);
+              a private pool of max_workers threads by default
+        incoming: Tasks (with an id) that are still being produced, e.g. by a
+                  streamed split. Read on a separate thread and added to the
+                  graph as they arrive; the run ends once it is exhausted and
+                  nothing is running.
+
+    Returns:
+        List of task results
+    """
+    scheduler = scheduler or DagScheduler(tasks)
+    # (task id, future) for each completion; (None, task) for each incoming
+    # task and (None, None) once incoming is exhausted
+    completions: "queue.SimpleQueue" = queue.SimpleQueue()
+    receiving = incoming is not None
+    if receiving:
+        threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(_feed_incoming, incoming, completions),
+            name="dag-incoming",
+            daemon=True,
+        ).start()
+
+    if pool is None:
+        pool_context = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        pool_context = nullcontext(pool)
+
+    with pool_context as executor:
+
+        def dispatch():
+            while len(scheduler.running) < max_workers:
+                task_id = scheduler.pop_ready()
+                if task_id is None:
+                    return
+                future = executor.submit(contextvars.copy_context().run, execute, task_id)
+                future.add_done_callback(
+                    lambda f, task_id=task_id: completions.put((task_id, f))
+                )
+
+        dispatch()
+        while scheduler.running or receiving:
+            task_id, item = completions.get()
+            if task_id is not None:
+                try:
+                    result = item.result()
+                except Exception as e:
+                    result = _failed_result(task_id, e)
+                succeeded = _record_result(tasks, results, task_id, result)
+                scheduler.finish(task_id, succeeded)
+            elif item is not None:
+                scheduler.add_task(item.id, item)
+            else:
+                receiving = False
+                scheduler.close()
+            dispatch()
+
+    return list(results.values())
+
+
+async def execute_dag_async(
+    tasks: Dict[str, Any],
+    max_concurrency: int,
+    execute: Callable[[str], Awaitable[Dict[str, Any]]],
+    results: Dict[str, Any],
+    scheduler: Optional[DagScheduler] = None,
+    incoming: Optional[AsyncIterable[Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run a dependency graph of tasks as coroutines.
+
+    Args:
+        tasks: Map of task id to task (anything with dependsOn / result fields)
+        max_concurrency: Maximum number of tasks executing at the same time
+        execute: Coroutine function taking a task id and returning a result dict
+        results: Dict that receives the results in completion order
+        scheduler: Scheduler to use, a new one for `tasks` by default
+        incoming: Tasks (with an id) that are still being produced, added to
+                  the graph as they arrive (see execute_dag)
+
+    Returns:
+        List of task results
+    """
+    scheduler = scheduler or DagScheduler(tasks)
+    pending: Dict[asyncio.Task, str] = {}
+    incoming_iter = incoming.__aiter__() if incoming is not None else None
+    receiver: Optional[asyncio.Future] = None
+
+    def receive():
+        nonlocal receiver
+        receiver = asyncio.ensure_future(incoming_iter.__anext__())
+
+    def on_received():
+        nonlocal receiver
+        try:
+            task = receiver.result()
+        except StopAsyncIteration:
+            task = None
+        except Exception as e:
+            logger.error(f"Reading incoming tasks failed: {str(e)}", exc_info=True)
+            task = None
+        if task is None:
+            receiver = None
+            scheduler.close()
+        else:
+            scheduler.add_task(task.id, task)
+            receive()
+
+    def dispatch():
+        while len(scheduler.running) < max_concurrency:
+            task_id = scheduler.pop_ready()
+            if task_id is None:
+                return
+            pending[asyncio.ensure_future(execute(task_id))] = task_id
+
+    try:
+        if incoming_iter is not None:
+            receive()
+        dispatch()
+        while pending or receiver is not None:
+            waiting = set(pending)
+            if receiver is not None:
+                waiting.add(receiver)
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future is receiver:
+                    on_received()
+                    continue
+                task_id = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = _failed_result(task_id, e)
+                succeeded = _record_result(tasks, results, task_id, result)
+                scheduler.finish(task_id, succeeded)
+            dispatch()
+    finally:
+        # Cancelled from outside: do not leave orphaned tasks running
+        for future in pending:
+            future.cancel()
+        if receiver is not None:
+            receiver.cancel()
+
+    return list(results.values())
@@ -0,0 +1,379 @@
+import hashlib
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, Field
+
+from tools.llm_generatory import get_llm_model, get_model_name
+from tools.streaming import chunk_text
+
+logger = logging.getLogger(__name__)
+
+# How a dependency result is put into the prompt
+FULL = "full"
+TRUNCATE = "truncate"
+SUMMARY = "summary"
+STRATEGIES = (FULL, TRUNCATE, SUMMARY)
+
+# Below this many tokens a summary is not worth an extra request
+MIN_SUMMARY_TOKENS = 64
+
+SUMMARY_PROMPT = """You condense the result of a completed task so that a later task can build on it.
+Keep every fact, decision, name, number, interface and piece of code that a follow-up task could need;
+drop repetition, filler and formatting. Answer in the language of the result.
+The summary MUST be shorter than {max_tokens} tokens. Output only the summary."""
+
+_summaries: Dict[Tuple[str, int], str] = {}
+_summaries_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """tiktoken encoding of a model, None if tiktoken or its data is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, estimating token counts")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Not an OpenAI model: o200k_base is close enough for budgeting
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(
+            f"Could not load tiktoken encoding for {model}, estimating token counts: {e}"
+        )
+        return None
+
+
+def _default_model() -> str:
+    return get_model_name()
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Number of tokens of a text for a model.
+
+    Args:
+        text: Text to count
+        model: Model name (the default model of PROVIDER by default)
+
+    Returns:
+        Token count; estimated from the characters if no encoding can be loaded
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model or _default_model())
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # About four characters per token in English, one per CJK character
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """
+    Shorten a text to about max_tokens, keeping its head and its tail.
+
+    Args:
+        text: Text to shorten
+        max_tokens: Token budget for the result
+        model: Model name (the default model of PROVIDER by default)
+
+    Returns:
+        The text itself if it fits, else head and tail joined by an omission marker
+    """
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+
+    marker = f"\n\n[... {total - max_tokens} tokens omitted ...]\n\n"
+    keep = max(0, max_tokens - count_tokens(marker, model))
+    # The start usually states what was done, the end the conclusion
+    head_tokens = keep * 2 // 3
+    tail_tokens = keep - head_tokens
+
+    encoding = _get_encoding(model or _default_model())
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        head = encoding.decode(tokens[:head_tokens])
+        tail = encoding.decode(tokens[len(tokens) - tail_tokens:]) if tail_tokens else ""
+    else:
+        chars_per_token = len(text) / total
+        head = text[: int(head_tokens * chars_per_token)]
+        tail = text[len(text) - int(tail_tokens * chars_per_token):] if tail_tokens else ""
+    return head + marker + tail
+
+
+class DependencyContext(BaseModel):
+    """Dependency results as put into the prompt of one task"""
+
+    text: str = Field(default="", description="Markdown block of dependency results")
+    tokens: int = Field(default=0, description="Tokens of text")
+    original_tokens: int = Field(
+        default=0, description="Tokens the block would have with every result in full"
+    )
+    saved_tokens: int = Field(default=0, description="original_tokens - tokens")
+    strategies: Dict[str, str] = Field(
+        default_factory=dict, description="Strategy applied per dependency id"
+    )
+
+
+class DependencyContextBuilder:
+    """
+    Builds the dependency section of a prompt within a token budget.
+
+    The budget only covers this section, not the rest of the prompt, so it
+    limits cost and prompt growth rather than guaranteeing the request fits
+    the model's context window. Without a budget (the default) every result
+    is passed in full and nothing is tokenized. Results that fit are kept in
+    full. The budget left after the headers is shared fairly: short results keep what they need, and the remainder is
+    split among the long ones, which are cut to head and tail or replaced by
+    a summary (cached, so a result feeding several tasks is summarised once
+    per size).
+    """
+
+    def __init__(
+            self,
+            max_tokens: Optional[int] = None,
+            strategy: Optional[str] = None,
+            model: Optional[str] = None,
+    ):
+        """
+        Args:
+            max_tokens: Token budget for the whole block; DEP_CONTEXT_MAX_TOKENS
+                        by default. 0 or less (the default) means unlimited
+            strategy: What to do with results over their share: truncate or
+                      summary; full keeps everything. DEP_CONTEXT_STRATEGY by
+                      default (truncate)
+            model: Model whose tokenizer is used, the one the prompt is sent to
+                   (see tools.llm_generatory.get_model_name); the default
+                   model of PROVIDER by default
+        """
+        self.max_tokens = (
+            max_tokens
+            if max_tokens is not None
+            else int(os.getenv("DEP_CONTEXT_MAX_TOKENS", "0"))
+        )
+        strategy = (strategy or os.getenv("DEP_CONTEXT_STRATEGY", TRUNCATE)).strip().lower()
+        if strategy not in STRATEGIES:
+            logger.warning(f"Unknown dependency context strategy '{strategy}', using {TRUNCATE}")
+            strategy = TRUNCATE
+        self.strategy = strategy
+        self.model = model or _default_model()
+
+    @staticmethod
+    def _header(task_id: str, task_data: Dict[str, Any]) -> str:
+        description = task_data.get("description", "No description")
+        return f"### Task {task_id}: {description}\n\n"
+
+    @staticmethod
+    def _result(task_data: Dict[str, Any]) -> str:
+        return str(task_data.get("result", "No result"))
+
+    @staticmethod
+    def _format(sections: List[Tuple[str, str]]) -> str:
+        md_output = "## Previous Task Results\n\n"
+        for header, result in sections:
+            md_output += header
+            md_output += f"{result}\n\n"
+            md_output += "---\n\n"
+        return md_output
+
+    @staticmethod
+    def _allocate(sizes: Dict[str, int], budget: int) -> Dict[str, int]:
+        """Max-min fair share of budget: small results first get all they need."""
+        allocation = {}
+        remaining = max(0, budget)
+        pending = sorted(sizes, key=lambda task_id: sizes[task_id])
+        while pending:
+            share = remaining // len(pending)
+            task_id = pending.pop(0)
+            allocation[task_id] = min(sizes[task_id], share)
+            remaining -= allocation[task_id]
+        return allocation
+
+    def _is_unbudgeted(self) -> bool:
+        return self.strategy == FULL or self.max_tokens <= 0
+
+    def _unbudgeted(self, dependency_results: Dict[str, Any]) -> DependencyContext:
+        """Every result in full, without counting tokens (stats stay 0)."""
+        return DependencyContext(
+            text=self._format(
+                [
+                    (self._header(task_id, data), self._result(data))
+                    for task_id, data in dependency_results.items()
+                ]
+            ),
+            strategies={task_id: FULL for task_id in dependency_results},
+        )
+
+    def _plan(
+            self, dependency_results: Dict[str, Any]
+    ) -> Tuple[Dict[str, str], Dict[str, int], Dict[str, int], int]:
+        """
+        Returns:
+            Tuple of (result text per id, its tokens, its token allocation,
+            tokens of the block with every result in full)
+        """
+        results = {task_id: self._result(data) for task_id, data in dependency_results.items()}
+        sizes = {task_id: count_tokens(result, self.model) for task_id, result in results.items()}
+        overhead = count_tokens(
+            self._format(
+                [(self._header(task_id, data), "") for task_id, data in dependency_results.items()]
+            ),
+            self.model,
+        )
+        original_tokens = overhead + sum(sizes.values())
+        if original_tokens <= self.max_tokens:
+            return results, sizes, dict(sizes), original_tokens
+        return results, sizes, self._allocate(sizes, self.max_tokens - overhead), original_tokens
+
+    def _finish(
+            self,
+            dependency_results: Dict[str, Any],
+            contents: Dict[str, str],
+            strategies: Dict[str, str],
+            original_tokens: int,
+    ) -> DependencyContext:
+        text = self._format(
+            [
+                (self._header(task_id, data), contents[task_id])
+                for task_id, data in dependency_results.items()
+            ]
+        )
+        tokens = count_tokens(text, self.model)
+        shortened = {
+            task_id: strategy for task_id, strategy in strategies.items() if strategy != FULL
+        }
+        if not shortened:
+            # Nothing was shortened; counting the parts separately may differ slightly
+            original_tokens = tokens
+        else:
+            logger.warning(
+                f"Dependency results over the {self.max_tokens} token budget "
+                f"({original_tokens} tokens) were shortened: {shortened}"
+            )
+        return DependencyContext(
+            text=text,
+            tokens=tokens,
+            original_tokens=original_tokens,
+            saved_tokens=max(0, original_tokens - tokens),
+            strategies=strategies,
+        )
+
+    def _summary_messages(self, result: str, max_tokens: int):
+        return [
+            SystemMessage(content=SUMMARY_PROMPT.format(max_tokens=max_tokens)),
+            HumanMessage(content=result),
+        ]
+
+    @staticmethod
+    def _summary_key(result: str, max_tokens: int) -> Tuple[str, int]:
+        return hashlib.sha256(result.encode("utf-8")).hexdigest(), max_tokens
+
+    def _summarize(self, result: str, max_tokens: int) -> Optional[str]:
+        key = self._summary_key(result, max_tokens)
+        with _summaries_lock:
+            if key in _summaries:
+                return _summaries[key]
+        try:
+            llm = get_llm_model(stage="dep_summary")
+            response = llm.invoke(self._summary_messages(result, max_tokens))
+        except Exception as e:
+            logger.warning(f"Summarising a dependency result failed: {e}")
+            return None
+        summary = truncate_tokens(chunk_text(response).strip(), max_tokens, self.model)
+        with _summaries_lock:
+            _summaries[key] = summary
+        return summary
+
+    async def _asummarize(self, result: str, max_tokens: int) -> Optional[str]:
+        key = self._summary_key(result, max_tokens)
+        with _summaries_lock:
+            if key in _summaries:
+                return _summaries[key]
+        try:
+            llm = get_llm_model(stage="dep_summary")
+            response = await llm.ainvoke(self._summary_messages(result, max_tokens))
+        except Exception as e:
+            logger.warning(f"Summarising a dependency result failed: {e}")
+            return None
+        summary = truncate_tokens(chunk_text(response).strip(), max_tokens, self.model)
+        with _summaries_lock:
+            _summaries[key] = summary
+        return summary
+
+    def _wants_summary(self, size: int, allocation: int) -> bool:
+        return self.strategy == SUMMARY and size > allocation >= MIN_SUMMARY_TOKENS
+
+    def build(self, dependency_results: Dict[str, Any]) -> DependencyContext:
+        """
+        Build the dependency block of a prompt.
+
+        Args:
+            dependency_results: Dictionary of dependency results where keys are task IDs
+                               and values contain description and result
+
+        Returns:
+            DependencyContext; its text is empty if there are no dependencies
+        """
+        if not dependency_results:
+            return DependencyContext()
+        if self._is_unbudgeted():
+            return self._unbudgeted(dependency_results)
+
+        results, sizes, allocation, original_tokens = self._plan(dependency_results)
+        contents: Dict[str, str] = {}
+        strategies: Dict[str, str] = {}
+        for task_id, result in results.items():
+            if sizes[task_id] <= allocation[task_id]:
+                contents[task_id], strategies[task_id] = result, FULL
+                continue
+            summary = None
+            if self._wants_summary(sizes[task_id], allocation[task_id]):
+                summary = self._summarize(result, allocation[task_id])
+            if summary is not None:
+                contents[task_id], strategies[task_id] = summary, SUMMARY
+            else:
+                contents[task_id] = truncate_tokens(result, allocation[task_id], self.model)
+                strategies[task_id] = TRUNCATE
+        return self._finish(dependency_results, contents, strategies, original_tokens)
+
+    async def abuild(self, dependency_results: Dict[str, Any]) -> DependencyContext:
+        """Async version of build; summaries are requested with ainvoke."""
+        if not dependency_results:
+            return DependencyContext()
+        if self._is_unbudgeted():
+            return self._unbudgeted(dependency_results)
+
+        results, sizes, allocation, original_tokens = self._plan(dependency_results)
+        contents: Dict[str, str] = {}
+        strategies: Dict[str, str] = {}
+        for task_id, result in results.items():
+            if sizes[task_id] <= allocation[task_id]:
+                contents[task_id], strategies[task_id] = result, FULL
+                continue
+            summary = None
+            if self._wants_summary(sizes[task_id], allocation[task_id]):
+                summary = await self._asummarize(result, allocation[task_id])
+            if summary is not None:
+                contents[task_id], strategies[task_id] = summary, SUMMARY
+            else:
+                contents[task_id] = truncate_tokens(result, allocation[task_id], self.model)
+                strategies[task_id] = TRUNCATE
+        return self._finish(dependency_results, contents, strategies, original_tokens)
+
+
+def log_dependency_context(name: str, context: DependencyContext):
+    if context.saved_tokens:
+        logger.info(
+            f"{name}: dependency context {context.tokens} tokens, "
+            f"saved {context.saved_tokens} of {context.original_tokens} ({context.strategies})"
+        )
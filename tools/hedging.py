@@ -0,0 +1,200 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import os
+import threading
+from typing import Any, Callable, Optional
+
+from tools.latency_stats import latency_percentile
+from tools.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# Sync requests run here so the caller can return on the first answer
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def is_hedging_enabled() -> bool:
+    """Hedge slow requests on a second API key (off unless HEDGE=1)."""
+    return os.getenv("HEDGE", "0") == "1"
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "64")),
+                    thread_name_prefix="hedge",
+                )
+    return _executor
+
+
+def hedge_delay(stage: str) -> Optional[float]:
+    """
+    How long a request of a stage may run before it is hedged.
+
+    HEDGE_PERCENTILE (default 95) of the stage's recent latency, at least
+    HEDGE_MIN_DELAY seconds (default 0.1). None until HEDGE_MIN_SAMPLES
+    calls (default 20) were observed. Only requests answered by the provider
+    are sampled: cache hits would pull the percentile towards 0 on a warm
+    cache and get nearly every uncached request hedged.
+    """
+    delay = latency_percentile(
+        stage,
+        float(os.getenv("HEDGE_PERCENTILE", "95")),
+        min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+    )
+    if delay is None:
+        return None
+    return max(delay, float(os.getenv("HEDGE_MIN_DELAY", "0.1")))
+
+
+class HedgeBudget:
+    """
+    Caps the extra requests sent by hedging.
+
+    A hedge may only be sent while hedges stay below max_ratio of all
+    requests that could have been hedged, e.g. 0.1 allows at most 10% more
+    requests (and roughly 10% more cost) than without hedging.
+    """
+
+    def __init__(self, max_ratio: float):
+        self.max_ratio = max_ratio
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+_budget = HedgeBudget(float(os.getenv("HEDGE_MAX_RATIO", "0.1")))
+
+
+def get_hedge_budget() -> HedgeBudget:
+    return _budget
+
+
+class HedgedModel:
+    """
+    View of a stage client that re-sends slow requests on a second API key.
+
+    invoke / ainvoke (and calling the model) send the request on the primary
+    client. If it has not answered after hedge_delay(stage), the same request
+    goes out on a client of another key, and the first successful answer is
+    returned. The slower async request is cancelled; a slower sync request
+    cannot be interrupted, its answer is dropped when it arrives. Streams
+    are not hedged, everything else is delegated to the primary client.
+    """
+
+    def __init__(self, stage: str, primary: Any, backup: Callable[[], Any]):
+        """
+        Args:
+            stage: Pipeline stage of the client
+            primary: Stage client bound to the selected API key
+            backup: Returns the stage client to hedge on (another key)
+        """
+        self.stage = stage
+        self.primary = primary
+        self._backup = backup
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.primary, name)
+
+    def _start_hedge(self) -> Optional[Any]:
+        if not _budget.try_acquire():
+            return None
+        get_metrics_registry().record_hedge(self.stage)
+        logger.debug(f"Hedging a slow {self.stage} request")
+        return self._backup()
+
+    def invoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> Any:
+        delay = hedge_delay(self.stage)
+        _budget.count_request()
+        if delay is None:
+            return self.primary.invoke(input, config, **kwargs)
+
+        started = threading.Event()
+
+        def run_primary():
+            started.set()
+            return self.primary.invoke(input, config, **kwargs)
+
+        executor = _get_executor()
+        primary = executor.submit(contextvars.copy_context().run, run_primary)
+        # The delay runs from when the request is sent, not from when a worker was free
+        started.wait()
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        backup_client = None if done else self._start_hedge()
+        if backup_client is None:
+            return primary.result()
+
+        backup = executor.submit(
+            contextvars.copy_context().run,
+            functools.partial(backup_client.invoke, input, config, **kwargs),
+        )
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            # The primary wins a tie
+            for future in sorted(done, key=lambda f: f is not primary):
+                if future.exception() is None:
+                    if future is backup:
+                        get_metrics_registry().record_hedge(self.stage, won=True)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def __call__(self, input: Any, *args: Any, **kwargs: Any) -> Any:
+        return self.invoke(input, *args, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[Any] = None, **kwargs: Any) -> Any:
+        delay = hedge_delay(self.stage)
+        _budget.count_request()
+        if delay is None:
+            return await self.primary.ainvoke(input, config, **kwargs)
+
+        primary = asyncio.ensure_future(self.primary.ainvoke(input, config, **kwargs))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            backup_client = None if done else self._start_hedge()
+            if backup_client is None:
+                return await primary
+
+            backup = asyncio.ensure_future(backup_client.ainvoke(input, config, **kwargs))
+            pending.add(backup)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in sorted(done, key=lambda f: f is not primary):
+                    if future.exception() is None:
+                        if future is backup:
+                            get_metrics_registry().record_hedge(self.stage, won=True)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # The loser, or both if the caller was cancelled
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import re
+from typing import Any, List, Tuple
+
+from langchain_core.messages import HumanMessage
+
+from tools.metrics import get_metrics_registry
+from tools.retry_policy import InvalidOutputError
+from tools.streaming import chunk_text
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Parse outcomes, in the order they are tried
+FAST = "fast"
+REPAIRED = "repaired"
+SALVAGED = "salvaged"
+FIXED = "fixed"
+FAILED = "failed"
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+FIX_PROMPT = """The text below was meant to be valid JSON but does not parse ({error}).
+Reply with the corrected JSON only: keep the content, fix the syntax, no explanation.
+
+{text}"""
+
+
+class JsonRepairError(InvalidOutputError):
+    """The text could not be parsed, repaired or salvaged."""
+
+
+def _loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def extract_json(text: str) -> str:
+    """
+    JSON part of a model response: the first fenced block (also an unclosed
+    one), else everything from the first bracket.
+    """
+    match = _FENCE.search(text)
+    if match and match.group(1).strip():
+        return match.group(1).strip()
+    starts = [index for index in (text.find("["), text.find("{")) if index >= 0]
+    return text[min(starts):].strip() if starts else text.strip()
+
+
+def _next_significant(text: str, start: int) -> str:
+    for ch in text[start:]:
+        if not ch.isspace():
+            return ch
+    return ""
+
+
+def _drop_trailing_comma(out: List[str]):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def repair_json(text: str) -> str:
+    """
+    Fix the usual syntax errors of generated JSON.
+
+    - trailing commas before a closing bracket are dropped
+    - quotes inside strings that are not followed by , : } ] are escaped,
+      as are raw newlines and tabs
+    - text after the closing bracket of the top-level value is ignored
+    - truncated output is cut after the last complete element of the
+      outermost open array, so a half-written item is dropped rather than
+      kept with partial values; without an open array it is closed where
+      it stops
+    """
+    out: List[str] = []
+    closers: List[str] = []
+    # Per open value: length of out after its last complete element (arrays)
+    marks: List[int] = []
+    in_string = escaped = False
+
+    for index, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(ch)
+            elif ch == "\\":
+                escaped = True
+                out.append(ch)
+            elif ch == '"':
+                if _next_significant(text, index + 1) in ("", ",", ":", "}", "]"):
+                    in_string = False
+                    out.append(ch)
+                else:
+                    out.append('\\"')
+            elif ch in "\n\r\t":
+                out.append({"\n": "\\n", "\r": "\\r", "\t": "\\t"}[ch])
+            else:
+                out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "[{":
+            closers.append("]" if ch == "[" else "}")
+            out.append(ch)
+            marks.append(len(out))
+        elif ch in "]}":
+            if not closers:
+                break
+            _drop_trailing_comma(out)
+            # A mismatched bracket closes the innermost open value
+            out.append(closers.pop())
+            marks.pop()
+            if not closers:
+                break
+            marks[-1] = len(out)
+        else:
+            if ch == "," and closers:
+                marks[-1] = len(out)
+            out.append(ch)
+
+    if closers:
+        if "]" in closers:
+            depth = closers.index("]")
+            del out[marks[depth]:]
+            del closers[depth + 1:]
+        else:
+            if in_string:
+                out.append('"')
+            _drop_trailing_comma(out)
+            if out and out[-1] == ":":
+                out.append("null")
+        for closer in reversed(closers):
+            _drop_trailing_comma(out)
+            out.append(closer)
+    return "".join(out)
+
+
+def salvage_json_array(text: str) -> List[Any]:
+    """Elements of a JSON array that decode, up to the first one that does not."""
+    start = text.find("[")
+    if start < 0:
+        return []
+    decoder = json.JSONDecoder()
+    items = []
+    index = start + 1
+    while index < len(text):
+        while index < len(text) and (text[index].isspace() or text[index] == ","):
+            index += 1
+        if index >= len(text) or text[index] == "]":
+            break
+        try:
+            item, index = decoder.raw_decode(text, index)
+        except ValueError:
+            break
+        items.append(item)
+    return items
+
+
+def parse_json(text: str) -> Tuple[Any, str]:
+    """
+    Parse generated JSON locally.
+
+    Tries, in order: the extracted JSON as is, the repaired JSON, and the
+    complete elements at the start of an array.
+
+    Returns:
+        Tuple of (value, outcome)
+
+    Raises:
+        JsonRepairError: If nothing could be recovered
+    """
+    candidate = extract_json(text)
+    try:
+        return _loads(candidate), FAST
+    except ValueError as e:
+        error = e
+    try:
+        return _loads(repair_json(candidate)), REPAIRED
+    except ValueError:
+        pass
+    items = salvage_json_array(candidate)
+    if items:
+        return items, SALVAGED
+    raise JsonRepairError(f"Invalid JSON output: {error}")
+
+
+def _record(stage: str, outcome: str):
+    get_metrics_registry().record_parse(stage, outcome)
+    if outcome not in (FAST, FAILED):
+        logger.info(f"{stage} output was {outcome} locally")
+
+
+def _fix_messages(content: str, error: Exception) -> List[HumanMessage]:
+    return [HumanMessage(content=FIX_PROMPT.format(error=error, text=content))]
+
+
+def _is_fix_enabled() -> bool:
+    """Ask the model to fix JSON that could not be repaired (off with JSON_FIX=0)."""
+    return os.getenv("JSON_FIX", "1") != "0"
+
+
+def parse_llm_json(response: Any, stage: str, llm: Any) -> Any:
+    """
+    Parse the JSON of a stage response, repairing it locally if needed.
+
+    Output that cannot be repaired is sent back with a short "fix this
+    JSON" request instead of repeating the full prompt.
+
+    Args:
+        response: Message returned by the model
+        stage: Stage of the call, for the parse metrics
+        llm: Client of the stage, used for the fix request
+
+    Returns:
+        The parsed value
+
+    Raises:
+        JsonRepairError: If the fixed output does not parse either; the
+                         stage retries the full request
+    """
+    content = chunk_text(response)
+    try:
+        value, outcome = parse_json(content)
+    except JsonRepairError as e:
+        if not _is_fix_enabled():
+            _record(stage, FAILED)
+            raise
+        try:
+            value, _ = parse_json(chunk_text(llm.invoke(_fix_messages(content, e))))
+        except JsonRepairError:
+            _record(stage, FAILED)
+            raise
+        outcome = FIXED
+    _record(stage, outcome)
+    return value
+
+
+async def aparse_llm_json(response: Any, stage: str, llm: Any) -> Any:
+    """Async version of parse_llm_json."""
+    content = chunk_text(response)
+    try:
+        value, outcome = parse_json(content)
+    except JsonRepairError as e:
+        if not _is_fix_enabled():
+            _record(stage, FAILED)
+            raise
+        try:
+            value, _ = parse_json(
+                chunk_text(await llm.ainvoke(_fix_messages(content, e)))
+            )
+        except JsonRepairError:
+            _record(stage, FAILED)
+            raise
+        outcome = FIXED
+    _record(stage, outcome)
+    return value
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from tools.llm_cache import is_cache_hit
+
+# Weight given to a new sample in the moving average
+SMOOTHING = 0.2
+# Durations kept per stage for percentiles
+RECENT_SAMPLES = 200
+
+_averages: Dict[str, float] = {}
+_recent: Dict[str, Deque[float]] = {}
+_samples: Dict[str, int] = {}
+_loaded = False
+_lock = threading.Lock()
+
+
+def _stats_path() -> str:
+    return os.getenv("LLM_LATENCY_STATS", ".cache/stage_latency.json")
+
+
+def _load():
+    """Seed the averages with the ones saved by previous runs."""
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    try:
+        with open(_stats_path(), "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read stage latency stats: {e}")
+        return
+    for stage, entry in saved.items():
+        _averages.setdefault(stage, float(entry["average"]))
+        _samples.setdefault(stage, int(entry.get("samples", 0)))
+
+
+def record_latency(stage: str, seconds: float):
+    """Add one observed LLM call duration to the moving average of a stage."""
+    with _lock:
+        _load()
+        previous = _averages.get(stage)
+        if previous is None:
+            _averages[stage] = seconds
+        else:
+            _averages[stage] = previous + SMOOTHING * (seconds - previous)
+        _samples[stage] = _samples.get(stage, 0) + 1
+        _recent.setdefault(stage, deque(maxlen=RECENT_SAMPLES)).append(seconds)
+
+
+def estimate_latency(stage: str, default: float = 1.0) -> float:
+    """
+    Expected duration of one LLM call of a stage.
+
+    Args:
+        stage: Stage name (see tools.llm_cache.STAGES)
+        default: Returned when the stage was never observed
+
+    Returns:
+        Moving average of past call durations in seconds
+    """
+    with _lock:
+        _load()
+        return _averages.get(stage, default)
+
+
+def latency_percentile(
+        stage: str, percentile: float, min_samples: int = 1
+) -> Optional[float]:
+    """
+    Percentile of the recent call durations of a stage in this process
+    (requests answered by the provider; cache hits are not recorded).
+
+    Args:
+        stage: Stage name
+        percentile: 0-100
+        min_samples: Return None below this many observed calls
+
+    Returns:
+        Duration in seconds (nearest rank), None without enough samples
+    """
+    with _lock:
+        samples = sorted(_recent.get(stage, ()))
+    if not samples or len(samples) < min_samples:
+        return None
+    rank = int(round(percentile / 100 * (len(samples) - 1)))
+    return samples[min(len(samples) - 1, max(0, rank))]
+
+
+def get_latency_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns:
+        Dict of stage name to {"average": seconds, "samples": int}
+    """
+    with _lock:
+        _load()
+        return {
+            stage: {"average": average, "samples": _samples.get(stage, 0)}
+            for stage, average in _averages.items()
+        }
+
+
+def save_latency_stats():
+    """Persist the averages so the next run starts with realistic estimates."""
+    stats = get_latency_stats()
+    if not stats:
+        return
+    path = _stats_path()
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+    except OSError as e:
+        logging.warning(f"Could not save stage latency stats: {e}")
+
+
+class StageLatencyCallback(BaseCallbackHandler):
+    """Measures every LLM call of one stage and feeds it into the averages."""
+
+    run_inline = True
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started: Optional[float] = self._started.pop(run_id, None)
+        # A cache hit says nothing about how long the provider takes
+        if started is not None and not is_cache_hit(response):
+            record_latency(self.stage, time.perf_counter() - started)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        # Failed calls say nothing about how long a successful one takes
+        self._started.pop(run_id, None)
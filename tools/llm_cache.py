@@ -0,0 +1,353 @@
+import contextvars
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import LLMResult
+
+# Stage names used as cache namespaces / counters (same keys as prompt_map where
+# the stage has a prompt file)
+STAGES = (
+    "task_split",
+    "role_system",
+    "task_jx",
+    "task_plan",
+    "task_result",
+    "task_result_batch",
+    "task_execute",
+    "task_reduce",
+    "dep_summary",
+)
+
+# generation_info flag of responses served from the cache
+CACHE_HIT = "cache_hit"
+
+
+class SQLiteResponseStore:
+    """
+    Content-addressed LLM response store on disk.
+
+    Entries are keyed by a hash of the llm string (provider class, model,
+    base url and call parameters) and the fully formatted message list.
+    SQLite in WAL mode makes the store safe to share between threads and
+    processes; each thread uses its own connection.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        """
+        Args:
+            path: SQLite database file
+            max_bytes: Total size of stored responses before LRU eviction
+            ttl_seconds: Entries older than this are ignored and purged; 0 keeps forever
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, created = row
+        now = time.time()
+        if self.ttl_seconds and now - created > self.ttl_seconds:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+
+        conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+        return value
+
+    def put(self, key: str, value: str):
+        conn = self._connection()
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Drop expired entries, then least recently used ones above max_bytes."""
+        if self.ttl_seconds:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE created < ?", (now - self.ttl_seconds,)
+            )
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Evict down to 90% so that eviction is not triggered on every write
+        target = self.max_bytes * 0.9
+        for key, size in conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        self._connection().execute("DELETE FROM llm_cache")
+
+    def size(self) -> int:
+        return self._connection().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()[0]
+
+
+class CacheAttempt:
+    """
+    Cache use of one attempt of a stage request (see cache_attempt).
+
+    Responses are only written once the stage accepted them, so output that
+    failed to parse or validate is never stored and replayed to the retry or
+    to later runs.
+    """
+
+    def __init__(self, lookup: bool = True):
+        """
+        Args:
+            lookup: Answer from the cache; False for retries, which must not get
+                    the response of the failed attempt again
+        """
+        self.lookup = lookup
+        self._writes: List[Tuple["StageCache", str, str]] = []
+
+    def add(self, cache: "StageCache", key: str, value: str):
+        self._writes.append((cache, key, value))
+
+    def commit(self):
+        """Store the responses of the attempt; called once its output was accepted."""
+        writes, self._writes = self._writes, []
+        for cache, key, value in writes:
+            cache.put(key, value)
+
+
+_attempt: contextvars.ContextVar[Optional[CacheAttempt]] = contextvars.ContextVar(
+    "cache_attempt", default=None
+)
+
+
+@contextmanager
+def cache_attempt(lookup: bool = True) -> Iterator[CacheAttempt]:
+    """
+    Hold back the cache writes of the LLM calls made inside the block until
+    CacheAttempt.commit is called. Calls outside such a block write at once.
+
+    Args:
+        lookup: Whether the calls of the block may be answered from the cache
+    """
+    attempt = CacheAttempt(lookup)
+    token = _attempt.set(attempt)
+    try:
+        yield attempt
+    finally:
+        _attempt.reset(token)
+
+
+class StageCache(BaseCache):
+    """
+    LangChain cache bound to one pipeline stage.
+
+    All stages share the same response store; the stage only decides whether
+    the cache is bypassed and which hit/miss counters are updated. Inside a
+    cache_attempt block, lookups and writes follow the attempt.
+    """
+
+    def __init__(self, store: SQLiteResponseStore, stage: str):
+        self.store = store
+        self.stage = stage
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        attempt = _attempt.get()
+        if is_cache_bypassed(self.stage) or (attempt is not None and not attempt.lookup):
+            return None
+
+        try:
+            value = self.store.get(self.store.make_key(prompt, llm_string))
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache lookup failed for stage {self.stage}: {e}")
+            value = None
+        if value is None:
+            _record(self.stage, "misses")
+            return None
+
+        _record(self.stage, "hits")
+        generations = loads(value)
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), CACHE_HIT: True}
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if is_cache_bypassed(self.stage):
+            return
+        key = self.store.make_key(prompt, llm_string)
+        attempt = _attempt.get()
+        if attempt is not None:
+            attempt.add(self, key, dumps(return_val))
+        else:
+            self.put(key, dumps(return_val))
+
+    def put(self, key: str, value: str):
+        try:
+            self.store.put(key, value)
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache update failed for stage {self.stage}: {e}")
+
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear()
+
+
+def is_cache_hit(response: LLMResult) -> bool:
+    """
+    Whether a response passed to a callback's on_llm_end came from the cache
+    (no request was made: no latency, tokens or cost to record).
+    """
+    generations = [generation for batch in response.generations for generation in batch]
+    return bool(generations) and all(
+        (generation.generation_info or {}).get(CACHE_HIT) for generation in generations
+    )
+
+
+_store: Optional[SQLiteResponseStore] = None
+_stage_caches: Dict[str, StageCache] = {}
+_bypassed_stages: Optional[Set[str]] = None
+_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+_lock = threading.Lock()
+
+
+def _record(stage: str, counter: str):
+    with _lock:
+        _stats[stage][counter] += 1
+
+
+def is_cache_enabled() -> bool:
+    """The cache is opt-in: set LLM_CACHE=1 to enable it."""
+    return os.getenv("LLM_CACHE", "0").lower() in ("1", "true", "yes")
+
+
+def is_cache_bypassed(stage: str) -> bool:
+    """
+    Whether a stage skips the cache.
+
+    Initialised from LLM_CACHE_BYPASS (comma separated stage names) and
+    changed at runtime with set_cache_bypass.
+    """
+    global _bypassed_stages
+    if _bypassed_stages is None:
+        with _lock:
+            if _bypassed_stages is None:
+                raw = os.getenv("LLM_CACHE_BYPASS", "")
+                _bypassed_stages = {s.strip() for s in raw.split(",") if s.strip()}
+    return stage in _bypassed_stages
+
+
+def set_cache_bypass(stage: str, bypass: bool = True):
+    """Turn the cache off (or back on) for a single stage."""
+    is_cache_bypassed(stage)
+    with _lock:
+        if bypass:
+            _bypassed_stages.add(stage)
+        else:
+            _bypassed_stages.discard(stage)
+
+
+def get_response_store() -> SQLiteResponseStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = SQLiteResponseStore(
+                    path=os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite"),
+                    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024),
+                    ttl_seconds=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                )
+    return _store
+
+
+def get_stage_cache(stage: Optional[str]) -> Optional[StageCache]:
+    """
+    Return the cache for a stage, or None when caching is disabled.
+
+    Args:
+        stage: Stage name (see STAGES); None means the call is not cached
+    """
+    if stage is None or not is_cache_enabled():
+        return None
+
+    cache = _stage_caches.get(stage)
+    if cache is None:
+        store = get_response_store()
+        with _lock:
+            cache = _stage_caches.setdefault(stage, StageCache(store, stage))
+    return cache
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Hit / miss counters per stage.
+
+    Returns:
+        Dict of stage name to {"hits": int, "misses": int}
+    """
+    with _lock:
+        return {stage: dict(counters) for stage, counters in _stats.items()}
@@ -1,87 +1,368 @@
 import os
 import random
-import time
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from tools.hedging import HedgedModel, is_hedging_enabled
+from tools.latency_stats import StageLatencyCallback
+from tools.metrics import StageMetricsCallback, key_label
+from tools.tracing import TracingCallback
+from tools.llm_cache import get_stage_cache
+from tools.mock_llm import MockChatModel
+from tools.model_routing import ModelRoute, get_route_cascade
+from tools.retry_policy import (
+    CircuitBreakerCallback,
+    get_circuit_breaker,
+    healthy_keys,
+)
+from tools.rate_limiter import (
+    TokenUsageCallback,
+    configure_rate_limits,
+    get_rate_limiter,
+)
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Global variable to store the last used API key
 _last_used_api_key = None
-# Set to track all API keys used in the current cycle
-_used_api_keys = set()
 
+# Pool of live LLM clients keyed by (provider, model, base_url, api_key).
+# The clients (and their underlying HTTP / gRPC connections) are shared by all
+# executor threads, so keep-alive connections are reused between calls.
+_client_pool: Dict[Tuple[str, str, str, str], Any] = {}
+# Per-stage views of pooled clients (same connections, stage specific cache)
+_stage_clients: Dict[Tuple[str, str, str, str, str], Any] = {}
+_pool_lock = threading.Lock()
+
+
+def _get_provider() -> str:
+    return os.getenv("PROVIDER", "google").lower()
 
-def get_llm_model():
+
+def _get_api_keys(env_name: str = "API_KEYS", provider: Optional[str] = None) -> List[str]:
     """
-    Factory function to create an LLM model based on environment variables.
+    Read API keys from the environment.
+
+    Args:
+        env_name: Variable holding the keys (a model route may use its own)
+        provider: Provider the keys are for, PROVIDER by default
 
     Returns:
-        An instance of a language model (ChatOpenAI, ChatGoogleGenerativeAI, etc.)
+        List of API keys configured in env_name (comma separated)
     """
-    global _last_used_api_key, _used_api_keys
+    api_keys_str = os.getenv(env_name)
+    if not api_keys_str:
+        if (provider or _get_provider()) == "mock":
+            # The mock provider needs no credentials
+            return ["mock-key"]
+        raise ValueError(f"{env_name} not found in environment variables.")
 
-    # Get provider type
-    provider = os.getenv("PROVIDER", "google").lower()
+    return [key.strip() for key in api_keys_str.split(",") if key.strip()]
 
-    # Get API keys the same way for all providers
-    api_keys_str = os.getenv("API_KEYS")
-    if not api_keys_str:
-        raise ValueError("API_KEYS not found in environment variables.")
 
-    # Split API keys string
-    api_keys = [key.strip() for key in api_keys_str.split(", ")]
+def _get_model_config(provider: str) -> Tuple[str, str]:
+    """
+    Resolve model name and base url for a provider.
 
-    # Check if all API keys have been used
-    if len(_used_api_keys) >= len(api_keys):
-        print(
-            "All API keys have been used. Pausing for 10 seconds to reset usage cycle..."
-        )
-        time.sleep(10)
-        # Reset the used keys tracking
-        _used_api_keys.clear()
+    Returns:
+        Tuple of (model_name, base_url); base_url is empty for google and mock
+    """
+    if provider == "mock":
+        return os.getenv("MODEL_NAME", "mock-model"), ""
+
+    if provider == "google":
+        return os.getenv("MODEL_NAME", "gemini-2.5-flash-preview-04-17"), ""
 
-    # Find keys that haven't been used yet
-    available_keys = [key for key in api_keys if key not in _used_api_keys]
+    model_name = os.getenv("MODEL_NAME", "qwen-max")
+    base_url = os.getenv(
+        "BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    )
+    return model_name, base_url
 
-    if available_keys:
-        # Prefer unused keys
-        selected_api_key = random.choice(available_keys)
-    else:
-        # This should not happen due to the reset above, but just in case
-        selected_api_key = random.choice(api_keys)
-        _used_api_keys.clear()  # Reset again as a safety measure
 
-    # Update tracking
-    _last_used_api_key = selected_api_key
-    _used_api_keys.add(selected_api_key)
+def _create_client(provider: str, model_name: str, base_url: str, api_key: str):
+    """
+    Build a new LLM client. Only used to fill the pool.
+
+    Args:
+        provider: Provider name from PROVIDER
+        model_name: Model to use
+        base_url: Base url of an OpenAI compatible endpoint
+        api_key: API key bound to this client
+
+    Returns:
+        An instance of a language model (ChatOpenAI, ChatGoogleGenerativeAI, etc.)
+    """
+    # Every request made through this client waits on the key's RPM/TPM budget
+    # and reports its outcome to the key's circuit breaker
+    rate_limiter = get_rate_limiter(api_key)
+    callbacks = [
+        TokenUsageCallback(rate_limiter),
+        CircuitBreakerCallback(get_circuit_breaker(api_key)),
+    ]
+
+    if provider == "mock":
+        # Offline model, configured with MOCK_* environment variables
+        return MockChatModel.from_env(
+            model_name, rate_limiter=rate_limiter, callbacks=callbacks
+        )
 
     if provider == "google":
         # Create Google Generative AI model
-        model_name = os.getenv("MODEL_NAME", "gemini-2.5-flash-preview-04-17")
-        # print("Using Google Generative AI model:", model_name)
-        # print("Using API key:", selected_api_key)
-        time.sleep(1)
         return ChatGoogleGenerativeAI(
             model=model_name,
-            api_key=selected_api_key,
-        )
-    else:  # Default to OpenAI
-        # Get configuration for OpenAI model
-        model_name = os.getenv("MODEL_NAME", "qwen-max")
-        base_url = os.getenv(
-            "BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"
+            api_key=api_key,
+            rate_limiter=rate_limiter,
+            callbacks=callbacks,
         )
 
-        return ChatOpenAI(
-            model_name=model_name,
-            base_url=base_url,
-            api_key=selected_api_key,
+    # Default to OpenAI compatible endpoint. The http client is shared by all
+    # threads using this pooled model so TCP/TLS connections are kept alive.
+    max_connections = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "32"))
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "120")),
+        ),
+        timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "600")), connect=10.0),
+    )
+    return ChatOpenAI(
+        model_name=model_name,
+        base_url=base_url,
+        api_key=api_key,
+        http_client=http_client,
+        # Report token usage on streamed responses (time-to-first-token metrics)
+        stream_usage=os.getenv("LLM_STREAM_USAGE", "1") != "0",
+        rate_limiter=rate_limiter,
+        callbacks=callbacks,
+    )
+
+
+def get_pooled_client(provider: str, model_name: str, base_url: str, api_key: str):
+    """
+    Return the pooled client for (provider, model, base_url, key), creating it once.
+
+    Returns:
+        A shared, thread-safe language model instance
+    """
+    pool_key = (provider, model_name, base_url, api_key)
+    client = _client_pool.get(pool_key)
+    if client is not None:
+        return client
+
+    with _pool_lock:
+        client = _client_pool.get(pool_key)
+        if client is None:
+            client = _create_client(provider, model_name, base_url, api_key)
+            _client_pool[pool_key] = client
+    return client
+
+
+def get_stage_client(client, pool_key: Tuple[str, str, str, str], stage: Optional[str]):
+    """
+    Return a view of a pooled client for one pipeline stage.
+
+    The view uses the stage's response cache, records the stage's call
+    latency (and, for the mock provider, produces that stage's output schema).
+    It is a shallow copy, so it shares the HTTP client, rate limiter and
+    callbacks of the pooled client.
+    """
+    update = {}
+    if stage is not None:
+        # Lets the stage retry loop tell which key a failed attempt was sent on
+        update["metadata"] = {**(client.metadata or {}), "api_key": key_label(pool_key[3])}
+        update["callbacks"] = list(client.callbacks or []) + [
+            StageLatencyCallback(stage),
+            StageMetricsCallback(stage, pool_key[3], pool_key[1]),
+            TracingCallback(stage, pool_key[3], pool_key[1]),
+        ]
+    cache = get_stage_cache(stage)
+    if cache is not None:
+        update["cache"] = cache
+    if isinstance(client, MockChatModel):
+        update["stage"] = stage
+    if not update:
+        return client
+
+    stage_key = pool_key + (stage,)
+    stage_client = _stage_clients.get(stage_key)
+    if stage_client is None:
+        with _pool_lock:
+            stage_client = _stage_clients.get(stage_key)
+            if stage_client is None:
+                stage_client = client.model_copy(update=update)
+                _stage_clients[stage_key] = stage_client
+    return stage_client
+
+
+def warm_llm_pool(connect: bool = False) -> int:
+    """
+    Create pooled clients for every configured API key ahead of the first call.
+
+    Args:
+        connect: Also open a connection to the endpoint so the first real
+                 request does not pay for the TCP/TLS handshake
+
+    Returns:
+        Number of clients in the pool
+    """
+    provider = _get_provider()
+    model_name, base_url = _get_model_config(provider)
+    api_keys = _get_api_keys()
+    configure_rate_limits(api_keys)
+
+    for api_key in api_keys:
+        client = get_pooled_client(provider, model_name, base_url, api_key)
+        if connect and base_url:
+            try:
+                client.http_client.get(
+                    f"{base_url.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                )
+            except Exception as e:
+                print(f"Failed to warm connection for {base_url}: {e}")
+
+    return len(_client_pool)
+
+
+def clear_llm_pool():
+    """Close and drop every pooled client."""
+    with _pool_lock:
+        for client in _client_pool.values():
+            http_client = getattr(client, "http_client", None)
+            if http_client is not None:
+                http_client.close()
+        _client_pool.clear()
+        _stage_clients.clear()
+
+
+def select_api_key(api_keys: List[str]) -> str:
+    """
+    Pick the API key whose rate limit budget frees up soonest.
+
+    Keys ejected by their circuit breaker are skipped (see
+    tools.retry_policy.healthy_keys). Keys that are equally available are
+    chosen at random to spread load.
+    """
+    waits = {key: get_rate_limiter(key).wait_time() for key in healthy_keys(api_keys)}
+    shortest = min(waits.values())
+    return random.choice([key for key, wait in waits.items() if wait <= shortest])
+
+
+async def aclose_llm_pool():
+    """
+    Close and drop every pooled client at the end of an event loop.
+
+    Async HTTP connections are bound to the loop that opened them, so the pool
+    must not outlive the loop of an async run.
+    """
+    with _pool_lock:
+        clients = list(_client_pool.values())
+        _client_pool.clear()
+        _stage_clients.clear()
+
+    for client in clients:
+        root_async_client = getattr(client, "root_async_client", None)
+        if root_async_client is not None:
+            await root_async_client.close()
+        http_client = getattr(client, "http_client", None)
+        if http_client is not None:
+            http_client.close()
+
+
+def _resolve_route(route: ModelRoute) -> Tuple[str, str, str, str]:
+    """
+    Fill the unset fields of a route from PROVIDER / MODEL_NAME / BASE_URL.
+
+    Returns:
+        Tuple of (provider, model_name, base_url, api keys variable)
+    """
+    provider = (route.provider or _get_provider()).lower()
+    model_name, base_url = _get_model_config(provider)
+    return (
+        provider,
+        route.model or model_name,
+        route.base_url or base_url,
+        route.api_keys_env or "API_KEYS",
+    )
+
+
+def get_model_name(stage: Optional[str] = None, role: Optional[str] = None) -> str:
+    """
+    Model a stage (and role) is routed to, e.g. to pick the tokenizer for its
+    prompts: the first route of the cascade, else MODEL_NAME or the
+    provider's default model.
+    """
+    return _resolve_route(get_route_cascade(stage, role)[0])[1]
+
+
+def get_llm_model(
+        stage: Optional[str] = None, role: Optional[str] = None, fallback: int = 0
+):
+    """
+    Factory function to create an LLM model based on environment variables.
+
+    The model is bound to one API key; requests wait on that key's
+    RATE_LIMIT_RPM / RATE_LIMIT_TPM budget instead of a fixed pause. With
+    HEDGE=1 and several keys, slow requests of a stage are also sent on a
+    second key (see tools.hedging.HedgedModel).
+
+    Stages and roles listed in MODEL_ROUTES use their own provider / model
+    (see tools.model_routing); everything else uses PROVIDER and MODEL_NAME.
+
+    Args:
+        stage: Pipeline stage making the call (see tools.llm_cache.STAGES);
+               enables the persistent response cache for that stage
+        role: Role the call is made for, to apply a per-role route
+        fallback: Position in the route's fallback cascade (0 is the route
+                  itself); the last model is used past the end
+
+    Returns:
+        An instance of a language model (ChatOpenAI, ChatGoogleGenerativeAI, etc.)
+    """
+    global _last_used_api_key
+
+    cascade = get_route_cascade(stage, role)
+    provider, model_name, base_url, api_keys_env = _resolve_route(
+        cascade[min(fallback, len(cascade) - 1)]
+    )
+
+    # Get API keys the same way for all providers
+    api_keys = _get_api_keys(api_keys_env, provider)
+    if api_keys_env == "API_KEYS":
+        # RATE_LIMIT_RPM / RATE_LIMIT_TPM lists are aligned with API_KEYS; keys of
+        # other routes are unlimited unless set with set_rate_limit
+        configure_rate_limits(api_keys)
+
+    selected_api_key = select_api_key(api_keys)
+
+    # Update tracking
+    _last_used_api_key = selected_api_key
+
+    client = get_pooled_client(provider, model_name, base_url, selected_api_key)
+    stage_client = get_stage_client(
+        client, (provider, model_name, base_url, selected_api_key), stage
+    )
+    if stage is None or len(api_keys) < 2 or not is_hedging_enabled():
+        return stage_client
+
+    def backup_client():
+        backup_key = select_api_key([key for key in api_keys if key != selected_api_key])
+        return get_stage_client(
+            get_pooled_client(provider, model_name, base_url, backup_key),
+            (provider, model_name, base_url, backup_key),
+            stage,
         )
 
+    return HedgedModel(stage, stage_client, backup_client)
+
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,423 @@
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from tools.llm_cache import is_cache_hit
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def key_label(api_key: str) -> str:
+    """Stable label for an API key that does not reveal it."""
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+@lru_cache(maxsize=8)
+def _parse_prices(raw: str) -> Dict[str, Tuple[float, float]]:
+    """
+    USD per million input / output tokens by model.
+
+    LLM_PRICES is a JSON object of model name to [input, output]; models not
+    listed use LLM_PRICE_INPUT / LLM_PRICE_OUTPUT (default 0, i.e. no cost).
+    """
+    if not raw:
+        return {}
+    try:
+        return {model: (float(p[0]), float(p[1])) for model, p in json.loads(raw).items()}
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid LLM_PRICES: {e}")
+        return {}
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Estimated USD cost of a call (see _parse_prices)."""
+    input_price, output_price = _parse_prices(os.getenv("LLM_PRICES", "")).get(
+        model,
+        (float(os.getenv("LLM_PRICE_INPUT", "0")), float(os.getenv("LLM_PRICE_OUTPUT", "0"))),
+    )
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class TaskUsage:
+    """
+    LLM usage of one task, including everything called on its behalf.
+
+    Usage added to a scope is also added to its parent, so a top-level task
+    totals the calls of all its subtasks.
+    """
+
+    def __init__(self, parent: Optional["TaskUsage"] = None):
+        self.parent = parent
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.llm_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, input_tokens: int, output_tokens: int, cost: float, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cost += cost
+            self.llm_seconds += seconds
+        if self.parent is not None:
+            self.parent.add(input_tokens, output_tokens, cost, seconds)
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+        if self.parent is not None:
+            self.parent.add_error()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.input_tokens + self.output_tokens,
+                "cost": round(self.cost, 6),
+                "llm_seconds": round(self.llm_seconds, 3),
+            }
+
+
+_current_usage: contextvars.ContextVar[Optional[TaskUsage]] = contextvars.ContextVar(
+    "task_usage", default=None
+)
+
+
+@contextmanager
+def usage_scope(usage: Optional[TaskUsage] = None):
+    """
+    Attribute the LLM calls made inside the block to a task.
+
+    Args:
+        usage: Accumulator to use (to continue a task in another thread);
+               a new child of the current scope by default
+
+    Yields:
+        The TaskUsage of the block
+    """
+    usage = usage or TaskUsage(parent=_current_usage.get())
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+class _SeriesStats:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": round(self.cost, 6),
+            "latency_sum": round(self.latency_sum, 3),
+            "latency_buckets": {
+                **{str(le): count for le, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+                "+Inf": self.latency_buckets[-1],
+            },
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe LLM call metrics per (stage, API key)."""
+
+    def __init__(self):
+        self._series: Dict[Tuple[str, str], _SeriesStats] = {}
+        # Outcomes of parsing structured output: (stage, outcome) -> count
+        self._parses: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, stage: str, key: str) -> _SeriesStats:
+        series = self._series.get((stage, key))
+        if series is None:
+            series = self._series.setdefault((stage, key), _SeriesStats())
+        return series
+
+    def record_call(
+            self,
+            stage: str,
+            key: str,
+            seconds: float,
+            input_tokens: int,
+            output_tokens: int,
+            cost: float,
+    ):
+        with self._lock:
+            series = self._get(stage, key)
+            series.calls += 1
+            series.input_tokens += input_tokens
+            series.output_tokens += output_tokens
+            series.cost += cost
+            series.latency_sum += seconds
+            series.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_cache_hit(self, stage: str, key: str):
+        """Count a response served from the cache; it is not a call (no latency or cost)."""
+        with self._lock:
+            self._get(stage, key).cache_hits += 1
+
+    def record_error(self, stage: str, key: str):
+        with self._lock:
+            self._get(stage, key).errors += 1
+
+    def record_retry(self, stage: str, key: str = ""):
+        with self._lock:
+            self._get(stage, key).retries += 1
+
+    def record_hedge(self, stage: str, won: bool = False):
+        """Count a hedged request of a stage, or one that answered first."""
+        with self._lock:
+            series = self._get(stage, "")
+            if won:
+                series.hedge_wins += 1
+            else:
+                series.hedges += 1
+
+    def record_parse(self, stage: str, outcome: str):
+        """Count how a structured response was parsed (see tools.json_repair)."""
+        with self._lock:
+            self._parses[(stage, outcome)] = self._parses.get((stage, outcome), 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns:
+            {"series": [{"stage", "key", counters...}], "stages": totals per stage,
+            "parses": {stage: {outcome: count}}}
+        """
+        with self._lock:
+            series = [
+                {"stage": stage, "key": key, **stats.to_dict()}
+                for (stage, key), stats in sorted(self._series.items())
+            ]
+            parses: Dict[str, Dict[str, int]] = {}
+            for (stage, outcome), count in sorted(self._parses.items()):
+                parses.setdefault(stage, {})[outcome] = count
+        stages: Dict[str, Dict[str, Any]] = {}
+        for entry in series:
+            total = stages.setdefault(
+                entry["stage"],
+                {
+                    "calls": 0,
+                    "cache_hits": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "hedges": 0,
+                    "hedge_wins": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "cost": 0.0,
+                    "latency_sum": 0.0,
+                },
+            )
+            for name in total:
+                total[name] += entry[name]
+        return {"timestamp": time.time(), "series": series, "stages": stages, "parses": parses}
+
+    def render_prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format."""
+        lines: List[str] = []
+        counters = (
+            ("calls", "LLM calls"),
+            ("cache_hits", "Responses served from the response cache"),
+            ("errors", "Failed LLM calls"),
+            ("retries", "Retried stage attempts"),
+            ("hedges", "Hedged requests sent on a second API key"),
+            ("hedge_wins", "Hedged requests that answered first"),
+            ("input_tokens", "Input tokens"),
+            ("output_tokens", "Output tokens"),
+            ("cost", "Estimated cost in USD"),
+        )
+        snapshot = self.snapshot()
+        series = snapshot["series"]
+        for name, help_text in counters:
+            lines.append(f"# HELP llm_{name}_total {help_text}")
+            lines.append(f"# TYPE llm_{name}_total counter")
+            for entry in series:
+                lines.append(
+                    f'llm_{name}_total{{stage="{entry["stage"]}",key="{entry["key"]}"}} '
+                    f"{entry[name]}"
+                )
+        lines.append("# HELP llm_latency_seconds LLM call latency")
+        lines.append("# TYPE llm_latency_seconds histogram")
+        for entry in series:
+            if not entry["calls"]:
+                continue
+            labels = f'stage="{entry["stage"]}",key="{entry["key"]}"'
+            cumulative = 0
+            for le, count in entry["latency_buckets"].items():
+                cumulative += count
+                lines.append(f'llm_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"llm_latency_seconds_sum{{{labels}}} {entry['latency_sum']}")
+            lines.append(f"llm_latency_seconds_count{{{labels}}} {entry['calls']}")
+        lines.append("# HELP llm_parse_total Structured responses by parse outcome")
+        lines.append("# TYPE llm_parse_total counter")
+        for stage, outcomes in snapshot["parses"].items():
+            for outcome, count in outcomes.items():
+                lines.append(f'llm_parse_total{{stage="{stage}",outcome="{outcome}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._parses.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+def record_retry(stage: str, key: str = ""):
+    """
+    Count a retried attempt of a stage (called from the stage retry loops).
+
+    Args:
+        stage: Stage of the call
+        key: key_label of the API key the failed attempt was sent on
+    """
+    _registry.record_retry(stage, key)
+
+
+def write_metrics(path: str):
+    """
+    Write a metrics snapshot; Prometheus text for *.prom / *.txt, JSON otherwise.
+    """
+    if path.endswith((".prom", ".txt")):
+        content = _registry.render_prometheus()
+    else:
+        content = json.dumps(_registry.snapshot(), indent=2)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {e}")
+
+
+def log_metrics_summary():
+    """Log calls, tokens, latency and cost per stage."""
+    snapshot = _registry.snapshot()
+    stages = snapshot["stages"]
+    # Most expensive stage first, then most time spent
+    for stage, total in sorted(
+            stages.items(), key=lambda item: (-item[1]["cost"], -item[1]["latency_sum"])
+    ):
+        logger.info(
+            f"LLM metrics [{stage}]: {total['calls']} calls, {total['cache_hits']} cached, "
+            f"{total['errors']} errors, "
+            f"{total['retries']} retries, {total['hedges']} hedged "
+            f"({total['hedge_wins']} won), {total['input_tokens']} in / "
+            f"{total['output_tokens']} out tokens, {total['latency_sum']:.1f}s, "
+            f"${total['cost']:.4f}"
+        )
+    for stage, outcomes in snapshot["parses"].items():
+        if set(outcomes) != {"fast"}:
+            logger.info(
+                f"LLM parses [{stage}]: "
+                + ", ".join(f"{count} {outcome}" for outcome, count in outcomes.items())
+            )
+
+
+def _get_usage(response: LLMResult) -> Tuple[int, int]:
+    """Input and output tokens of a response, 0 if the provider reports none."""
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                input_tokens += int(usage.get("input_tokens", 0))
+                output_tokens += int(usage.get("output_tokens", 0))
+    if not input_tokens and not output_tokens:
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = int(token_usage.get("prompt_tokens", 0))
+        output_tokens = int(token_usage.get("completion_tokens", 0))
+    return input_tokens, output_tokens
+
+
+class StageMetricsCallback(BaseCallbackHandler):
+    """
+    Records every LLM call of one stage and API key in the metrics registry.
+
+    Responses served from the response cache are counted as cache hits only,
+    not as calls with tokens, cost and latency.
+    """
+
+    run_inline = True
+
+    def __init__(self, stage: str, api_key: str, model: str):
+        self.stage = stage
+        self.key = key_label(api_key)
+        self.model = model
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if is_cache_hit(response):
+            _registry.record_cache_hit(self.stage, self.key)
+            return
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        input_tokens, output_tokens = _get_usage(response)
+        cost = estimate_cost(self.model, input_tokens, output_tokens)
+        _registry.record_call(self.stage, self.key, seconds, input_tokens, output_tokens, cost)
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(input_tokens, output_tokens, cost, seconds)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started.pop(run_id, None)
+        if isinstance(error, asyncio.CancelledError):
+            # Abandoned on purpose (e.g. the losing side of a hedged request)
+            return
+        _registry.record_error(self.stage, self.key)
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add_error()
@@ -0,0 +1,343 @@
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field, PrivateAttr
+
+WORDS = (
+    "analyse design implement verify document deploy review collect data "
+    "report module service endpoint schema test result summary plan step"
+).split()
+
+
+class MockLLMError(Exception):
+    """Injected provider failure."""
+
+    status_code = 500
+
+
+class MockRateLimitError(MockLLMError):
+    """Injected HTTP 429 with a retry-after hint."""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Distribution:
+    """
+    Samples values (latency in seconds, token counts) from a spec string.
+
+    Supported specs:
+        fixed:<seconds>
+        lognormal:<median seconds>,<sigma>
+        replay:<path>   (one value per line, or a JSON list; replayed in a loop)
+    """
+
+    def __init__(self, spec: str, rng: random.Random):
+        self.spec = spec
+        self.rng = rng
+        kind, _, args = spec.partition(":")
+        self.kind = kind.strip().lower()
+
+        if self.kind == "fixed":
+            self.value = float(args or 0)
+        elif self.kind == "lognormal":
+            median, _, sigma = args.partition(",")
+            self.mu = math.log(float(median))
+            self.sigma = float(sigma or 0.5)
+        elif self.kind == "replay":
+            with open(args.strip(), "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            if content.startswith("["):
+                values = [float(v) for v in json.loads(content)]
+            else:
+                values = [float(line) for line in content.splitlines() if line.strip()]
+            if not values:
+                raise ValueError(f"No values in replay file {args}")
+            self._replay = itertools.cycle(values)
+            self._replay_lock = threading.Lock()
+        else:
+            raise ValueError(f"Unknown distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.value
+        if self.kind == "lognormal":
+            return self.rng.lognormvariate(self.mu, self.sigma)
+        with self._replay_lock:
+            return next(self._replay)
+
+
+class MockChatModel(BaseChatModel):
+    """
+    Offline chat model returning schema-valid output for every pipeline stage.
+
+    Selected with PROVIDER=mock. Latency, token usage and injected failures are
+    configured with MOCK_* environment variables (see from_env), so the
+    executors can be load-tested without network or API keys.
+    """
+
+    model_name: str = "mock-model"
+    stage: Optional[str] = None
+    latency: str = Field(default="fixed:0.0", description="Latency model spec")
+    output_tokens: str = Field(default="fixed:200", description="Output token model spec")
+    tokens_per_second: float = Field(
+        default=0.0, description="Generation speed added to the latency; 0 disables"
+    )
+    failure_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    split_tasks: int = 4
+    roles: int = 3
+    subtasks: int = 4
+    seed: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr()
+    _latency_model: Distribution = PrivateAttr()
+    _token_model: Distribution = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+        self._latency_model = Distribution(self.latency, self._rng)
+        self._token_model = Distribution(self.output_tokens, self._rng)
+
+    @classmethod
+    def from_env(cls, model_name: str, **kwargs) -> "MockChatModel":
+        """Build a mock model from MOCK_* environment variables."""
+        seed = os.getenv("MOCK_SEED")
+        return cls(
+            model_name=model_name,
+            latency=os.getenv("MOCK_LATENCY", "fixed:0.0"),
+            output_tokens=os.getenv("MOCK_OUTPUT_TOKENS", "fixed:200"),
+            tokens_per_second=float(os.getenv("MOCK_TOKENS_PER_SECOND", "0")),
+            failure_rate=float(os.getenv("MOCK_FAILURE_RATE", "0")),
+            rate_limit_rate=float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")),
+            split_tasks=int(os.getenv("MOCK_SPLIT_TASKS", "4")),
+            roles=int(os.getenv("MOCK_ROLES", "3")),
+            subtasks=int(os.getenv("MOCK_SUBTASKS", "4")),
+            seed=int(seed) if seed else None,
+            **kwargs,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "stage": self.stage}
+
+    # ------------------------------------------------------------------
+    # Response generation
+    # ------------------------------------------------------------------
+
+    def _infer_stage(self, messages: List[BaseMessage]) -> str:
+        if self.stage:
+            return self.stage
+        human = str(messages[-1].content) if messages else ""
+        if human.startswith("taks:"):
+            return "task_jx"
+        if human.startswith("task:") and "role=" in human:
+            return "task_result"
+        return "text"
+
+    def _words(self, count: int) -> str:
+        return " ".join(self._rng.choice(WORDS) for _ in range(max(1, count)))
+
+    def _depends_on(self, index: int) -> List[str]:
+        if index == 0:
+            return []
+        candidates = list(range(1, index + 1))
+        count = self._rng.randint(0, min(2, len(candidates)))
+        return [str(i) for i in sorted(self._rng.sample(candidates, count))]
+
+    def _split_output(self) -> str:
+        return json.dumps(
+            [
+                {
+                    "id": str(i + 1),
+                    "description": f"Task {i + 1}: {self._words(6)}",
+                    "dependsOn": self._depends_on(i),
+                }
+                for i in range(self.split_tasks)
+            ],
+            ensure_ascii=False,
+        )
+
+    def _roles(self) -> List[Dict[str, str]]:
+        return [
+            {
+                "role_name": f"Mock Role {i + 1}",
+                "prompt_text": f"### Persona\nYou are Mock Role {i + 1}. {self._words(20)}",
+            }
+            for i in range(self.roles)
+        ]
+
+    def _subtasks(self, role_names: List[str]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": str(i + 1),
+                "description": f"Subtask {i + 1}: {self._words(6)}",
+                "role_name": role_names[i % len(role_names)],
+                "dependsOn": self._depends_on(i),
+            }
+            for i in range(self.subtasks)
+        ]
+
+    def _roles_output(self) -> str:
+        return json.dumps(self._roles(), ensure_ascii=False)
+
+    def _task_jx_output(self, messages: List[BaseMessage]) -> str:
+        human = str(messages[-1].content) if messages else ""
+        role_line = human.split("role:", 1)[1] if "role:" in human else ""
+        role_names = [r.strip() for r in role_line.split(",") if r.strip()]
+        role_names = role_names or [f"Mock Role {i + 1}" for i in range(self.roles)]
+        return "```json\n" + json.dumps(
+            self._subtasks(role_names), ensure_ascii=False
+        ) + "\n```"
+
+    def _task_plan_output(self) -> str:
+        roles = self._roles()
+        return json.dumps(
+            {"roles": roles, "tasks": self._subtasks([r["role_name"] for r in roles])},
+            ensure_ascii=False,
+        )
+
+    def _task_result_batch_output(self, messages: List[BaseMessage]) -> str:
+        try:
+            tasks = json.loads(str(messages[-1].content))
+        except ValueError:
+            tasks = []
+        return json.dumps(
+            {str(task.get("id")): "markdown 文档" for task in tasks}, ensure_ascii=False
+        )
+
+    def _respond(self, messages: List[BaseMessage]) -> Tuple[str, int]:
+        """
+        Returns:
+            Tuple of (content, output tokens)
+        """
+        stage = self._infer_stage(messages)
+        if stage == "task_split":
+            content = self._split_output()
+        elif stage == "role_system":
+            content = self._roles_output()
+        elif stage == "task_jx":
+            content = self._task_jx_output(messages)
+        elif stage == "task_plan":
+            content = self._task_plan_output()
+        elif stage == "task_result":
+            content = "markdown 文档"
+        elif stage == "task_result_batch":
+            content = self._task_result_batch_output(messages)
+        else:
+            # Free text stages: one word per sampled output token
+            output_tokens = max(1, int(self._token_model.sample()))
+            return self._words(output_tokens), output_tokens
+        return content, max(1, len(content) // 4)
+
+    def _prepare(self, messages: List[BaseMessage]):
+        """
+        Draw failures and latency for one request.
+
+        Returns:
+            Tuple of (content, usage_metadata, delay before first token, delay per token)
+        """
+        roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            raise MockRateLimitError("Mock provider: 429 Too Many Requests")
+        if roll < self.rate_limit_rate + self.failure_rate:
+            raise MockLLMError("Mock provider: injected failure")
+
+        content, output_tokens = self._respond(messages)
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return content, usage, self._latency_model.sample(), per_token
+
+    def _chunks(self, content: str) -> List[str]:
+        words = content.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content, usage, delay, per_token = self._prepare(messages)
+        time.sleep(delay + per_token * usage["output_tokens"])
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content, usage, delay, per_token = self._prepare(messages)
+        await asyncio.sleep(delay + per_token * usage["output_tokens"])
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        content, usage, delay, per_token = self._prepare(messages)
+        time.sleep(delay)
+        chunks = self._chunks(content)
+        for i, text in enumerate(chunks):
+            time.sleep(per_token * usage["output_tokens"] / len(chunks))
+            chunk = AIMessageChunk(
+                content=text, usage_metadata=usage if i == len(chunks) - 1 else None
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        content, usage, delay, per_token = self._prepare(messages)
+        await asyncio.sleep(delay)
+        chunks = self._chunks(content)
+        for i, text in enumerate(chunks):
+            await asyncio.sleep(per_token * usage["output_tokens"] / len(chunks))
+            chunk = AIMessageChunk(
+                content=text, usage_metadata=usage if i == len(chunks) - 1 else None
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(
+                    text, chunk=ChatGenerationChunk(message=chunk)
+                )
+            yield ChatGenerationChunk(message=chunk)
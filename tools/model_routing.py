@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRoute(BaseModel):
+    """Where the calls of a stage (or of a role in a stage) go; None fields use the defaults."""
+
+    provider: Optional[str] = Field(default=None, description="PROVIDER by default")
+    model: Optional[str] = Field(default=None, description="MODEL_NAME by default")
+    base_url: Optional[str] = Field(default=None, description="BASE_URL by default")
+    api_keys_env: Optional[str] = Field(
+        default=None, description="Environment variable holding the keys, API_KEYS by default"
+    )
+
+
+def _entry(value: Any) -> Dict[str, Any]:
+    # A bare string is a model name
+    return {"model": value} if isinstance(value, str) else dict(value or {})
+
+
+def _route(entry: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> ModelRoute:
+    fields = {name: entry.get(name) for name in ModelRoute.model_fields}
+    if base is not None:
+        fields = {name: fields[name] or base.get(name) for name in fields}
+    return ModelRoute(**fields)
+
+
+def _cascade(entry: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> List[ModelRoute]:
+    """The route of an entry followed by its fallbacks (which start from the defaults)."""
+    fallback = entry.get("fallback")
+    if fallback is None and base is not None:
+        fallback = base.get("fallback")
+    if isinstance(fallback, (str, dict)):
+        fallback = [fallback]
+    return [_route(entry, base)] + [_route(_entry(item)) for item in fallback or []]
+
+
+@lru_cache(maxsize=8)
+def _parse_routes(raw: str) -> Dict[str, Any]:
+    """
+    Routing table from MODEL_ROUTES: inline JSON or the path of a JSON file.
+
+    Maps a stage to a model name or to an object with any of provider,
+    model, base_url, api_keys_env, fallback (list of routes tried in order
+    when the output does not parse or validate) and roles (role name to a
+    route overriding the stage's fields), e.g.
+
+        {"role_system": {"model": "qwen-turbo", "fallback": ["qwen-max"]},
+         "task_execute": {"roles": {"Reviewer": "qwen-max"}}}
+    """
+    if not raw:
+        return {}
+    try:
+        if raw.lstrip().startswith("{"):
+            routes = json.loads(raw)
+        else:
+            with open(raw, "r", encoding="utf-8") as f:
+                routes = json.load(f)
+        for stage, value in routes.items():
+            _cascade(_entry(value))
+            for role_value in _entry(value).get("roles", {}).values():
+                _cascade(_entry(role_value), _entry(value))
+        return routes
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid MODEL_ROUTES: {e}")
+        return {}
+
+
+def get_route_cascade(stage: Optional[str], role: Optional[str] = None) -> List[ModelRoute]:
+    """
+    Routes for a call site, most preferred first.
+
+    Args:
+        stage: Pipeline stage (see tools.llm_cache.STAGES)
+        role: Role the call is made for; its override wins over the stage route
+
+    Returns:
+        At least one route; [ModelRoute()] (all defaults) for unrouted stages
+    """
+    value = _parse_routes(os.getenv("MODEL_ROUTES", "")).get(stage) if stage else None
+    if value is None:
+        return [ModelRoute()]
+    entry = _entry(value)
+    roles = entry.get("roles") or {}
+    if role is not None and role in roles:
+        return _cascade(_entry(roles[role]), entry)
+    return _cascade(entry)
+
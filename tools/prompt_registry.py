@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+from langchain_core.messages import SystemMessage
+
+from tools.dep_context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def compile_chat_prompt(
+        system_prompt: str, human_template: str, system_is_template: bool = False
+) -> ChatPromptTemplate:
+    """
+    Build the two-message chat prompt used by the planning stages.
+
+    Args:
+        system_prompt: System prompt text
+        human_template: Template of the human message, e.g. "{task}"
+        system_is_template: Parse the system prompt as a template too (its
+                            braces are placeholders) instead of sending it as is
+
+    Returns:
+        ChatPromptTemplate
+    """
+    if system_is_template:
+        system = SystemMessagePromptTemplate.from_template(system_prompt)
+    else:
+        system = SystemMessage(content=system_prompt)
+    return ChatPromptTemplate.from_messages(
+        [system, HumanMessagePromptTemplate.from_template(human_template)]
+    )
+
+
+class _PromptEntry:
+    def __init__(self, path: str, mtime_ns: int, text: str):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.text = text
+        # Counted on first use: the tokenizer may have to be downloaded
+        self.tokens: Optional[int] = None
+        # Compiled templates by (human template, system_is_template)
+        self.templates: Dict[Tuple[str, bool], ChatPromptTemplate] = {}
+
+
+class PromptRegistry(Mapping):
+    """
+    Prompt files loaded once and shared by every stage.
+
+    Behaves like the prompt_map dict (key -> prompt text). Each file is read
+    once, each chat prompt compiled once, and a file is only
+    read again when its mtime changes, so prompts can be edited while runs are
+    in progress. Files are checked at most every check_interval seconds.
+    """
+
+    def __init__(self, files_mapping: Dict[str, str], check_interval: float = 1.0):
+        """
+        Args:
+            files_mapping: Prompt key to file path
+            check_interval: Minimum seconds between mtime checks of a file
+        """
+        self.files_mapping = dict(files_mapping)
+        self.check_interval = check_interval
+        self._entries: Dict[str, _PromptEntry] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        for key in self.files_mapping:
+            self._refresh(key, force=True)
+
+    def _refresh(self, key: str, force: bool = False) -> Optional[_PromptEntry]:
+        path = self.files_mapping.get(key)
+        if path is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not force and now - self._checked.get(key, 0.0) < self.check_interval:
+                return entry
+            self._checked[key] = now
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                if entry is not None and entry.mtime_ns == mtime_ns:
+                    return entry
+                with open(path, "r", encoding="utf-8") as file:
+                    text = file.read()
+            except OSError as e:
+                logger.error(f"Error reading {path}: {e}")
+                return entry
+
+            entry = _PromptEntry(path, mtime_ns, text)
+            self._entries[key] = entry
+        logger.info(f"Successfully read: {path} as '{key}'")
+        return entry
+
+    def __getitem__(self, key: str) -> str:
+        entry = self._refresh(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry.text
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([key for key in self.files_mapping if key in self._entries])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def tokens(self, key: str) -> int:
+        """Token count of a prompt, computed once per file version (0 if missing)."""
+        entry = self._refresh(key)
+        if entry is None:
+            return 0
+        if entry.tokens is None:
+            entry.tokens = count_tokens(entry.text)
+        return entry.tokens
+
+    def chat_prompt(
+            self, key: str, human_template: str, system_is_template: bool = False
+    ) -> ChatPromptTemplate:
+        """
+        Compiled chat prompt with the prompt `key` as system message.
+
+        Args:
+            key: Prompt key (e.g. role_system)
+            human_template: Template of the human message
+            system_is_template: See compile_chat_prompt
+
+        Returns:
+            ChatPromptTemplate, compiled once per file version
+        """
+        entry = self._refresh(key)
+        if entry is None:
+            return compile_chat_prompt("", human_template, system_is_template)
+        template_key = (human_template, system_is_template)
+        template = entry.templates.get(template_key)
+        if template is None:
+            template = compile_chat_prompt(entry.text, human_template, system_is_template)
+            entry.templates[template_key] = template
+        return template
+
+
+def get_chat_prompt(
+        prompt_map: Mapping, key: str, human_template: str, system_is_template: bool = False
+) -> ChatPromptTemplate:
+    """
+    Chat prompt for a stage; compiled once when prompt_map is a PromptRegistry,
+    built on every call for a plain dict.
+    """
+    if isinstance(prompt_map, PromptRegistry):
+        return prompt_map.chat_prompt(key, human_template, system_is_template)
+    return compile_chat_prompt(prompt_map.get(key, ""), human_template, system_is_template)
+
+
+_registries: Dict[Tuple[Tuple[str, str], ...], PromptRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_prompt_registry(files_mapping: Dict[str, str]) -> PromptRegistry:
+    """
+    Process-wide registry for a set of prompt files, created on first use.
+
+    Args:
+        files_mapping: Prompt key to file path
+
+    Returns:
+        The shared PromptRegistry for this mapping
+    """
+    registry_key = tuple(sorted(files_mapping.items()))
+    with _registries_lock:
+        registry = _registries.get(registry_key)
+        if registry is None:
+            registry = PromptRegistry(
+                files_mapping, float(os.getenv("PROMPT_RELOAD_INTERVAL", "1.0"))
+            )
+            _registries[registry_key] = registry
+        return registry
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from tools.llm_cache import is_cache_hit
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+
+    The balance may go negative: usage that is only known after a request
+    finishes (e.g. output tokens) is charged as debt and repaid by refilling.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            per_minute: Refill rate; 0 or less disables the bucket
+            capacity: Maximum burst size, defaults to one minute of budget
+        """
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 0) -> float:
+        """
+        Seconds until `amount` tokens would be available, without taking them.
+        """
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = amount - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take `amount` tokens now, borrowing against future refills if needed.
+
+        Returns:
+            Seconds the caller must wait before the reservation is covered
+        """
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            missing = -self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        """Charge tokens that were already used (may leave the bucket in debt)."""
+        if self.unlimited:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+
+class KeyRateLimiter(BaseRateLimiter):
+    """
+    Requests-per-minute and tokens-per-minute budget for a single API key.
+
+    Plugged into the pooled chat model as its `rate_limiter`, so every request
+    (including stage retries) waits exactly as long as the budget requires.
+    """
+
+    def __init__(self, api_key: str, rpm: float = 0, tpm: float = 0):
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm: float = 0, tpm: float = 0):
+        """Replace the budget of this key; 0 means unlimited."""
+        with self._lock:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+
+    def wait_time(self) -> float:
+        """Seconds a new request on this key would currently have to wait."""
+        return max(self.requests.wait_time(1), self.tokens.wait_time(0))
+
+    def _reserve(self, blocking: bool) -> Optional[float]:
+        with self._lock:
+            wait = self.wait_time()
+            if wait > 0 and not blocking:
+                return None
+            # Token usage is only known afterwards, so a request is admitted
+            # once the token bucket is out of debt.
+            return max(self.requests.reserve(1), self.tokens.wait_time(0))
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+    def record_tokens(self, total_tokens: int):
+        """Charge the tokens used by a finished request against the TPM budget."""
+        self.tokens.consume(total_tokens)
+
+
+def get_total_tokens(response: LLMResult) -> int:
+    """
+    Extract total token usage from an LLMResult across providers.
+
+    Returns:
+        Total tokens reported by the provider, 0 if not reported
+    """
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage.get("total_tokens"):
+        return int(token_usage["total_tokens"])
+
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                total += int(usage.get("total_tokens", 0))
+    return total
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Feeds actual token usage of each request back into the key's limiter."""
+
+    # Cheap bookkeeping; run on the calling thread / event loop
+    run_inline = True
+
+    def __init__(self, limiter: KeyRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        # Cache hits never reached the provider
+        if not is_cache_hit(response):
+            self.limiter.record_tokens(get_total_tokens(response))
+
+
+_limiters: Dict[str, KeyRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _parse_budget(env_name: str, api_keys: List[str]) -> Dict[str, float]:
+    """
+    Read a per-key budget from the environment.
+
+    The value is either a single number applied to every key, or a comma
+    separated list aligned with API_KEYS (e.g. RATE_LIMIT_RPM="60, 30").
+    """
+    raw = os.getenv(env_name, "")
+    values = [value.strip() for value in raw.split(",") if value.strip()]
+    if not values:
+        return {key: 0 for key in api_keys}
+    if len(values) == 1:
+        return {key: float(values[0]) for key in api_keys}
+    if len(values) != len(api_keys):
+        raise ValueError(
+            f"{env_name} has {len(values)} values but API_KEYS has {len(api_keys)} keys"
+        )
+    return {key: float(value) for key, value in zip(api_keys, values)}
+
+
+def configure_rate_limits(api_keys: List[str]):
+    """
+    Create limiters for all keys from RATE_LIMIT_RPM / RATE_LIMIT_TPM.
+
+    Keys that already have a limiter keep it (and its current budget state).
+    """
+    rpm = _parse_budget("RATE_LIMIT_RPM", api_keys)
+    tpm = _parse_budget("RATE_LIMIT_TPM", api_keys)
+    with _limiters_lock:
+        for key in api_keys:
+            if key not in _limiters:
+                _limiters[key] = KeyRateLimiter(key, rpm=rpm[key], tpm=tpm[key])
+
+
+def set_rate_limit(api_key: str, rpm: float = 0, tpm: float = 0):
+    """Set (or replace) the budget of a single key; 0 means unlimited."""
+    get_rate_limiter(api_key).configure(rpm, tpm)
+
+
+def get_rate_limiter(api_key: str) -> KeyRateLimiter:
+    """Return the limiter of a key, unlimited if it was never configured."""
+    limiter = _limiters.get(api_key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(api_key, KeyRateLimiter(api_key))
+    return limiter
@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Record kinds: a role prompt (written once per top-level task), a subtask
+# result and a top-level result whose children are subtask ids
+ROLE = "role"
+SUBTASK = "subtask"
+TASK = "task"
+
+# Fields of a result still read after it was written: dependency context of
+# later tasks, leaf selection of the parent's reduce step and the run summary
+RETAINED_FIELDS = ("task_id", "status", "description", "dependsOn", "result", "error")
+
+
+def _dumps(record: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, default=str, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def _loads(line: bytes) -> Dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+class ResultSink:
+    """
+    Appends one compact JSON line per finished task while the run goes on.
+
+    Subtask results are written as they complete. A top-level result
+    refers to its subtasks by id instead of repeating them, and a role's
+    system prompt is written once per top-level task instead of once per
+    subtask. read_results rebuilds the nested view of execute_tasks.
+
+    Executors writing to a sink only keep retained_result of each written
+    result in memory.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSONL file to append to (created with its directory)
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        # (top-level task id, role name) and (top-level task id, subtask id) written so far
+        self._roles: Set[Tuple[Optional[str], str]] = set()
+        self._subtasks: Set[Tuple[Optional[str], str]] = set()
+
+    def _write(self, lines: List[bytes]):
+        if not lines:
+            return
+        with self._lock:
+            self._file.write(b"".join(lines))
+            # Flushed per record so consumers can tail the file
+            self._file.flush()
+
+    def _subtask_lines(self, parent: Optional[str], result: Dict[str, Any]) -> List[bytes]:
+        key = (parent, str(result.get("task_id")))
+        with self._lock:
+            if key in self._subtasks:
+                return []
+            self._subtasks.add(key)
+        lines = []
+        record = {"record": SUBTASK, "parent": parent, **result}
+        prompt = record.pop("role_sys_prompt", None)
+        role_name = result.get("role_name")
+        if prompt is not None and role_name is not None:
+            with self._lock:
+                new_role = (parent, role_name) not in self._roles
+                self._roles.add((parent, role_name))
+            if new_role:
+                lines.append(
+                    _dumps(
+                        {"record": ROLE, "parent": parent, "role_name": role_name, "prompt": prompt}
+                    )
+                )
+        lines.append(_dumps(record))
+        return lines
+
+    def write_subtask(self, parent: Optional[str], result: Dict[str, Any]):
+        """
+        Write the result of a subtask.
+
+        Args:
+            parent: Id of the top-level task the subtask belongs to
+            result: Subtask result as returned by TaskJxExecutor
+        """
+        self._write(self._subtask_lines(parent, result))
+
+    def write_task(self, result: Dict[str, Any]):
+        """
+        Write the result of a top-level task; subtasks not written yet
+        (e.g. restored from a checkpoint) are written first.
+        """
+        parent = result.get("task_id")
+        children = result.get("children") or []
+        lines = []
+        for child in children:
+            lines += self._subtask_lines(parent, child)
+        record = {"record": TASK, **result}
+        if "children" in result:
+            record["children"] = [child.get("task_id") for child in children]
+        lines.append(_dumps(record))
+        self._write(lines)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def retained_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    What an executor keeps of a result once the sink has written it.
+
+    Children, role prompts, stream metrics and usage are only in the sink
+    file from then on (see read_results), so a run holds one short entry per
+    task instead of every nested result.
+    """
+    return {field: result[field] for field in RETAINED_FIELDS if field in result}
+
+
+def read_results(path: str) -> List[Dict[str, Any]]:
+    """
+    Rebuild the nested results (as returned by execute_tasks) from a sink file.
+
+    Top-level tasks are returned in completion order. Subtasks whose
+    top-level task never finished (e.g. the run was interrupted) are
+    grouped under an entry with status "incomplete".
+
+    Args:
+        path: File written by ResultSink
+
+    Returns:
+        List of top-level task results with their children
+    """
+    roles: Dict[Tuple[Optional[str], str], str] = {}
+    subtasks: Dict[Optional[str], Dict[str, Dict[str, Any]]] = {}
+    tasks: List[Dict[str, Any]] = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = _loads(line)
+            except ValueError:
+                # Last line of a file that is still being written
+                logger.warning(f"Skipping unreadable line in {path}")
+                continue
+            kind = record.pop("record", None)
+            if kind == ROLE:
+                roles[(record["parent"], record["role_name"])] = record["prompt"]
+            elif kind == SUBTASK:
+                parent = record.pop("parent")
+                role_name = record.get("role_name")
+                if (parent, role_name) in roles:
+                    record["role_sys_prompt"] = roles[(parent, role_name)]
+                subtasks.setdefault(parent, {})[record["task_id"]] = record
+            elif kind == TASK:
+                tasks.append(record)
+
+    for task in tasks:
+        own = subtasks.pop(task["task_id"], {})
+        if "children" in task:
+            task["children"] = [own[child_id] for child_id in task["children"] if child_id in own]
+    for parent, own in subtasks.items():
+        tasks.append({"task_id": parent, "status": "incomplete", "children": list(own.values())})
+    return tasks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the nested results of a result sink file as JSON"
+    )
+    parser.add_argument("path", help="JSONL file written during a run")
+    parser.add_argument("-o", "--output", help="Write to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = read_results(args.path)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
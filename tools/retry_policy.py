@@ -0,0 +1,415 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.exceptions import OutputParserException
+from langchain_core.outputs import LLMResult
+from pydantic import ValidationError
+
+from tools.llm_cache import cache_attempt, is_cache_hit
+from tools.metrics import key_label, record_retry
+
+logger = logging.getLogger(__name__)
+
+# Error classes (see classify_error)
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+KEY = "key"
+FATAL = "fatal"
+OUTPUT = "output"
+
+
+class InvalidOutputError(ValueError):
+    """A response that parsed but is not usable by its stage (e.g. an invalid plan)."""
+
+
+# Failures of the response rather than of the request or of local code
+_OUTPUT_ERRORS = (InvalidOutputError, json.JSONDecodeError, ValidationError, OutputParserException)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for value in (
+            getattr(error, "status_code", None),
+            getattr(getattr(error, "response", None), "status_code", None),
+            getattr(error, "code", None),
+    ):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Kind of a failed attempt:
+
+    - RATE_LIMIT: HTTP 429
+    - TRANSIENT: 408, 409, 5xx, timeouts and connection errors
+    - KEY: 401 / 403, the key itself is unusable
+    - OUTPUT: the response did not parse or validate (InvalidOutputError,
+      JSON decode errors, pydantic ValidationError, OutputParserException)
+    - FATAL: any other 4xx, the same request fails again on every key, and
+      anything else (most likely a bug that a retry does not fix)
+    """
+    status = _status_code(error)
+    if status == 429:
+        return RATE_LIMIT
+    if status in (401, 403):
+        return KEY
+    if status in (408, 409) or (status is not None and status >= 500):
+        return TRANSIENT
+    if status is not None and 400 <= status < 500:
+        return FATAL
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)) or any(
+            name in type(error).__name__ for name in ("Timeout", "Connect")
+    ):
+        return TRANSIENT
+    if isinstance(error, _OUTPUT_ERRORS):
+        return OUTPUT
+    return FATAL
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked to wait (retry_after or a Retry-After header)."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """
+    Health of one API key.
+
+    A key is ejected (open) for cooldown seconds after failure_threshold
+    consecutive provider errors, immediately on 401 / 403, and for the
+    Retry-After of a 429. Once the time is up the key takes requests again;
+    one success closes the circuit, one more failure ejects it again.
+    """
+
+    def __init__(self, api_key: str, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.key = key_label(api_key)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self, error: BaseException):
+        kind = classify_error(error)
+        if kind in (FATAL, OUTPUT):
+            # Says nothing about the key
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.failures += 1
+            until = now + (retry_after(error) or 0.0)
+            if kind == KEY or self.failures >= self.failure_threshold:
+                until = max(until, now + self.cooldown)
+            opened = until > max(now, self.open_until)
+            self.open_until = max(self.open_until, until)
+        if opened:
+            logger.warning(
+                f"API key {self.key} ejected for {until - now:.1f}s after {kind} error: {error}"
+            )
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(api_key: str) -> CircuitBreaker:
+    breaker = _breakers.get(api_key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(api_key)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    api_key,
+                    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+                    cooldown=float(os.getenv("CIRCUIT_COOLDOWN", "30")),
+                )
+                _breakers[api_key] = breaker
+    return breaker
+
+
+def healthy_keys(api_keys: List[str]) -> List[str]:
+    """
+    Keys whose circuit is closed; if every key is ejected, the one that
+    comes back first.
+    """
+    healthy = [key for key in api_keys if get_circuit_breaker(key).available()]
+    if healthy:
+        return healthy
+    return [min(api_keys, key=lambda key: get_circuit_breaker(key).open_until)]
+
+
+def _wait_for_key() -> float:
+    """Seconds until some known key takes requests again (0 if one does now)."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    if not breakers:
+        return 0.0
+    return max(0.0, min(breaker.open_until for breaker in breakers) - time.monotonic())
+
+
+class RetryBudget:
+    """
+    Run-wide cap on retries: at most min_retries plus ratio of all requests,
+    so a failing provider is not hit with three times the normal load.
+    """
+
+    def __init__(self, ratio: float, min_retries: int):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+_budget = RetryBudget(
+    float(os.getenv("RETRY_BUDGET_RATIO", "0.2")), int(os.getenv("RETRY_BUDGET_MIN", "10"))
+)
+
+
+def get_retry_budget() -> RetryBudget:
+    return _budget
+
+
+class CircuitBreakerCallback(BaseCallbackHandler):
+    """Feeds the outcome of every request of a key into its circuit breaker."""
+
+    run_inline = True
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        _budget.count_request()
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        _budget.count_request()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if not is_cache_hit(response):
+            self.breaker.record_success()
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        if not isinstance(error, asyncio.CancelledError):
+            self.breaker.record_failure(error)
+
+
+def _retry_delay(
+        stage: str, error: Exception, attempt: int, max_attempts: int, key: str = ""
+) -> Optional[float]:
+    """
+    Decide whether a failed attempt is retried and how long to wait first.
+
+    Provider errors back off exponentially with full jitter (RETRY_BASE_DELAY,
+    default 0.5s, capped at RETRY_MAX_DELAY, default 30s). The retry picks a
+    new key, so a rate limit is only waited out when every key is ejected.
+    Unparseable output is retried at once. key is the key_label of the API
+    key of the failed attempt, for the per-key retry count.
+
+    Returns:
+        Seconds to wait, None to give up
+    """
+    kind = classify_error(error)
+    if attempt >= max_attempts:
+        return None
+    if kind == FATAL:
+        logger.warning(f"{stage} attempt {attempt} failed with a non-retryable error: {error}")
+        return None
+    if not _budget.try_acquire():
+        logger.warning(f"{stage} attempt {attempt} failed, retry budget exhausted: {error}")
+        return None
+
+    delay = 0.0
+    if kind != OUTPUT:
+        base = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+        cap = float(os.getenv("RETRY_MAX_DELAY", "30"))
+        delay = max(random.uniform(0, min(cap, base * 2 ** (attempt - 1))), _wait_for_key())
+    record_retry(stage, key)
+    logger.warning(f"Attempt {attempt} failed: {error}. Retrying in {delay:.2f}s...")
+    return delay
+
+
+def _get_stage_client(stage: str, role: Optional[str], fallback: int) -> Any:
+    # Imported here: tools.llm_generatory uses this module to build its clients
+    from tools.llm_generatory import get_llm_model
+
+    return get_llm_model(stage=stage, role=role, fallback=fallback)
+
+
+def _log_raw_response(response: Any):
+    if response is not None:
+        logger.error(f"Raw Response: {getattr(response, 'content', str(response))}")
+
+
+class StageAttempts:
+    """
+    Attempts of one stage request under the retry policy.
+
+    llm is the client of the current attempt. After a failed attempt, retry()
+    waits (see _retry_delay) and moves on to a fresh client from get_llm_model,
+    which avoids ejected keys; output that did not parse or validate also
+    moves one step up the model fallback cascade of the stage. Only the first
+    attempt may be answered from the response cache.
+    """
+
+    def __init__(self, stage: str, role: Optional[str] = None, max_attempts: int = 3):
+        """
+        Args:
+            stage: Stage of the call (see tools.llm_cache.STAGES)
+            role: Role the call is made for, to apply a per-role model route
+            max_attempts: Attempts before giving up
+        """
+        self.stage = stage
+        self.role = role
+        self.max_attempts = max_attempts
+        self.attempt = 1
+        self.fallback = 0
+        self.llm = _get_stage_client(stage, role, self.fallback)
+
+    def _give_up_or_delay(self, error: Exception) -> Optional[float]:
+        # Stage clients carry the label of their key (see get_stage_client)
+        key = (getattr(self.llm, "metadata", None) or {}).get("api_key", "")
+        delay = _retry_delay(self.stage, error, self.attempt, self.max_attempts, key)
+        if delay is None:
+            logger.error(f"{self.stage} failed after {self.attempt} attempts: {error}")
+        return delay
+
+    def _next_attempt(self, error: Exception):
+        self.attempt += 1
+        if classify_error(error) == OUTPUT:
+            self.fallback += 1
+        self.llm = _get_stage_client(self.stage, self.role, self.fallback)
+
+    def retry(self, error: Exception) -> bool:
+        """
+        Called after a failed attempt; sleeps before the next one.
+
+        Returns:
+            True to retry with self.llm, False to give up
+        """
+        delay = self._give_up_or_delay(error)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        self._next_attempt(error)
+        return True
+
+    async def aretry(self, error: Exception) -> bool:
+        """Async version of retry."""
+        delay = self._give_up_or_delay(error)
+        if delay is None:
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_attempt(error)
+        return True
+
+
+def call_with_retries(
+        stage: str,
+        call: Callable[[Any], Any],
+        parse: Optional[Callable[[Any, Any], Any]] = None,
+        default: Any = None,
+        role: Optional[str] = None,
+        max_attempts: int = 3,
+) -> Any:
+    """
+    Make a stage request under the retry policy (see StageAttempts).
+
+    Args:
+        stage: Stage of the call (see tools.llm_cache.STAGES)
+        call: Sends the request on the client of an attempt: call(llm) -> response
+        parse: Turns the response into the result: parse(response, llm); a parse
+               or validation error retries the request
+        default: Returned once the request is given up
+        role: Role the call is made for, to apply a per-role model route
+        max_attempts: Attempts before giving up
+
+    Returns:
+        The parsed result (the response itself without parse), or default
+    """
+    attempts = StageAttempts(stage, role, max_attempts)
+    while True:
+        response = None
+        try:
+            with cache_attempt(lookup=attempts.attempt == 1) as cached:
+                response = call(attempts.llm)
+                result = response if parse is None else parse(response, attempts.llm)
+            # The response is only cached once it parsed and validated
+            cached.commit()
+            return result
+        except Exception as e:
+            if not attempts.retry(e):
+                _log_raw_response(response)
+                return default
+
+
+async def acall_with_retries(
+        stage: str,
+        call: Callable[[Any], Awaitable[Any]],
+        parse: Optional[Callable[[Any, Any], Any]] = None,
+        default: Any = None,
+        role: Optional[str] = None,
+        max_attempts: int = 3,
+) -> Any:
+    """Async version of call_with_retries; parse may be sync or async."""
+    attempts = StageAttempts(stage, role, max_attempts)
+    while True:
+        response = None
+        try:
+            with cache_attempt(lookup=attempts.attempt == 1) as cached:
+                response = await call(attempts.llm)
+                result = response if parse is None else parse(response, attempts.llm)
+                if inspect.isawaitable(result):
+                    result = await result
+            cached.commit()
+            return result
+        except Exception as e:
+            if not await attempts.aretry(e):
+                _log_raw_response(response)
+                return default
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+
+class StreamMetrics(BaseModel):
+    """Latency profile of one streamed generation"""
+
+    time_to_first_token: float = Field(
+        default=0.0, description="Seconds from request to the first non-empty chunk"
+    )
+    total_time: float = Field(default=0.0, description="Seconds until the stream ended")
+    output_tokens: int = Field(
+        default=0, description="Output tokens (provider usage, else chunk count)"
+    )
+    tokens_per_second: float = Field(
+        default=0.0, description="Output tokens per second after the first token"
+    )
+
+
+class PartialResultWriter:
+    """
+    Appends streamed chunks to a file as they arrive, so long running tasks
+    can be followed (e.g. with `tail -f`) before they finish.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def start(self):
+        """Open (and truncate) the file; called at the start of every attempt."""
+        self.close()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def write(self, chunk: str):
+        if self._file is None:
+            self.start()
+        self._file.write(chunk)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def chunk_text(chunk) -> str:
+    """Text of a message chunk; some providers return a list of content parts."""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content or []:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and part.get("type") == "text":
+            parts.append(part.get("text", ""))
+    return "".join(parts)
+
+
+class _StreamCollector:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.chunks = 0
+        self.usage_tokens = 0
+
+    def add(self, chunk) -> str:
+        text = chunk_text(chunk)
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.usage_tokens += int(usage.get("output_tokens", 0))
+        if text:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.chunks += 1
+        return text
+
+    def finish(self) -> StreamMetrics:
+        end = time.perf_counter()
+        first = self.first_token_at or end
+        output_tokens = self.usage_tokens or self.chunks
+        generation_time = end - first
+        return StreamMetrics(
+            time_to_first_token=first - self.start,
+            total_time=end - self.start,
+            output_tokens=output_tokens,
+            tokens_per_second=output_tokens / generation_time if generation_time > 0 else 0.0,
+        )
+
+
+def stream_text(
+    chunks: Iterator, on_finish: Callable[[StreamMetrics], None]
+) -> Iterator[str]:
+    """
+    Yield the text of each chunk of a chat model stream as it arrives.
+
+    Args:
+        chunks: Iterator returned by llm.stream(messages)
+        on_finish: Called with the StreamMetrics once the stream is exhausted
+    """
+    collector = _StreamCollector()
+    for chunk in chunks:
+        text = collector.add(chunk)
+        if text:
+            yield text
+    on_finish(collector.finish())
+
+
+async def astream_text(
+    chunks: AsyncIterator, on_finish: Callable[[StreamMetrics], None]
+) -> AsyncIterator[str]:
+    """Async version of stream_text for llm.astream(messages)."""
+    collector = _StreamCollector()
+    async for chunk in chunks:
+        text = collector.add(chunk)
+        if text:
+            yield text
+    on_finish(collector.finish())
+
+
+class JsonArrayItemParser:
+    """
+    Incrementally parses the objects of a streamed JSON array.
+
+    Text before the opening bracket (e.g. a markdown code fence) is ignored.
+    Each object is returned by feed() as soon as its closing brace arrives,
+    so the caller can act on it while the rest of the array is generated.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.started = False
+        self.finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start: Optional[int] = None
+        self._pos = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Add streamed text.
+
+        Args:
+            chunk: Next piece of the generation
+
+        Returns:
+            Objects of the array completed by this chunk
+
+        Raises:
+            ValueError: If a completed object is not valid JSON
+        """
+        self.text += chunk
+        items = []
+        text = self.text
+        while self._pos < len(text) and not self.finished:
+            char = text[self._pos]
+            self._pos += 1
+            if not self.started:
+                self.started = char == "["
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._item_start = self._pos - 1
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self.finished = char == "]"
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(json.loads(text[self._item_start:self._pos]))
+                    self._item_start = None
+        return items
+
+
+def collect_stream(
+    chunks: Iterator, on_chunk: Optional[Callable[[str], None]] = None
+) -> Tuple[str, StreamMetrics]:
+    """
+    Consume a chat model stream.
+
+    Args:
+        chunks: Iterator returned by llm.stream(messages)
+        on_chunk: Called with the text of each chunk as it arrives
+
+    Returns:
+        Tuple of the full text and its StreamMetrics
+    """
+    metrics = []
+    parts = []
+    for text in stream_text(chunks, metrics.append):
+        parts.append(text)
+        if on_chunk is not None:
+            on_chunk(text)
+    return "".join(parts), metrics[0]
+
+
+async def acollect_stream(
+    chunks: AsyncIterator, on_chunk: Optional[Callable[[str], None]] = None
+) -> Tuple[str, StreamMetrics]:
+    """Async version of collect_stream for llm.astream(messages)."""
+    metrics = []
+    parts = []
+    async for text in astream_text(chunks, metrics.append):
+        parts.append(text)
+        if on_chunk is not None:
+            on_chunk(text)
+    return "".join(parts), metrics[0]
+
+
+def log_stream_metrics(name: str, metrics: StreamMetrics):
+    logging.info(
+        f"{name}: first token after {metrics.time_to_first_token:.2f}s, "
+        f"{metrics.output_tokens} tokens in {metrics.total_time:.2f}s "
+        f"({metrics.tokens_per_second:.1f} tokens/s)"
+    )
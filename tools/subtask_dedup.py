@@ -0,0 +1,298 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import mmh3
+except ImportError:
+    mmh3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+# Result fields that describe one execution and are not shared with a duplicate
+_EXECUTION_FIELDS = ("usage", "stream_metrics", "dependency_context")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _exact_key(*parts: str) -> str:
+    data = "\x00".join(parts).encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def dependency_fingerprint(dependency_results: Dict[str, Any]) -> str:
+    """
+    Hash of the dependency results a subtask's context is built from.
+
+    The role's system prompt is left out on purpose: it is generated anew for
+    every top-level task, so the same role never has the same wording twice.
+
+    Args:
+        dependency_results: Dependency id to {"description", "result"}
+    """
+    return _exact_key(
+        json.dumps(dependency_results, sort_keys=True, ensure_ascii=False, default=str)
+    )
+
+
+def _hash(shingle: str, seed: int) -> int:
+    if mmh3 is not None:
+        return mmh3.hash(shingle, seed, signed=False)
+    digest = hashlib.blake2b(
+        shingle.encode("utf-8"), digest_size=4, salt=seed.to_bytes(16, "little")
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def minhash(text: str, num_perm: int = 64, shingle_size: int = 3) -> Tuple[int, ...]:
+    """
+    MinHash signature of the character shingles of a text.
+
+    Character shingles work for Chinese as well as English descriptions.
+    The share of equal positions of two signatures estimates the Jaccard
+    similarity of their shingle sets.
+    """
+    if len(text) <= shingle_size:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+    return tuple(min(_hash(shingle, seed) for shingle in shingles) for seed in range(num_perm))
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class _Entry:
+    def __init__(
+            self,
+            scope: Optional[str],
+            task_id: str,
+            group: str,
+            key: str,
+            signature: Tuple[int, ...],
+    ):
+        self.scope = scope
+        self.task_id = task_id
+        # Role name and dependency results; only entries of one group are compared
+        self.group = group
+        self.key = key
+        self.signature = signature
+        # LLM calls of the execution, saved by every duplicate
+        self.calls = 0
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+class DedupClaim:
+    """Outcome of SubtaskDeduplicator.claim for one subtask."""
+
+    def __init__(self, entry: _Entry, owner: bool, similarity: float = 1.0):
+        self.entry = entry
+        # True: execute the subtask and resolve the claim; False: wait for entry.future
+        self.owner = owner
+        self.similarity = similarity
+
+    @property
+    def future(self) -> concurrent.futures.Future:
+        return self.entry.future
+
+
+class SubtaskDeduplicator:
+    """
+    Runs a subtask once when top-level tasks plan (near-)identical ones.
+
+    Each subtask is indexed by its role name, the results of its dependencies
+    (see dependency_fingerprint) and its description when it starts. A later
+    subtask of another top-level task with the same role name and dependency
+    results and a description whose MinHash similarity reaches the threshold
+    waits for that execution instead of its own, whether it is still running
+    or already done, and receives a copy of the result. If the first
+    execution fails, the duplicates run themselves.
+    """
+
+    def __init__(
+            self,
+            threshold: Optional[float] = None,
+            num_perm: int = 64,
+            shingle_size: int = 3,
+    ):
+        """
+        Args:
+            threshold: Minimum estimated Jaccard similarity of two descriptions
+                       to share one execution; SUBTASK_DEDUP_THRESHOLD by
+                       default (0.9). 1.0 only merges identical descriptions
+            num_perm: MinHash signature length
+            shingle_size: Characters per shingle
+        """
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else float(os.getenv("SUBTASK_DEDUP_THRESHOLD", "0.9"))
+        )
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._exact: Dict[str, _Entry] = {}
+        self._by_group: Dict[str, List[_Entry]] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.saved_calls = 0
+
+    def _find(
+            self, scope: Optional[str], group: str, key: str, signature: Tuple[int, ...]
+    ) -> Tuple[Optional[_Entry], float]:
+        entry = self._exact.get(key)
+        if entry is not None and entry.scope != scope:
+            return entry, 1.0
+        if self.threshold >= 1.0:
+            return None, 0.0
+        best, best_similarity = None, 0.0
+        for candidate in self._by_group.get(group, []):
+            if candidate.scope == scope:
+                continue
+            candidate_similarity = similarity(signature, candidate.signature)
+            if candidate_similarity > best_similarity:
+                best, best_similarity = candidate, candidate_similarity
+        if best_similarity >= self.threshold:
+            return best, best_similarity
+        return None, 0.0
+
+    def claim(
+            self,
+            scope: Optional[str],
+            task_id: str,
+            role_name: str,
+            description: str,
+            context: str = "",
+    ) -> DedupClaim:
+        """
+        Look up a subtask before executing it.
+
+        Subtasks of the same scope (top-level task) are never merged: a plan
+        listing two similar steps means them to run separately.
+
+        Args:
+            scope: Id of the top-level task the subtask belongs to
+            task_id: Id of the subtask
+            role_name: Role executing it
+            description: Its description
+            context: dependency_fingerprint of the subtask; subtasks whose
+                     dependencies produced different results are never merged
+
+        Returns:
+            DedupClaim; the owner must call resolve once the subtask is done
+        """
+        group = _exact_key(_normalize(role_name), context)
+        text = _normalize(description)
+        key = _exact_key(group, text)
+        signature = minhash(text, self.num_perm, self.shingle_size)
+        with self._lock:
+            entry, entry_similarity = self._find(scope, group, key, signature)
+            if entry is not None:
+                if entry_similarity >= 1.0:
+                    self.exact_hits += 1
+                else:
+                    self.near_hits += 1
+                return DedupClaim(entry, owner=False, similarity=entry_similarity)
+
+            entry = _Entry(scope, task_id, group, key, signature)
+            self._exact.setdefault(key, entry)
+            self._by_group.setdefault(group, []).append(entry)
+            return DedupClaim(entry, owner=True)
+
+    def resolve(self, claim: DedupClaim, result: Optional[Dict[str, Any]], calls: int = 0):
+        """
+        Publish the result of an owned claim.
+
+        Args:
+            claim: Claim returned with owner=True
+            result: Completed result, or None if the subtask failed; later
+                    duplicates then execute on their own
+            calls: LLM calls the execution made
+        """
+        claim.entry.calls = calls
+        if result is None or result.get("status") != "completed":
+            result = None
+            entry = claim.entry
+            with self._lock:
+                if self._exact.get(entry.key) is entry:
+                    del self._exact[entry.key]
+                self._by_group[entry.group].remove(entry)
+        claim.future.set_result(result)
+
+    def share(
+            self, claim: DedupClaim, shared: Dict[str, Any], task: Any, role_prompt: str
+    ) -> Dict[str, Any]:
+        """
+        Result of a duplicate subtask, copied from the execution it waited for.
+
+        Args:
+            claim: Claim returned with owner=False
+            shared: Result of the owner
+            task: The duplicate TaskDefinition
+            role_prompt: System prompt of the duplicate's role
+
+        Returns:
+            Result dict for the duplicate
+        """
+        calls = claim.entry.calls
+        with self._lock:
+            self.saved_calls += calls
+        result = {key: value for key, value in shared.items() if key not in _EXECUTION_FIELDS}
+        result.update(
+            {
+                "task_id": task.id,
+                "description": task.description,
+                "role_name": task.role_name,
+                "role_sys_prompt": role_prompt,
+                "dependsOn": task.dependsOn,
+                "deduplicated_from": {
+                    "task_id": claim.entry.scope,
+                    "subtask_id": claim.entry.task_id,
+                    "similarity": round(claim.similarity, 3),
+                },
+            }
+        )
+        logger.info(
+            f"Subtask {task.id} reuses subtask {claim.entry.task_id} of task "
+            f"{claim.entry.scope} (similarity {claim.similarity:.2f}), {calls} calls saved"
+        )
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "exact": self.exact_hits,
+                "near": self.near_hits,
+                "saved_calls": self.saved_calls,
+            }
+
+
+def is_dedup_enabled() -> bool:
+    """Share executions of duplicate subtasks (off unless SUBTASK_DEDUP=1)."""
+    return os.getenv("SUBTASK_DEDUP", "0") == "1"
+
+
+def log_dedup_stats(dedup: Optional[SubtaskDeduplicator]):
+    if dedup is None:
+        return
+    stats = dedup.stats()
+    if stats["exact"] or stats["near"]:
+        logger.info(
+            f"Subtask dedup: {stats['exact']} exact and {stats['near']} near duplicates, "
+            f"{stats['saved_calls']} LLM calls saved"
+        )
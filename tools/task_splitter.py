@@ -1,14 +1,17 @@
-from typing import List, Dict, Any, Optional
+import threading
+from typing import AsyncIterator, Iterator, List, Dict, Any, Optional, Set
 from pydantic import BaseModel, Field
-from langchain.output_parsers import PydanticOutputParser
-from tools.llm_generatory import get_llm_model
-import logging
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
+from tools.llm_cache import is_cache_bypassed, is_cache_enabled
+from tools.json_repair import aparse_llm_json, parse_llm_json
+from tools.retry_policy import (
+    InvalidOutputError,
+    StageAttempts,
+    acall_with_retries,
+    call_with_retries,
 )
-from langchain_core.output_parsers import JsonOutputParser
+from tools.streaming import JsonArrayItemParser, chunk_text
+import logging
+from tools.prompt_registry import get_chat_prompt
 
 
 class TaskItem(BaseModel):
@@ -32,13 +35,79 @@ class TokenUsage(BaseModel):
     total_tokens: int = Field(default=0, description="Total tokens used")
 
 
+class _SplitStream:
+    """Subtasks of one streamed split attempt, parsed as their objects complete."""
+
+    def __init__(self, splitter: "TaskSplitter"):
+        self.splitter = splitter
+        self.parser = JsonArrayItemParser()
+
+    def feed(self, chunk) -> List[TaskItem]:
+        self.splitter._add_usage(getattr(chunk, "usage_metadata", None))
+        text = chunk_text(chunk)
+        while True:
+            try:
+                return [TaskItem.model_validate(item) for item in self.parser.feed(text)]
+            except ValueError as e:
+                # The parser has moved past the object; it is read again from
+                # the complete text by json_repair once the stream ends
+                logging.warning(f"Streamed task item did not parse, read again at the end: {e}")
+                text = ""
+
+    def check_complete(self):
+        if self.parser.started and not self.parser.finished:
+            raise InvalidOutputError("Task list stream ended before the array was closed")
+
+
 class TaskSplitter:
     """Splits a high-level task into detailed subtasks using LLM"""
 
     def __init__(self, prompt_map: Dict[str, str]):
         self.prompt_map = prompt_map
-        self.output_parser = JsonOutputParser()
         self.token_usage = TokenUsage()
+        self._usage_lock = threading.Lock()
+
+    def _build_messages(self, task: str):
+        chat_prompt = get_chat_prompt(
+            self.prompt_map, "task_split", "{task}", system_is_template=True
+        )
+
+        return chat_prompt.format_messages(task=task)
+
+    def _add_usage(self, usage: Optional[Dict[str, int]]):
+        if not usage:
+            return
+        with self._usage_lock:
+            self.token_usage.input_tokens += usage.get("input_tokens", 0)
+            self.token_usage.output_tokens += usage.get("output_tokens", 0)
+            self.token_usage.total_tokens += usage.get("total_tokens", 0)
+
+    @staticmethod
+    def _parse_items(response, llm) -> List[TaskItem]:
+        """Subtasks of a response or of the complete text of a stream."""
+        parsed = parse_llm_json(response, "task_split", llm)
+        return [TaskItem.model_validate(item) for item in parsed]
+
+    @staticmethod
+    async def _aparse_items(response, llm) -> List[TaskItem]:
+        parsed = await aparse_llm_json(response, "task_split", llm)
+        return [TaskItem.model_validate(item) for item in parsed]
+
+    def _parse_response(self, response, llm) -> List[TaskItem]:
+        self._add_usage(response.usage_metadata)
+        return self._parse_items(response, llm)
+
+    async def _aparse_response(self, response, llm) -> List[TaskItem]:
+        self._add_usage(response.usage_metadata)
+        return await self._aparse_items(response, llm)
+
+    def _stream_cached(self) -> bool:
+        # 流式请求不经过响应缓存；启用缓存时使用普通请求，命中时无需等待生成
+        return is_cache_enabled() and not is_cache_bypassed("task_split")
+
+    @staticmethod
+    def _remaining(items: List[TaskItem], dispatched: Set[str]) -> List[TaskItem]:
+        return [item for item in items if item.id not in dispatched]
 
     def split_task(self, task: str) -> List[TaskItem]:
         """
@@ -50,41 +119,117 @@ class TaskSplitter:
         Returns:
             A list of structured task dictionaries.
         """
-        llm = get_llm_model()
-        system_prompt_str = self.prompt_map.get("task_split", "")
-
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [
-                SystemMessagePromptTemplate.from_template(system_prompt_str),
-                HumanMessagePromptTemplate.from_template("{task}"),
-            ]
+        messages = self._build_messages(task)
+        return call_with_retries(
+            "task_split", lambda llm: llm.invoke(messages), self._parse_response, default=[]
+        )
+
+    async def asplit_task(self, task: str) -> List[TaskItem]:
+        """
+        Async version of split_task, using ainvoke.
+
+        Args:
+            task: High-level task description.
+
+        Returns:
+            A list of structured task dictionaries.
+        """
+        messages = self._build_messages(task)
+        return await acall_with_retries(
+            "task_split", lambda llm: llm.ainvoke(messages), self._aparse_response, default=[]
         )
 
-        messages = chat_prompt.format_messages(task=task)
+    def stream_split_task(self, task: str) -> Iterator[TaskItem]:
+        """
+        Splits a task like split_task, yielding each subtask as soon as its
+        JSON object has been generated.
+
+        The complete text goes through the json_repair pipeline at the end,
+        which yields the subtasks the incremental parser could not read. A
+        failed attempt is retried while no subtask has been yielded; after
+        that the task is split again with split_task and only the subtasks
+        whose ids were not yielded yet are added.
+
+        Args:
+            task: High-level task description.
+
+        Yields:
+            TaskItem objects in the order the model generates them.
+        """
+        if self._stream_cached():
+            yield from self.split_task(task)
+            return
+
+        messages = self._build_messages(task)
+        attempts = StageAttempts("task_split")
+        dispatched: Set[str] = set()
+
+        while True:
+            stream = _SplitStream(self)
+            try:
+                for chunk in attempts.llm.stream(messages):
+                    for item in stream.feed(chunk):
+                        dispatched.add(item.id)
+                        yield item
+                stream.check_complete()
+                items = self._parse_items(stream.parser.text, attempts.llm)
+                for item in self._remaining(items, dispatched):
+                    dispatched.add(item.id)
+                    yield item
+                return
+            except Exception as e:
+                if dispatched:
+                    logging.error(
+                        f"Task split stream failed after {len(dispatched)} items, "
+                        f"splitting again for the rest: {e}"
+                    )
+                    yield from self._remaining(self.split_task(task), dispatched)
+                    return
+                if not attempts.retry(e):
+                    logging.error(f"Raw Response: {stream.parser.text}")
+                    return
+
+    async def astream_split_task(self, task: str) -> AsyncIterator[TaskItem]:
+        """
+        Async version of stream_split_task, using astream.
+
+        Args:
+            task: High-level task description.
+
+        Yields:
+            TaskItem objects in the order the model generates them.
+        """
+        if self._stream_cached():
+            for item in await self.asplit_task(task):
+                yield item
+            return
 
-        max_retries = 3
-        retry_count = 0
+        messages = self._build_messages(task)
+        attempts = StageAttempts("task_split")
+        dispatched: Set[str] = set()
 
-        while retry_count < max_retries:
+        while True:
+            stream = _SplitStream(self)
             try:
-                response = llm(messages)
-                c = response.usage_metadata
-                self.token_usage.input_tokens += c["input_tokens"]
-                self.token_usage.output_tokens += c["output_tokens"]
-                self.token_usage.total_tokens += c["total_tokens"]
-                parsed = self.output_parser.invoke(response)
-                task_items = [TaskItem(**item) for item in parsed]
-                return task_items
+                async for chunk in attempts.llm.astream(messages):
+                    for item in stream.feed(chunk):
+                        dispatched.add(item.id)
+                        yield item
+                stream.check_complete()
+                items = await self._aparse_items(stream.parser.text, attempts.llm)
+                for item in self._remaining(items, dispatched):
+                    dispatched.add(item.id)
+                    yield item
+                return
             except Exception as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    logging.warning(f"Attempt {retry_count} failed: {e}. Retrying...")
-                else:
+                if dispatched:
                     logging.error(
-                        f"Failed to parse LLM response after {max_retries} attempts: {e}"
+                        f"Task split stream failed after {len(dispatched)} items, "
+                        f"splitting again for the rest: {e}"
                     )
-                    if "response" in locals():
-                        logging.error(
-                            f"Raw Response: {getattr(response, 'content', str(response))}"
-                        )
-                    return []
+                    for item in self._remaining(await self.asplit_task(task), dispatched):
+                        yield item
+                    return
+                if not await attempts.aretry(e):
+                    logging.error(f"Raw Response: {stream.parser.text}")
+                    return
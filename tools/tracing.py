@@ -0,0 +1,282 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+)
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from tools.llm_cache import is_cache_hit
+from tools.metrics import _get_usage, key_label
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SpanExporter,
+        SpanExportResult,
+    )
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    trace = None
+    SpanExporter = object
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "loop-agent"
+
+_provider = None
+_lock = threading.Lock()
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends every finished span as one JSON line to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence["ReadableSpan"]) -> "SpanExportResult":
+        try:
+            lines = [span.to_json(indent=None) for span in spans]
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write spans to {self.path}: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def configure_tracing(export: Optional[str] = None) -> bool:
+    """
+    Install a tracer provider exporting spans locally.
+
+    Args:
+        export: "console", or the path of a JSON lines file; defaults to
+                TRACE_EXPORT. Tracing stays off when empty.
+
+    Returns:
+        True if tracing is enabled
+    """
+    global _provider
+    export = export if export is not None else os.getenv("TRACE_EXPORT", "")
+    if not export:
+        return _provider is not None
+    if trace is None:
+        logger.warning("opentelemetry-sdk is not installed, tracing disabled")
+        return False
+
+    with _lock:
+        if _provider is not None:
+            return True
+        exporter = ConsoleSpanExporter() if export == "console" else JsonLinesSpanExporter(export)
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _provider = provider
+    logger.info(f"Tracing enabled, exporting spans to {export}")
+    return True
+
+
+def is_tracing_enabled() -> bool:
+    return _provider is not None
+
+
+def flush_tracing():
+    """Export the spans still buffered (call at the end of a run)."""
+    if _provider is not None:
+        _provider.force_flush()
+
+
+def _attribute(value: Any) -> Any:
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return str(value)
+
+
+@contextmanager
+def start_span(name: str, **attributes: Any):
+    """
+    Span around a block, child of the current span; a no-op when tracing is off.
+
+    Exceptions leaving the block are recorded on the span.
+
+    Yields:
+        The span (None when tracing is off)
+    """
+    if _provider is None:
+        yield None
+        return
+    tracer = trace.get_tracer(SERVICE_NAME)
+    with tracer.start_as_current_span(
+        name, attributes={k: _attribute(v) for k, v in attributes.items() if v is not None}
+    ) as span:
+        yield span
+
+
+def set_span_attributes(span, prefix: str, values: Dict[str, Any]):
+    """Set `prefix.key` attributes (e.g. usage totals) on a span from start_span."""
+    if span is None:
+        return
+    for key, value in values.items():
+        span.set_attribute(f"{prefix}.{key}", _attribute(value))
+
+
+def mark_span_failed(span, error: str):
+    """Set the error status on a span whose block handled the failure itself."""
+    if span is not None:
+        span.set_status(Status(StatusCode.ERROR, error))
+
+
+def _start_detached(name: str, attributes: Dict[str, Any]):
+    return trace.get_tracer(SERVICE_NAME).start_span(
+        name, attributes={k: _attribute(v) for k, v in attributes.items() if v is not None}
+    )
+
+
+def trace_iterable(name: str, iterable: Iterable[Any], **attributes: Any) -> Iterator[Any]:
+    """
+    One span covering the consumption of an iterable (e.g. a streamed split).
+
+    Each item is produced with the span current, so calls made by the
+    producer become its children; `items` is set when it is exhausted.
+    """
+    if _provider is None:
+        yield from iterable
+        return
+    span = _start_detached(name, attributes)
+    iterator = iter(iterable)
+    count = 0
+    try:
+        while True:
+            with trace.use_span(span, end_on_exit=False):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+            count += 1
+            yield item
+    finally:
+        span.set_attribute("items", count)
+        span.end()
+
+
+async def atrace_iterable(
+        name: str, iterable: AsyncIterable[Any], **attributes: Any
+) -> AsyncIterator[Any]:
+    """Async version of trace_iterable."""
+    if _provider is None:
+        async for item in iterable:
+            yield item
+        return
+    span = _start_detached(name, attributes)
+    iterator = iterable.__aiter__()
+    count = 0
+    try:
+        while True:
+            with trace.use_span(span, end_on_exit=False):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            count += 1
+            yield item
+    finally:
+        span.set_attribute("items", count)
+        span.end()
+
+
+class TracingCallback(BaseCallbackHandler):
+    """
+    One span per LLM request of a stage, child of the span active at the call.
+
+    Does nothing until tracing is configured, so pooled clients created
+    before configure_tracing still report their requests. Retries of a stage
+    show up as sibling spans with an increasing llm.attempt under the same
+    parent.
+    """
+
+    run_inline = True
+
+    def __init__(self, stage: str, api_key: str, model: str):
+        self.stage = stage
+        self.key = key_label(api_key)
+        self.model = model
+        self._spans: Dict[UUID, Any] = {}
+        # Requests per (parent span, stage), most recent parents only
+        self._attempts: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _attempt(self, parent_span_id: int) -> int:
+        with self._lock:
+            attempt = self._attempts.pop(parent_span_id, 0) + 1
+            self._attempts[parent_span_id] = attempt
+            if len(self._attempts) > 10000:
+                self._attempts.popitem(last=False)
+            return attempt
+
+    def _start(self, run_id: UUID):
+        if _provider is None:
+            return
+        parent = trace.get_current_span()
+        parent_span_id = parent.get_span_context().span_id
+        span = trace.get_tracer(SERVICE_NAME).start_span(
+            f"llm {self.stage}",
+            context=otel_context.get_current(),
+            attributes={
+                "llm.stage": self.stage,
+                "llm.model": self.model,
+                "llm.api_key": self.key,
+                "llm.attempt": self._attempt(parent_span_id) if parent_span_id else 1,
+            },
+        )
+        self._spans[run_id] = span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        if is_cache_hit(response):
+            span.set_attribute("llm.cache_hit", True)
+            span.end()
+            return
+        input_tokens, output_tokens = _get_usage(response)
+        span.set_attribute("llm.input_tokens", input_tokens)
+        span.set_attribute("llm.output_tokens", output_tokens)
+        span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+        span.end()